@@ -1,46 +1,154 @@
 from __future__ import annotations
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
 import os
 from datetime import datetime, timezone
-from fastapi import FastAPI, Response
-from pydantic import BaseModel
-from dateutil import parser as dtparser
-from zoneinfo import ZoneInfo
+from typing import Any, Dict, Optional
+from fastapi import FastAPI, Request, Response
 
-# Storage selection mirrors main.py
-USE_MONGO = os.getenv("USE_MONGO", "0") == "1" or bool(os.getenv("MONGODB_URI"))
-if USE_MONGO:
-    from storage_mongo import load_reminders, update_reminder_status
-else:
-    from storage import load_reminders, update_reminder_status
+import metrics
+from sharding import check_shard
 
-from telegram import Bot
+# Cold-start notes: only FastAPI is imported up front. telegram, the delivery
+# engine and the storage drivers load on the first request that needs them, and
+# the Bot (with its HTTP connection pool) is kept for every warm invocation
+# after that. Timings are reported in each response under "cold_start".
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
-DEFAULT_TZ = os.getenv("DEFAULT_TZ", "Asia/Ho_Chi_Minh")
+BATCH_LIMIT = int(os.getenv("CRON_BATCH_LIMIT", "500"))
+# Number of shards /fan-out splits each tick into, one invocation per shard
+SHARDS = int(os.getenv("CRON_SHARDS", "1"))
+
+_timings: Dict[str, float] = {}
+_bot: Any = None
+_bot_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+# Point the Bot at another Bot API server (e.g. the fake one in bench/)
+BOT_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+
+
+def get_bot() -> Any:
+    """The Bot shared by every invocation of this instance.
+
+    Built on first use, with one keep-alive connection per concurrent sender
+    (PTB's default pool has a single one), and rebuilt only when the event loop
+    changes, since its httpx client is bound to the loop it was created on.
+    """
+    global _bot, _bot_loop
+    loop = asyncio.get_running_loop()
+    if _bot is None or _bot_loop is not loop:
+        from delivery import CONCURRENCY
+        from telegram import Bot
+        from telegram.request import HTTPXRequest
+        started = time.perf_counter()
+        _bot = Bot(TELEGRAM_TOKEN, base_url=BOT_API_URL, request=HTTPXRequest(connection_pool_size=CONCURRENCY))
+        _bot_loop = loop
+        _timings.setdefault("bot_init_ms", round((time.perf_counter() - started) * 1000, 1))
+    return _bot
+
+
+def _cold_start() -> Dict[str, Any]:
+    from astorage import USE_MONGO
+    out: Dict[str, Any] = {**_timings, "warm": _timings.get("calls", 0) > 1}
+    if USE_MONGO:
+        from db import startup_stats
+        out["mongo_startup_ms"] = startup_stats()
+    return out
+
 
 app = FastAPI()
 
 
 @app.get("/process-due")
-async def process_due() -> dict:
+async def process_due(shard: int = 0, shards: int = 1) -> dict:
+    """Deliver due reminders, optionally only for chats in shard ``shard`` of ``shards``."""
     if not TELEGRAM_TOKEN:
         return {"ok": False, "error": "TELEGRAM_TOKEN not set"}
-    bot = Bot(TELEGRAM_TOKEN)
-    now_utc = datetime.now(timezone.utc)
-    count = 0
-    for r in load_reminders():
-        if r.get("status") != "scheduled":
-            continue
-        due_at = dtparser.isoparse(r["due_at"]) if isinstance(r.get("due_at"), str) else r.get("due_at")
-        if due_at is None:
-            continue
-        if due_at.tzinfo is None:
-            tz = r.get("timezone") or DEFAULT_TZ
-            due_at = due_at.replace(tzinfo=ZoneInfo(tz))
-        if due_at <= now_utc:
-            await bot.send_message(r["chat_id"], f"⏰ Reminder: {r['text']}")
-            update_reminder_status(r["id"], "done")
-            count += 1
-    return {"ok": True, "notified": count}
+    try:
+        part = check_shard(shard, shards)
+    except ValueError as e:
+        return {"ok": False, "error": str(e)}
+    first_call = "first_call_ms" not in _timings
+    _timings["calls"] = _timings.get("calls", 0) + 1
+    started = time.perf_counter()
+    from astorage import claim_due, renew_claimed
+    from delivery import LEASE_SECONDS, WORKER_ID, engine, settle_failed, settle_sent
+    bot = get_bot()
+    with metrics.cron_seconds.time():
+        now_utc = datetime.now(timezone.utc)
+        # Claiming first means an overlapping run never sees the same rows.
+        due = await claim_due(now_utc, BATCH_LIMIT, WORKER_ID, LEASE_SECONDS, shard=part)
+        metrics.queue_depth.set(len(due), queue="cron_claimed")
+        result = await engine.deliver(
+            bot, due,
+            mark_sent=lambda rows: settle_sent(rows, WORKER_ID),
+            renew=lambda ids: renew_claimed(ids, WORKER_ID, LEASE_SECONDS),
+        )
+        # Failures are retried with backoff on a later tick; blocked chats are parked
+        await settle_failed(result, due, WORKER_ID)
+    if first_call:
+        _timings["first_call_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return {
+        "ok": True, "notified": len(result.sent), "failed": len(result.failed), "blocked_chats": len(result.blocked),
+        "shard": f"{shard}/{shards}",
+        "cold_start": _cold_start(),
+    }
+
+
+@app.get("/archive")
+async def archive() -> dict:
+    """Daily: move done reminders past ARCHIVE_AFTER_DAYS out of the hot store."""
+    from retention import archive_old
+    return {"ok": True, "archived": await archive_old()}
+
+
+@app.get("/metrics")
+async def metrics_endpoint() -> Response:
+    # Counters are per warm instance; they reset when the function is recycled.
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/fan-out")
+async def fan_out(request: Request) -> dict:
+    """Coordinator for the Vercel cron: runs every shard as its own invocation.
+
+    Shards partition chats, so each chat is still served by one invocation and
+    its reminders stay in order.
+    """
+    if SHARDS == 1:
+        return await process_due()
+    import httpx
+    url = str(request.url).replace("/fan-out", "/process-due").split("?")[0]
+    async with httpx.AsyncClient(timeout=300) as client:
+        replies = await asyncio.gather(
+            *(client.get(url, params={"shard": i, "shards": SHARDS}) for i in range(SHARDS)),
+            return_exceptions=True,
+        )
+    runs = [r.json() if isinstance(r, httpx.Response) else {"ok": False, "error": repr(r)} for r in replies]
+    return {
+        "ok": all(r.get("ok") for r in runs),
+        "notified": sum(r.get("notified", 0) for r in runs),
+        "failed": sum(r.get("failed", 0) for r in runs),
+        "shards": runs,
+    }
+
+
+def _run_shard(shard: int, shards: int) -> dict:
+    return asyncio.run(process_due(shard, shards))
+
+
+_timings["import_ms"] = round((time.perf_counter() - _IMPORT_STARTED) * 1000, 1)
 
 
+if __name__ == "__main__":
+    # python -m api.cron [shards]  -> one pass over every shard, one process each
+    import sys
+    from concurrent.futures import ProcessPoolExecutor
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count() or 1
+    with ProcessPoolExecutor(n) as pool:
+        for out in pool.map(_run_shard, range(n), [n] * n):
+            print(out)
@@ -0,0 +1,63 @@
+from __future__ import annotations
+import asyncio
+import os
+import sys
+from typing import Optional
+from fastapi import FastAPI, Header, Request, Response
+
+from telegram import Update
+from telegram.ext import Application
+
+# Telegram webhook entry point. Any number of instances can serve it: the
+# /setreminder conversation and user_data live in storage (persistence.py),
+# and reminders are delivered by the cron rather than an in-process scheduler.
+
+WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+
+app = FastAPI()
+_application: Optional[Application] = None
+_application_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+async def _bot_app() -> Application:
+    # Built once per warm instance; initialize() costs a single getMe call.
+    # Rebuilt if the event loop changes: its Bot, HTTP pool and update
+    # processor locks are bound to the loop they were created on.
+    global _application, _application_loop
+    loop = asyncio.get_running_loop()
+    if _application is None or _application_loop is not loop:
+        from main import build_application
+        application = build_application()
+        await application.initialize()
+        _application, _application_loop = application, loop
+    return _application
+
+
+@app.post("/telegram")
+async def telegram_webhook(
+    request: Request,
+    x_telegram_bot_api_secret_token: Optional[str] = Header(None),
+) -> Response:
+    if WEBHOOK_SECRET and x_telegram_bot_api_secret_token != WEBHOOK_SECRET:
+        return Response(status_code=403)
+    application = await _bot_app()
+    update = Update.de_json(await request.json(), application.bot)
+    # Through the update processor, so concurrent requests for one chat run in order
+    await application.update_processor.process_update(update, application.process_update(update))
+    return Response(status_code=200)
+
+
+if __name__ == "__main__":
+    # python api/webhook.py set <https://host/api/webhook/telegram>
+    if len(sys.argv) != 3 or sys.argv[1] != "set":
+        print("usage: python api/webhook.py set <url>")
+        sys.exit(2)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from telegram import Bot
+
+    async def _set() -> None:
+        async with Bot(os.environ["TELEGRAM_TOKEN"]) as bot:
+            await bot.set_webhook(sys.argv[2], secret_token=WEBHOOK_SECRET)
+            print(await bot.get_webhook_info())
+
+    asyncio.run(_set())
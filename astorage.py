@@ -0,0 +1,74 @@
+from __future__ import annotations
+import asyncio
+import functools
+import os
+from typing import Any, Awaitable, Callable
+
+import metrics
+
+# Async storage interface for the bot and the cron. Mongo uses the native
+# asyncio driver (storage_mongo_async); the JSON backend runs its blocking
+# file I/O in a worker thread so the event loop keeps serving other chats.
+
+USE_MONGO = os.getenv("USE_MONGO", "0") == "1" or bool(os.getenv("MONGODB_URI"))
+
+__all__ = [
+    "USE_MONGO",
+    "add_reminder", "load_reminders", "save_reminders", "update_reminder_status",
+    "update_reminders_status", "delete_reminder", "fetch_due", "claim_due",
+    "claim_reminders", "finish_claimed", "reschedule_claimed", "list_reminders_for_chat",
+    "upsert_user_timezone", "get_user_timezone", "get_session", "set_session",
+    "list_archived_for_chat", "archive_done", "fail_claimed", "block_chat", "unblock_chat",
+    "add_habit", "list_habits", "check_in_habit", "delete_habit", "renew_claimed",
+]
+
+
+def _threaded(fn: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    return wrapper
+
+
+if USE_MONGO:
+    from storage_mongo_async import (
+        add_reminder, load_reminders, save_reminders, update_reminder_status,
+        update_reminders_status, delete_reminder, fetch_due, claim_due,
+        claim_reminders, finish_claimed, reschedule_claimed, list_reminders_for_chat,
+        upsert_user_timezone, get_user_timezone, get_session, set_session,
+        list_archived_for_chat, archive_done, fail_claimed, block_chat, unblock_chat,
+        add_habit, list_habits, check_in_habit, delete_habit, renew_claimed,
+    )
+else:
+    import storage as _storage
+
+    add_reminder = _threaded(_storage.add_reminder)
+    load_reminders = _threaded(_storage.load_reminders)
+    save_reminders = _threaded(_storage.save_reminders)
+    update_reminder_status = _threaded(_storage.update_reminder_status)
+    update_reminders_status = _threaded(_storage.update_reminders_status)
+    delete_reminder = _threaded(_storage.delete_reminder)
+    fetch_due = _threaded(_storage.fetch_due)
+    claim_due = _threaded(_storage.claim_due)
+    claim_reminders = _threaded(_storage.claim_reminders)
+    finish_claimed = _threaded(_storage.finish_claimed)
+    reschedule_claimed = _threaded(_storage.reschedule_claimed)
+    list_reminders_for_chat = _threaded(_storage.list_reminders_for_chat)
+    upsert_user_timezone = _threaded(_storage.upsert_user_timezone)
+    get_user_timezone = _threaded(_storage.get_user_timezone)
+    get_session = _threaded(_storage.get_session)
+    set_session = _threaded(_storage.set_session)
+    list_archived_for_chat = _threaded(_storage.list_archived_for_chat)
+    archive_done = _threaded(_storage.archive_done)
+    fail_claimed = _threaded(_storage.fail_claimed)
+    block_chat = _threaded(_storage.block_chat)
+    unblock_chat = _threaded(_storage.unblock_chat)
+    add_habit = _threaded(_storage.add_habit)
+    list_habits = _threaded(_storage.list_habits)
+    check_in_habit = _threaded(_storage.check_in_habit)
+    delete_habit = _threaded(_storage.delete_habit)
+    renew_claimed = _threaded(_storage.renew_claimed)
+
+# Every call is timed into gretchen_storage_seconds{op=...}
+for _name in __all__[1:]:
+    globals()[_name] = metrics.timed_storage(globals()[_name])
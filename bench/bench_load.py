@@ -0,0 +1,256 @@
+"""Load test for storage, listing, scheduling and the cron delivery path.
+
+    python bench/bench_load.py [--backend json,mongo] [--sizes 1000,100000]
+                               [--samples 200] [--rounds 5] [--out FILE] [--compare FILE]
+
+Each (backend, size) pair runs in its own subprocess against a freshly seeded
+synthetic population: ``size`` reminders spread over ``size // 10`` chats,
+10% recurring, 20% already done, and enough due right now for ``--rounds``
+cron runs. Telegram is replaced by the local fake in fake_telegram.py, so the
+real ``telegram.Bot`` and delivery engine are exercised without the network.
+The JSON backend writes to a temporary directory. The Mongo backend needs a
+disposable server (e.g. ``docker run -p 27017:27017 mongo``) given by
+``--mongo-uri`` or MONGODB_URI; the ``gretchen_bench`` database is dropped
+before each run.
+
+Per operation it reports p50/p99 latency, throughput and tracemalloc peak
+memory (taken from one extra, separately run sample). Results are saved as one
+JSON document under bench/results/; pass an earlier one to ``--compare`` to
+print the p99 change per operation and exit non-zero on regressions beyond
+``--tolerance``. Send rate limits are lifted unless TELEGRAM_*_RATE are set,
+so process_due measures our own overhead rather than the limiter.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS = Path(__file__).with_name("results")
+TZ = "Asia/Ho_Chi_Minh"
+BENCH_DB = "gretchen_bench"
+
+
+# ---- population ----
+def population(size: int, due_now: int, now: datetime, seed: int = 7) -> List[Any]:
+    from zoneinfo import ZoneInfo
+    from reminder import Reminder
+    rng = random.Random(seed)
+    chats = max(1, size // 10)
+    tz = ZoneInfo(TZ)
+    rows = []
+    for i in range(size):
+        if i < due_now:
+            due, status = now - timedelta(seconds=rng.uniform(0, 300)), "scheduled"
+        else:
+            due = now + timedelta(seconds=rng.uniform(60, 30 * 86400))
+            status = "done" if rng.random() < 0.2 else "scheduled"
+        chat_id = 10_000 + rng.randrange(chats)
+        recurrence = {"freq": "daily", "interval": 1, "at": due.astimezone(tz).strftime("%H:%M")} if rng.random() < 0.1 else None
+        rows.append(Reminder(
+            id=f"b{i:07x}", chat_id=chat_id, text=f"synthetic reminder {i}", due=due, timezone=TZ,
+            status=status, recurrence=recurrence, created_at=now, updated_at=now,
+        ))
+    return rows
+
+
+def seed(backend: str, rows: List[Any]) -> None:
+    chats = {r.chat_id for r in rows}
+    if backend == "json":
+        import storage
+        storage.save_reminders(rows)
+        storage.save_users({str(c): {"timezone": TZ} for c in chats})
+        return
+    import db
+    db.get_mongo_client().drop_database(BENCH_DB)
+    database = db.ready_db()
+    for i in range(0, len(rows), 10_000):
+        database.reminders.insert_many([r.to_doc(native=True) for r in rows[i:i + 10_000]], ordered=False)
+    database.users.insert_many([{"chatId": c, "timezone": TZ} for c in chats], ordered=False)
+
+
+# ---- measurement ----
+def _pct(sorted_ms: List[float], q: float) -> float:
+    return sorted_ms[min(len(sorted_ms) - 1, int(q * len(sorted_ms)))]
+
+
+async def measure(fn: Callable[[int], Awaitable[Any]], samples: int) -> Dict[str, Any]:
+    """Time ``samples`` calls, then one more under tracemalloc for peak memory."""
+    times: List[float] = []
+    items = 0
+    started = time.perf_counter()
+    for i in range(samples):
+        t0 = time.perf_counter()
+        n = await fn(i)
+        times.append((time.perf_counter() - t0) * 1000)
+        items += n if isinstance(n, int) else 1
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    await fn(samples)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    times.sort()
+    return {
+        "n": samples,
+        "p50_ms": round(_pct(times, 0.50), 3),
+        "p99_ms": round(_pct(times, 0.99), 3),
+        "ops_per_s": round(samples / elapsed, 1),
+        "items_per_s": round(items / elapsed, 1),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+async def run_child(backend: str, size: int, samples: int, rounds: int) -> Dict[str, Any]:
+    import api.cron as cron
+    import astorage
+    import main as bot
+    from reminder import Reminder
+    from scheduler import Scheduler
+    from fake_telegram import FakeTelegram
+
+    now = datetime.now(timezone.utc)
+    # One spare round for the tracemalloc pass
+    due_now = min(size // 2, (rounds + 1) * cron.BATCH_LIMIT)
+    rows = population(size, due_now, now)
+    t0 = time.perf_counter()
+    seed(backend, rows)
+    ops: Dict[str, Any] = {"seed": {"n": 1, "rows_per_s": round(size / (time.perf_counter() - t0), 1)}}
+    rng = random.Random(11)
+    chats = sorted({r.chat_id for r in rows})
+    del rows
+
+    async def add(i: int) -> None:
+        due = now + timedelta(days=1, seconds=i)
+        await astorage.add_reminder(Reminder(id=f"a{i:07x}", chat_id=rng.choice(chats), text="added", due=due, timezone=TZ))
+
+    async def list_page(i: int) -> None:
+        await bot._render_reminder_page(rng.choice(chats), "s", None)
+
+    async def window(i: int) -> int:
+        return len(await astorage.fetch_due(datetime.now(timezone.utc) + timedelta(hours=1), 500))
+
+    async def startup(i: int) -> int:
+        async def nothing(ids: List[str]) -> None:
+            return None
+        return await Scheduler(astorage.fetch_due, nothing).refill()
+
+    fake = await FakeTelegram().start()
+    cron.TELEGRAM_TOKEN = "1:bench"
+    cron.BOT_API_URL = fake.base_url
+
+    async def process_due(i: int) -> int:
+        return (await cron.process_due())["notified"]
+
+    try:
+        ops["add_reminder"] = await measure(add, samples)
+        ops["list_reminders"] = await measure(list_page, samples)
+        ops["fetch_window"] = await measure(window, samples)
+        ops["scheduler_startup"] = await measure(startup, max(1, samples // 20))
+        ops["process_due"] = await measure(process_due, rounds)
+    finally:
+        await fake.stop()
+    return {"backend": backend, "size": size, "ops": ops}
+
+
+# ---- driver ----
+def child_env(backend: str, tmp: str, mongo_uri: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("TELEGRAM_GLOBAL_RATE", "1000000")
+    env.setdefault("TELEGRAM_CHAT_RATE", "1000000")
+    env["TELEGRAM_TOKEN"] = "1:bench"
+    env["PYTHONPATH"] = os.pathsep.join([str(ROOT), str(Path(__file__).parent)])
+    if backend == "json":
+        env.pop("MONGODB_URI", None)
+        env["USE_MONGO"] = "0"
+        env["JSON_DATA_DIR"] = tmp
+    else:
+        env["MONGODB_URI"] = mongo_uri
+        env["MONGODB_DB"] = BENCH_DB
+    return env
+
+
+def compare(current: Dict[str, Any], baseline_path: Path, tolerance: float) -> bool:
+    baseline = json.loads(baseline_path.read_text())
+    old = {(r["backend"], r["size"]): r["ops"] for r in baseline["runs"]}
+    ok = True
+    for run in current["runs"]:
+        prev = old.get((run["backend"], run["size"]))
+        if prev is None:
+            continue
+        for op, stats in run["ops"].items():
+            if "p99_ms" not in stats or op not in prev:
+                continue
+            change = stats["p99_ms"] / prev[op]["p99_ms"] - 1 if prev[op]["p99_ms"] else 0.0
+            flag = "  REGRESSION" if change > tolerance else ""
+            ok &= not flag
+            print(f"{run['backend']:>5} {run['size']:>8} {op:<18} p99 {prev[op]['p99_ms']:>9.2f} -> {stats['p99_ms']:>9.2f} ms ({change:+.0%}){flag}")
+    return ok
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--backend", default="json", help="comma-separated: json,mongo")
+    ap.add_argument("--sizes", default="1000,100000")
+    ap.add_argument("--samples", type=int, default=200)
+    ap.add_argument("--rounds", type=int, default=5, help="process_due calls per run")
+    ap.add_argument("--mongo-uri", default=os.getenv("MONGODB_URI", "mongodb://127.0.0.1:27017"))
+    ap.add_argument("--out", type=Path)
+    ap.add_argument("--compare", type=Path)
+    ap.add_argument("--tolerance", type=float, default=0.15)
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        backend, size = args.child.split(":")
+        result = asyncio.run(run_child(backend, int(size), args.samples, args.rounds))
+        print(json.dumps(result))
+        return
+
+    runs = []
+    for backend in args.backend.split(","):
+        for size in (int(s) for s in args.sizes.split(",")):
+            with tempfile.TemporaryDirectory() as tmp:
+                proc = subprocess.run(
+                    [sys.executable, __file__, "--child", f"{backend}:{size}",
+                     "--samples", str(args.samples), "--rounds", str(args.rounds)],
+                    env=child_env(backend, tmp, args.mongo_uri), capture_output=True, text=True,
+                )
+            if proc.returncode != 0:
+                print(f"{backend} {size}: failed\n{proc.stderr.strip()}", file=sys.stderr)
+                continue
+            run = json.loads(proc.stdout.strip().splitlines()[-1])
+            runs.append(run)
+            for op, stats in run["ops"].items():
+                if "p50_ms" in stats:
+                    print(f"{backend:>5} {size:>8} {op:<18} p50 {stats['p50_ms']:>9.2f} ms  p99 {stats['p99_ms']:>9.2f} ms  "
+                          f"{stats['items_per_s']:>10,.0f}/s  peak {stats['peak_kib']:>9,.0f} KiB")
+                else:
+                    print(f"{backend:>5} {size:>8} {op:<18} {stats['rows_per_s']:>10,.0f} rows/s")
+
+    sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    result = {
+        "meta": {"git": sha, "python": platform.python_version(), "at": datetime.now(timezone.utc).isoformat(),
+                 "samples": args.samples, "rounds": args.rounds},
+        "runs": runs,
+    }
+    out = args.out or RESULTS / f"{datetime.now():%Y%m%d-%H%M%S}-{sha or 'nogit'}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=1))
+    print(f"saved {out}")
+    if args.compare and not compare(result, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
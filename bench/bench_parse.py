@@ -0,0 +1,75 @@
+"""Throughput and accuracy of timeparse.parse_when over bench/parse_corpus.tsv.
+
+    python bench/bench_parse.py [--rounds 200] [--json]
+
+Cold = first pass with an empty plan cache; warm = repeated passes, as in a
+running bot where the same phrasings recur.
+"""
+from __future__ import annotations
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import timeparse  # noqa: E402
+
+TZ = "Asia/Ho_Chi_Minh"
+REFERENCE_NOW = datetime(2025, 8, 26, 10, 0, tzinfo=ZoneInfo(TZ))
+CORPUS = Path(__file__).with_name("parse_corpus.tsv")
+
+
+def load_corpus():
+    rows = []
+    for line in CORPUS.read_text(encoding="utf-8").splitlines():
+        if not line.strip() or line.startswith("#"):
+            continue
+        text, expected = line.split("\t")
+        rows.append((text, None if expected == "-" else datetime.fromisoformat(expected)))
+    return rows
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=200)
+    ap.add_argument("--json", action="store_true", help="print one JSON object instead of a report")
+    args = ap.parse_args()
+    corpus = load_corpus()
+
+    misses = []
+    timeparse._plan.cache_clear()
+    started = time.perf_counter()
+    for text, expected in corpus:
+        got = timeparse.parse_when(text, TZ, REFERENCE_NOW)
+        got_dt = got.due_at if got else None
+        if got_dt != expected:
+            misses.append((text, expected, got_dt))
+    cold = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        for text, _expected in corpus:
+            timeparse.parse_when(text, TZ, REFERENCE_NOW)
+    warm = time.perf_counter() - started
+
+    result = {
+        "inputs": len(corpus),
+        "accuracy": round(1 - len(misses) / len(corpus), 4),
+        "cold_parses_per_s": round(len(corpus) / cold),
+        "warm_parses_per_s": round(len(corpus) * args.rounds / warm),
+        "misses": [[t, e.isoformat() if e else None, g.isoformat() if g else None] for t, e, g in misses],
+    }
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(f"inputs: {result['inputs']}  accuracy: {result['accuracy']:.1%}")
+    print(f"cold: {result['cold_parses_per_s']:,} parses/s  warm: {result['warm_parses_per_s']:,} parses/s")
+    for text, expected, got in result["misses"]:
+        print(f"  miss: {text!r} expected {expected} got {got}")
+
+
+if __name__ == "__main__":
+    main()
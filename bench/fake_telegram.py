@@ -0,0 +1,72 @@
+"""A local stand-in for the Telegram Bot API, for benchmarks.
+
+Serves ``getMe`` and ``sendMessage`` over plain HTTP/1.1 with keep-alive so a
+real ``telegram.Bot(token, base_url=server.base_url)`` can talk to it. Replies
+are built without validation; ``latency`` adds a fixed delay per call.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs
+
+
+class FakeTelegram:
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.sent = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.port = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def start(self) -> "FakeTelegram":
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def _result(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == "sendMessage":
+            self.sent += 1
+            return {
+                "message_id": self.sent,
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        return True
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                path = lines[0].split(" ")[1]
+                headers = {k.lower(): v.strip() for k, _, v in (l.partition(":") for l in lines[1:] if l)}
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                if headers.get("content-type", "").startswith("application/json"):
+                    params = json.loads(body or b"{}")
+                else:
+                    params = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                payload = json.dumps({"ok": True, "result": self._result(path.rsplit("/", 1)[-1], params)}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: " + str(len(payload)).encode() + b"\r\n\r\n" + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
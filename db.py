@@ -1,36 +1,218 @@
 from __future__ import annotations
+import asyncio
 import os
-from typing import Optional
-from pymongo import MongoClient, ASCENDING
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from pymongo import AsyncMongoClient, MongoClient, ASCENDING, IndexModel
 
 _client: Optional[MongoClient] = None
+_async_client: Optional[AsyncMongoClient] = None
+_async_loop: Optional[asyncio.AbstractEventLoop] = None
+_indexes_ready = False
+_async_indexes_ready = False
+_lock = threading.RLock()
+
+# Millisecond timings of the one-off setup steps, for cold-start diagnostics
+_stats: Dict[str, float] = {}
+
+# Set MONGODB_AUTO_INDEX=0 where indexes are managed by `python db.py migrate`
+# (e.g. on Vercel), so no request ever pays for create_index round trips.
+AUTO_INDEX = os.getenv("MONGODB_AUTO_INDEX", "1") == "1"
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(7 * 86400)))
+# Archived reminders expire this many days after archiving; 0 keeps them forever
+ARCHIVE_TTL_DAYS = int(os.getenv("ARCHIVE_TTL_DAYS", "0"))
+
+
+def _client_options() -> Dict[str, Any]:
+    return dict(
+        tz_aware=True,
+        appname="gretchen",
+        serverSelectionTimeoutMS=int(os.getenv("MONGODB_SERVER_SELECTION_MS", "3000")),
+        connectTimeoutMS=int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "3000")),
+        # Serverless instances each hold their own pool: keep it small and
+        # let idle sockets go rather than pinning Atlas connections.
+        maxPoolSize=int(os.getenv("MONGODB_MAX_POOL_SIZE", "10")),
+        minPoolSize=0,
+        maxIdleTimeMS=int(os.getenv("MONGODB_MAX_IDLE_MS", "60000")),
+        retryWrites=True,
+        retryReads=True,
+    )
+
+
+def _uri() -> str:
+    uri = os.getenv("MONGODB_URI")
+    if not uri:
+        raise RuntimeError("MONGODB_URI not set")
+    return uri
 
 
 def get_mongo_client() -> MongoClient:
+    """Process-wide client, kept across warm serverless invocations.
+
+    Construction does no network I/O; the pool connects lazily on first use.
+    Call ``connect()`` to verify the deployment up front.
+    """
     global _client
     if _client is not None:
         return _client
-    uri = os.getenv("MONGODB_URI")
-    if not uri:
-        raise RuntimeError("MONGODB_URI not set")
-    _client = MongoClient(uri, serverSelectionTimeoutMS=5000)
-    # Trigger early server selection to fail fast if invalid
-    _client.admin.command("ping")
+    with _lock:
+        if _client is not None:
+            return _client
+        started = time.perf_counter()
+        _client = MongoClient(_uri(), **_client_options())
+        _stats["client_init_ms"] = (time.perf_counter() - started) * 1000
     return _client
 
 
+def get_async_client() -> AsyncMongoClient:
+    """Asyncio counterpart of ``get_mongo_client``, used by storage_mongo_async.
+
+    The client is tied to one event loop; it is rebuilt if a host runs each
+    invocation on a fresh loop.
+    """
+    global _async_client, _async_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_loop is not loop:
+        _async_loop = loop
+        started = time.perf_counter()
+        _async_client = AsyncMongoClient(_uri(), **_client_options())
+        _stats["async_client_init_ms"] = (time.perf_counter() - started) * 1000
+    return _async_client
+
+
+def connect() -> None:
+    """Ping the deployment, raising quickly if it is unreachable."""
+    started = time.perf_counter()
+    get_mongo_client().admin.command("ping")
+    _stats["ping_ms"] = (time.perf_counter() - started) * 1000
+
+
+def _db_name() -> str:
+    return os.getenv("MONGODB_DB", "gretchen")
+
+
+async def connect_async() -> None:
+    started = time.perf_counter()
+    await get_async_client().admin.command("ping")
+    _stats["ping_ms"] = (time.perf_counter() - started) * 1000
+
+
 def get_db():
-    name = os.getenv("MONGODB_DB", "gretchen")
-    return get_mongo_client()[name]
+    return get_mongo_client()[_db_name()]
 
 
-def ensure_indexes() -> None:
-    db = get_db()
+def get_async_db():
+    return get_async_client()[_db_name()]
+
+
+def _index_models() -> Dict[str, List[IndexModel]]:
     # Users: unique chatId
-    db.users.create_index([("chatId", ASCENDING)], unique=True)
+    models = {"users": [IndexModel([("chatId", ASCENDING)], unique=True)]}
+    # Sessions: bot conversation state and user_data, dropped once abandoned
+    models["sessions"] = [
+        IndexModel([("key", ASCENDING)], unique=True),
+        IndexModel([("updatedAt", ASCENDING)], expireAfterSeconds=SESSION_TTL_SECONDS),
+    ]
     # Reminders / Tasks / Habits / Events: id unique per chat, and nextRunAt/status for scanning
     for col in ("reminders", "tasks", "habits", "events"):
-        db[col].create_index([("chatId", ASCENDING), ("id", ASCENDING)], unique=True)
-        db[col].create_index([("status", ASCENDING), ("nextRunAt", ASCENDING)])
+        models[col] = [
+            IndexModel([("chat_id", ASCENDING), ("id", ASCENDING)], unique=True),
+            # shard last so sharded claims filter on index keys alone
+            IndexModel([("status", ASCENDING), ("nextRunAt", ASCENDING), ("shard", ASCENDING)]),
+            IndexModel([("status", ASCENDING), ("leaseUntil", ASCENDING)]),
+            IndexModel([("claimId", ASCENDING)], sparse=True),
+            # Per-chat listing, paged by (nextRunAt, id)
+            IndexModel([("chat_id", ASCENDING), ("status", ASCENDING), ("nextRunAt", ASCENDING), ("id", ASCENDING)]),
+        ]
+    # One check-in per habit and day; the habit's summary lives in habits
+    models["habit_checkins"] = [IndexModel([("habit_id", ASCENDING), ("day", ASCENDING)], unique=True)]
+    models["reminders_archive"] = [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("chat_id", ASCENDING), ("nextRunAt", ASCENDING), ("id", ASCENDING)]),
+    ]
+    if ARCHIVE_TTL_DAYS > 0:
+        models["reminders_archive"].append(
+            IndexModel([("archivedAt", ASCENDING)], expireAfterSeconds=ARCHIVE_TTL_DAYS * 86400)
+        )
+    return models
+
+
+def ensure_indexes() -> None:
+    db = get_db()
+    started = time.perf_counter()
+    for col, models in _index_models().items():
+        db[col].create_indexes(models)
+    _stats["ensure_indexes_ms"] = (time.perf_counter() - started) * 1000
+
+
+async def ensure_indexes_async() -> None:
+    db = get_async_db()
+    started = time.perf_counter()
+    for col, models in _index_models().items():
+        await db[col].create_indexes(models)
+    _stats["ensure_indexes_ms"] = (time.perf_counter() - started) * 1000
+
+
+def _report_backfill(counts: Dict[str, int], started: float) -> None:
+    _stats["backfill_ms"] = (time.perf_counter() - started) * 1000
+    for field, n in counts.items():
+        if n:
+            print(f"[db] backfilled {field} on {n} legacy reminders", file=sys.stderr)
+
+
+def backfill() -> Dict[str, int]:
+    """Fill in fields that due queries rely on but older reminders lack."""
+    from storage_mongo import backfill_next_run_at, backfill_shards
+    started = time.perf_counter()
+    counts = {"nextRunAt": backfill_next_run_at(), "shard": backfill_shards()}
+    _report_backfill(counts, started)
+    return counts
+
+
+async def backfill_async() -> Dict[str, int]:
+    from storage_mongo_async import backfill_next_run_at, backfill_shards
+    started = time.perf_counter()
+    counts = {"nextRunAt": await backfill_next_run_at(), "shard": await backfill_shards()}
+    _report_backfill(counts, started)
+    return counts
+
+
+def ready_db():
+    """The database, with indexes ensured and legacy reminders backfilled at most once per process.
+
+    With MONGODB_AUTO_INDEX=0 both are left to ``python db.py migrate``.
+    """
+    global _indexes_ready
+    if AUTO_INDEX and not _indexes_ready:
+        with _lock:
+            if not _indexes_ready:
+                ensure_indexes()
+                backfill()
+                _indexes_ready = True
+    return get_db()
+
+
+async def ready_async_db():
+    global _async_indexes_ready
+    if AUTO_INDEX and not (_indexes_ready or _async_indexes_ready):
+        await ensure_indexes_async()
+        await backfill_async()
+        _async_indexes_ready = True
+    return get_async_db()
+
+
+def startup_stats() -> Dict[str, float]:
+    return dict(_stats)
 
 
+if __name__ == "__main__":
+    # python db.py migrate  -> create indexes and backfill legacy fields
+    if sys.argv[1:] != ["migrate"]:
+        raise SystemExit("usage: python db.py migrate")
+    connect()
+    ensure_indexes()
+    for field, n in backfill().items():
+        print(f"backfilled {field} on {n} reminders")
+    print(startup_stats())
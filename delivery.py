@@ -0,0 +1,357 @@
+from __future__ import annotations
+import asyncio
+import os
+import random
+import socket
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from telegram import Bot
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter, TelegramError
+
+import metrics
+from astorage import block_chat, fail_claimed, finish_claimed, reschedule_claimed
+from recurrence import next_occurrence
+from reminder import Reminder
+
+# Telegram allows ~30 messages/s per bot overall and ~1 message/s per chat.
+GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+CONCURRENCY = int(os.getenv("DELIVERY_CONCURRENCY", "20"))
+MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "4"))
+FLUSH_SIZE = int(os.getenv("DELIVERY_FLUSH_SIZE", "100"))
+LEASE_SECONDS = int(os.getenv("CLAIM_LEASE_SECONDS", "120"))
+# Reminders for one chat due within this many seconds of each other are sent
+# as a single digest message; 0 sends each on its own.
+COALESCE_SECONDS = float(os.getenv("DELIVERY_COALESCE_SECONDS", "0"))
+MESSAGE_LIMIT = 4096  # Telegram's maximum message length
+# A reminder whose send fails is retried after RETRY_BASE_SECONDS, doubling
+# per failure up to RETRY_MAX_SECONDS, and dead-lettered after DEAD_AFTER failures.
+RETRY_BASE_SECONDS = float(os.getenv("DELIVERY_RETRY_BASE_SECONDS", "60"))
+RETRY_MAX_SECONDS = float(os.getenv("DELIVERY_RETRY_MAX_SECONDS", "21600"))
+DEAD_AFTER = int(os.getenv("DELIVERY_DEAD_AFTER", "8"))
+
+# Identifies this process in claim leases (see storage claim_due/finish_claimed).
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class TokenBucket:
+    """Async token bucket: ``rate`` tokens/s, bursting up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        self._lock_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _loop_lock(self) -> asyncio.Lock:
+        # A Lock binds to the loop it is first contended on, and warm serverless
+        # instances may run each invocation on a new loop; the rate state carries over.
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock, self._lock_loop = asyncio.Lock(), loop
+        return self._lock
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for ``seconds`` (used on flood-control replies)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        now = time.monotonic()
+        return now >= self.blocked_until and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+    async def acquire(self) -> None:
+        async with self._loop_lock():
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def render(rem: Reminder) -> str:
+    return f"⏰ Reminder: {rem.text}"
+
+
+def render_digest(rems: List[Reminder]) -> str:
+    if len(rems) == 1:
+        return render(rems[0])
+    return f"⏰ {len(rems)} reminders:\n" + "\n".join(f"• {r.text}" for r in rems)
+
+
+def coalesce(rems: List[Reminder], window: float) -> List[List[Reminder]]:
+    """Split one chat's reminders (in due order) into digest groups.
+
+    A group spans at most ``window`` seconds from its first reminder and is cut
+    early if its digest would exceed Telegram's message length.
+    """
+    groups: List[List[Reminder]] = []
+    start = 0.0
+    for rem in rems:
+        if (
+            groups
+            and rem.epoch - start <= window
+            and len(render_digest(groups[-1] + [rem])) <= MESSAGE_LIMIT
+        ):
+            groups[-1].append(rem)
+        else:
+            groups.append([rem])
+            start = rem.epoch
+    return groups
+
+
+def _retry_after_seconds(exc: RetryAfter) -> float:
+    value = exc.retry_after
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+def _unreachable(exc: TelegramError) -> bool:
+    # Blocked by the user, user deactivated, kicked from the group, or chat deleted
+    return isinstance(exc, Forbidden) or (isinstance(exc, BadRequest) and "chat not found" in exc.message.lower())
+
+
+def retry_delay(failures: int) -> float:
+    """Seconds before the next attempt after ``failures`` failed sends, with ±20% jitter."""
+    delay = min(RETRY_BASE_SECONDS * 2 ** (failures - 1), RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+@dataclass
+class DeliveryResult:
+    sent: List[str] = field(default_factory=list)
+    # id -> error for sends that failed; ids in ``permanent`` will never succeed
+    failed: Dict[str, str] = field(default_factory=dict)
+    permanent: Set[str] = field(default_factory=set)
+    # chat -> error for chats that can no longer be reached
+    blocked: Dict[int, str] = field(default_factory=dict)
+
+
+class DeliveryEngine:
+    """Sends reminders concurrently while honouring global and per-chat rate limits.
+
+    Successfully sent reminders are handed to ``mark_sent`` in chunks of
+    ``flush_size`` so that status writes are batched rather than issued per message.
+    A run can outlast its claim lease (a busy chat at 1 msg/s, flood-control
+    pauses), so every third of ``lease_seconds`` whatever was sent is flushed
+    and the rest handed to ``renew`` to extend their lease.
+    Different chats are sent to concurrently; within a chat, strictly in due order,
+    optionally coalesced into digests (``coalesce_seconds``) that cost one send.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = GLOBAL_RATE,
+        chat_rate: float = CHAT_RATE,
+        concurrency: int = CONCURRENCY,
+        max_attempts: int = MAX_ATTEMPTS,
+        flush_size: int = FLUSH_SIZE,
+        coalesce_seconds: float = COALESCE_SECONDS,
+        lease_seconds: float = LEASE_SECONDS,
+    ) -> None:
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.flush_size = flush_size
+        self.coalesce_seconds = coalesce_seconds
+        self.lease_seconds = lease_seconds
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10_000:
+                self._chat_buckets = {k: b for k, b in self._chat_buckets.items() if not b.idle()}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1.0)
+        return bucket
+
+    async def _send(self, bot: Bot, chat_id: int, text: str, slots: asyncio.Semaphore) -> None:
+        for attempt in range(1, self.max_attempts + 1):
+            await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            started = time.perf_counter()
+            try:
+                # Only the request itself holds a slot; waits and backoff do not
+                async with slots:
+                    await bot.send_message(chat_id, text)
+                return
+            except RetryAfter as e:
+                metrics.send_errors.inc(error="RetryAfter")
+                # Flood control applies to the whole bot, so stall every sender.
+                self.global_bucket.pause(_retry_after_seconds(e))
+                if attempt == self.max_attempts:
+                    raise
+            except BadRequest:
+                # A NetworkError subclass, but retrying the same request cannot help
+                metrics.send_errors.inc(error="BadRequest")
+                raise
+            except NetworkError as e:
+                metrics.send_errors.inc(error=type(e).__name__)
+                if attempt == self.max_attempts:
+                    raise
+                await asyncio.sleep(min(2 ** attempt * 0.5, 10))
+            except TelegramError as e:
+                metrics.send_errors.inc(error=type(e).__name__)
+                raise
+            finally:
+                metrics.send_seconds.observe(time.perf_counter() - started)
+
+    async def deliver(
+        self,
+        bot: Bot,
+        reminders: Iterable[Reminder],
+        mark_sent: Optional[Callable[[List[Reminder]], Awaitable[Any]]] = None,
+        renew: Optional[Callable[[List[str]], Awaitable[Any]]] = None,
+    ) -> DeliveryResult:
+        reminders = sorted(reminders, key=lambda r: r.epoch)
+        result = DeliveryResult()
+        pending: List[Reminder] = []
+        # Claimed and not yet handed to mark_sent: the leases that must not lapse
+        held = {r.id for r in reminders}
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def flush() -> None:
+            if mark_sent is not None and pending:
+                batch = pending[:]
+                pending.clear()
+                held.difference_update(r.id for r in batch)
+                await mark_sent(batch)
+
+        async def keep_leases() -> None:
+            while True:
+                try:
+                    await asyncio.wait_for(stopping.wait(), timeout=self.lease_seconds / 3)
+                    return
+                except asyncio.TimeoutError:
+                    pass
+                await flush()
+                if renew is not None and held:
+                    await renew(list(held))
+
+        async def one(group: List[Reminder]) -> bool:
+            """Send one message; False once the chat turns out to be unreachable."""
+            metrics.queue_depth.dec(len(group), queue="delivery")
+            chat_id = group[0].chat_id
+            try:
+                await self._send(bot, chat_id, render_digest(group), sem)
+            except TelegramError as e:
+                metrics.delivery_failed.inc(len(group))
+                error = f"{type(e).__name__}: {e}"
+                if _unreachable(e):
+                    result.blocked[chat_id] = error
+                    return False
+                for rem in group:
+                    result.failed[rem.id] = error
+                    if isinstance(e, (BadRequest, ChatMigrated)):
+                        result.permanent.add(rem.id)
+                return True
+            now = time.time()
+            for rem in group:
+                metrics.delivery_lag.observe(now - rem.epoch)
+                result.sent.append(rem.id)
+            metrics.delivered.inc(len(group))
+            pending.extend(group)
+            if len(pending) >= self.flush_size:
+                await flush()
+            return True
+
+        async def chat(rems: List[Reminder]) -> None:
+            # One chat's reminders go out one after another, in due order
+            groups = coalesce(rems, self.coalesce_seconds) if self.coalesce_seconds > 0 else [[r] for r in rems]
+            for i, group in enumerate(groups):
+                if not await one(group):
+                    # The rest are parked along with the chat, not attempted
+                    metrics.queue_depth.dec(sum(map(len, groups[i + 1:])), queue="delivery")
+                    return
+
+        by_chat: Dict[int, List[Reminder]] = {}
+        for rem in reminders:
+            by_chat.setdefault(rem.chat_id, []).append(rem)
+        metrics.queue_depth.inc(len(reminders), queue="delivery")
+        stopping = asyncio.Event()
+        keeper = asyncio.create_task(keep_leases())
+        try:
+            # Every chat runs to the end even if one fails, so nothing sent is left unflushed
+            outcomes = await asyncio.gather(*(chat(rems) for rems in by_chat.values()), return_exceptions=True)
+        finally:
+            # Let a flush or renewal already under way finish rather than cutting off mark_sent
+            stopping.set()
+            await asyncio.wait([keeper])
+            await flush()
+        for outcome in (*outcomes, keeper.exception()):
+            if isinstance(outcome, BaseException):
+                raise outcome
+        return result
+
+
+async def settle_sent(rows: List[Reminder], worker_id: str) -> Dict[str, datetime]:
+    """Finish sent one-shot reminders and advance recurring ones to their next occurrence.
+
+    A recurring reminder whose next occurrence cannot be computed is
+    dead-lettered with the error. Returns the new local due time of each
+    recurring reminder, keyed by id.
+    """
+    now = datetime.now(timezone.utc)
+    next_runs: Dict[str, datetime] = {}
+    broken: Dict[str, Tuple[Optional[datetime], str]] = {}
+    for r in rows:
+        if r.recurrence:
+            try:
+                next_runs[r.id] = next_occurrence(r.recurrence, r.local_due, r.timezone, now)
+            except (ValueError, OverflowError) as e:
+                broken[r.id] = (None, f"{type(e).__name__}: {e}")
+    await finish_claimed([r.id for r in rows if not r.recurrence], worker_id, "done")
+    await reschedule_claimed(next_runs, worker_id)
+    if broken:
+        await fail_claimed(broken, worker_id)
+        metrics.dead_lettered.inc(len(broken))
+    return next_runs
+
+
+async def settle_failed(result: DeliveryResult, rows: List[Reminder], worker_id: str) -> Dict[str, datetime]:
+    """Park unreachable chats, back off failed sends and dead-letter those out of attempts.
+
+    Recurring reminders are never dead-lettered: a failed occurrence is
+    dropped and the reminder moves on to its next one. Returns the new due
+    time of every reminder that will be tried again, keyed by id.
+    """
+    for chat_id in result.blocked:
+        await block_chat(chat_id)
+        metrics.chats_blocked.inc()
+    now = datetime.now(timezone.utc)
+    by_id = {r.id: r for r in rows}
+    failures: Dict[str, Tuple[Optional[datetime], str]] = {}
+    skipped: List[Reminder] = []
+    for rid, error in result.failed.items():
+        rem = by_id[rid]
+        if rid not in result.permanent and rem.attempts + 1 < DEAD_AFTER:
+            failures[rid] = (now + timedelta(seconds=retry_delay(rem.attempts + 1)), error)
+        elif rem.recurrence:
+            skipped.append(rem)
+        else:
+            failures[rid] = (None, error)
+            metrics.dead_lettered.inc()
+    await fail_claimed(failures, worker_id)
+    retries = {rid: at for rid, (at, _) in failures.items() if at is not None}
+    if skipped:
+        retries.update(await settle_sent(skipped, worker_id))
+    return retries
+
+
+# Shared by the bot process so every job draws from the same rate budget.
+engine = DeliveryEngine()
@@ -0,0 +1,92 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from timeutil import to_utc
+
+# The summary keeps which of the last RECENT_DAYS days were checked in as a
+# bitmask (bit 0 = lastDay), so the weekly rate never needs the check-in log.
+RECENT_DAYS = 28
+_RECENT_MASK = (1 << RECENT_DAYS) - 1
+
+
+@dataclass(slots=True)
+class Habit:
+    """A daily habit and its running summary, kept in one document per habit.
+
+    Each check-in updates the summary in place (see ``checkin``), so stats
+    are O(1) however long the history. Days are the chat's local dates.
+    Treat instances as read-only: changes go through the storage functions.
+    """
+
+    id: str
+    chat_id: int
+    name: str
+    created_at: Optional[datetime] = None
+    last_day: Optional[date] = None  # latest day checked in
+    streak: int = 0  # consecutive days ending at last_day
+    longest: int = 0
+    total: int = 0
+    recent: int = 0
+
+    @classmethod
+    def from_doc(cls, doc: Dict[str, Any]) -> "Habit":
+        last = doc.get("lastDay")
+        return cls(
+            id=doc["id"],
+            chat_id=doc["chat_id"],
+            name=doc.get("name", ""),
+            created_at=to_utc(doc.get("created_at"), "UTC"),
+            last_day=date.fromisoformat(last) if last else None,
+            streak=doc.get("streak", 0),
+            longest=doc.get("longest", 0),
+            total=doc.get("total", 0),
+            recent=doc.get("recent", 0),
+        )
+
+    def to_doc(self) -> Dict[str, Any]:
+        # Dates as ISO strings in both backends; nothing here is range-queried
+        created = (self.created_at or datetime.now(timezone.utc)).isoformat()
+        return {
+            "id": self.id,
+            "chat_id": self.chat_id,
+            "name": self.name,
+            "created_at": created,
+            "updated_at": created,
+            "lastDay": self.last_day.isoformat() if self.last_day else None,
+            "streak": self.streak,
+            "longest": self.longest,
+            "total": self.total,
+            "recent": self.recent,
+        }
+
+    def checkin(self, day: date) -> Optional[Dict[str, Any]]:
+        """The summary fields after checking in on ``day``, or None if it is already counted."""
+        if self.last_day is not None and day <= self.last_day:
+            return None
+        gap = (day - self.last_day).days if self.last_day else RECENT_DAYS
+        streak = self.streak + 1 if gap == 1 else 1
+        return {
+            "lastDay": day.isoformat(),
+            "streak": streak,
+            "longest": max(self.longest, streak),
+            "total": self.total + 1,
+            "recent": ((self.recent << gap) | 1) & _RECENT_MASK if gap < RECENT_DAYS else 1,
+        }
+
+    def current_streak(self, today: date) -> int:
+        # Still alive until today ends without a check-in
+        if self.last_day is None or (today - self.last_day).days > 1:
+            return 0
+        return self.streak
+
+    def days(self, today: date, n: int = 7) -> List[bool]:
+        """Whether each of the ``n`` days up to ``today`` was checked in, oldest first."""
+        gap = (today - self.last_day).days if self.last_day else RECENT_DAYS
+        mask = self.recent << gap if 0 <= gap < RECENT_DAYS else self.recent >> -gap if gap < 0 else 0
+        return [bool(mask >> i & 1) for i in reversed(range(n))]
+
+    def week_rate(self, today: date) -> float:
+        """Share of the last 7 days, today included, that were checked in."""
+        return sum(self.days(today)) / 7
@@ -0,0 +1,313 @@
+from __future__ import annotations
+import bisect
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None  # type: ignore[assignment]
+
+COMPACT_EVERY = int(os.getenv("JSON_COMPACT_EVERY", "1000"))
+FSYNC = os.getenv("JSON_FSYNC", "0") == "1"
+
+Record = Dict[str, Any]
+
+
+class SortedIndex:
+    """(sort key, record key) pairs kept in order, in chunks of up to ~2 * ``CHUNK``.
+
+    Inserts and deletes shift one chunk rather than the whole list, which matters
+    because claims remove entries from the front of a large index.
+    """
+
+    CHUNK = 512
+
+    def __init__(self, entries: Iterable[Tuple[Any, str]] = ()) -> None:
+        items = sorted(entries)
+        self._chunks = [items[i:i + self.CHUNK] for i in range(0, len(items), self.CHUNK)]
+        self._maxes = [c[-1] for c in self._chunks]
+
+    def add(self, item: Tuple[Any, str]) -> None:
+        if not self._chunks:
+            self._chunks, self._maxes = [[item]], [item]
+            return
+        i = min(bisect.bisect_left(self._maxes, item), len(self._chunks) - 1)
+        chunk = self._chunks[i]
+        bisect.insort(chunk, item)
+        self._maxes[i] = chunk[-1]
+        if len(chunk) > 2 * self.CHUNK:
+            self._chunks[i:i + 1] = [chunk[:self.CHUNK], chunk[self.CHUNK:]]
+            self._maxes[i:i + 1] = [chunk[self.CHUNK - 1], chunk[-1]]
+
+    def remove(self, item: Tuple[Any, str]) -> None:
+        i = bisect.bisect_left(self._maxes, item)
+        if i == len(self._chunks):
+            return
+        chunk = self._chunks[i]
+        j = bisect.bisect_left(chunk, item)
+        if j < len(chunk) and chunk[j] == item:
+            del chunk[j]
+            if chunk:
+                self._maxes[i] = chunk[-1]
+            else:
+                del self._chunks[i], self._maxes[i]
+
+    def __iter__(self) -> Iterator[Tuple[Any, str]]:
+        for chunk in self._chunks:
+            yield from chunk
+
+    def __len__(self) -> int:
+        return sum(map(len, self._chunks))
+
+
+class Journal:
+    """A keyed record store persisted as a JSON snapshot plus an append-only JSONL log.
+
+    Writes append one small line per change; the snapshot is rewritten only on
+    compaction, once the log holds ``compact_every`` entries. All records live in
+    memory, keyed by ``key``, with optional secondary indexes (name -> record ->
+    value) maintained alongside, and optional ordered indexes (name -> record ->
+    sort key, or None to leave the record out) kept sorted for range scans. Every read and write first takes an flock on a
+    sidecar lock file and replays whatever other processes appended since, so the
+    bot and the cron can share the same files.
+
+    The snapshot keeps the historical on-disk shape: a list of records when
+    ``key`` names a record field, or a ``{key: record}`` object when ``key`` is None.
+    """
+
+    def __init__(
+        self,
+        snapshot: Path,
+        key: Optional[str] = "id",
+        indexes: Optional[Dict[str, Callable[[Record], Any]]] = None,
+        ordered: Optional[Dict[str, Callable[[Record], Any]]] = None,
+        compact_every: int = COMPACT_EVERY,
+    ) -> None:
+        self.snapshot = snapshot
+        self.log = snapshot.with_suffix(".log.jsonl")
+        self.lock_path = snapshot.with_suffix(".lock")
+        self.key = key
+        self.compact_every = compact_every
+        self.index_fns = indexes or {}
+        self.records: Dict[str, Record] = {}
+        self.indexes: Dict[str, Dict[Any, Set[str]]] = {name: {} for name in self.index_fns}
+        self.order_fns = ordered or {}
+        self.orders: Dict[str, SortedIndex] = {name: SortedIndex() for name in self.order_fns}
+        self._snap_sig: Optional[tuple] = None
+        self._offset = 0
+        self._log_entries = 0
+        self._pending: List[str] = []
+        self._thread_lock = threading.RLock()
+        self._lock_fh = None
+
+    # ---- locking & replay ----
+    @contextmanager
+    def _locked(self, exclusive: bool) -> Iterator[None]:
+        with self._thread_lock:
+            self.snapshot.parent.mkdir(parents=True, exist_ok=True)
+            if self._lock_fh is None:
+                self._lock_fh = open(self.lock_path, "a")
+            if fcntl is not None:
+                fcntl.flock(self._lock_fh, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                self._refresh(exclusive)
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_fh, fcntl.LOCK_UN)
+
+    def _signature(self) -> Optional[tuple]:
+        try:
+            st = os.stat(self.snapshot)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _refresh(self, exclusive: bool) -> None:
+        sig = self._signature()
+        try:
+            log_size = os.path.getsize(self.log)
+        except FileNotFoundError:
+            log_size = 0
+        if sig != self._snap_sig or log_size < self._offset:
+            self._reload(sig)
+        if log_size == self._offset:
+            return
+        with open(self.log, "rb") as f:
+            f.seek(self._offset)
+            chunk = f.read()
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            if line.strip():
+                self._apply(json.loads(line))
+                self._log_entries += 1
+        self._offset += end
+        if end < len(chunk) and exclusive:
+            # A writer died mid-line; drop the fragment so our appends stay parseable
+            with open(self.log, "r+b") as f:
+                f.truncate(self._offset)
+
+    def _reload(self, sig: Optional[tuple]) -> None:
+        self._clear()
+        if sig is not None:
+            with open(self.snapshot, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            items = data.items() if self.key is None else ((r[self.key], r) for r in data)
+            for k, rec in items:
+                self._index(str(k), rec, order=False)
+            self._build_orders()
+        self._snap_sig = sig
+        self._offset = 0
+        self._log_entries = 0
+
+    # ---- in-memory state ----
+    def _clear(self) -> None:
+        self.records = {}
+        self.indexes = {name: {} for name in self.index_fns}
+        self.orders = {name: SortedIndex() for name in self.order_fns}
+
+    def _build_orders(self) -> None:
+        # One sort for a full load instead of an insert per record
+        for name, fn in self.order_fns.items():
+            keyed = ((fn(rec), k) for k, rec in self.records.items())
+            self.orders[name] = SortedIndex(e for e in keyed if e[0] is not None)
+
+    def _index(self, k: str, rec: Record, order: bool = True) -> None:
+        self.records[k] = rec
+        for name, fn in self.index_fns.items():
+            self.indexes[name].setdefault(fn(rec), set()).add(k)
+        if order:
+            for name, fn in self.order_fns.items():
+                key = fn(rec)
+                if key is not None:
+                    self.orders[name].add((key, k))
+
+    def _unindex(self, k: str) -> Optional[Record]:
+        rec = self.records.pop(k, None)
+        if rec is not None:
+            for name, fn in self.index_fns.items():
+                bucket = self.indexes[name].get(fn(rec))
+                if bucket is not None:
+                    bucket.discard(k)
+                    if not bucket:
+                        del self.indexes[name][fn(rec)]
+            for name, fn in self.order_fns.items():
+                key = fn(rec)
+                if key is not None:
+                    self.orders[name].remove((key, k))
+        return rec
+
+    def _apply(self, entry: Dict[str, Any]) -> None:
+        k = entry["k"]
+        op = entry["op"]
+        if op == "put":
+            self._unindex(k)
+            self._index(k, entry["r"])
+        elif op == "set":
+            rec = self._unindex(k)
+            if rec is not None:
+                rec.update(entry.get("set", {}))
+                for field in entry.get("unset", ()):
+                    rec.pop(field, None)
+                self._index(k, rec)
+        elif op == "del":
+            self._unindex(k)
+
+    def _record(self, entry: Dict[str, Any]) -> None:
+        self._apply(entry)
+        self._pending.append(json.dumps(entry, ensure_ascii=False, separators=(",", ":")))
+
+    # ---- public API ----
+    @contextmanager
+    def reading(self) -> Iterator["Journal"]:
+        with self._locked(exclusive=False):
+            yield self
+
+    @contextmanager
+    def writing(self) -> Iterator["Journal"]:
+        """Lock, replay, let the caller ``put``/``update``/``delete``, then append in one write."""
+        with self._locked(exclusive=True):
+            try:
+                yield self
+            except BaseException:
+                # In-memory state may be ahead of disk; rebuild on next access
+                self._pending.clear()
+                self._snap_sig = ("stale",)
+                raise
+            if self._pending:
+                self._flush()
+
+    def put(self, k: Any, rec: Record) -> None:
+        self._record({"op": "put", "k": str(k), "r": rec})
+
+    def update(self, k: Any, set_: Optional[Record] = None, unset: Optional[List[str]] = None) -> bool:
+        k = str(k)
+        if k not in self.records:
+            return False
+        entry: Dict[str, Any] = {"op": "set", "k": k, "set": set_ or {}}
+        if unset:
+            entry["unset"] = list(unset)
+        self._record(entry)
+        return True
+
+    def delete(self, k: Any) -> bool:
+        k = str(k)
+        if k not in self.records:
+            return False
+        self._record({"op": "del", "k": k})
+        return True
+
+    def ids(self, index: str, value: Any) -> Set[str]:
+        return self.indexes[index].get(value, set())
+
+    def upto(self, index: str, bound: Any) -> Iterator[str]:
+        """Keys in ordered ``index`` with sort key <= ``bound``, in order.
+
+        Yields from the live index: finish iterating before changing records.
+        """
+        for key, k in self.orders[index]:
+            if key > bound:
+                return
+            yield k
+
+    def replace_all(self, records: Dict[str, Record]) -> None:
+        self._pending.clear()
+        self._clear()
+        for k, rec in records.items():
+            self._index(str(k), rec, order=False)
+        self._build_orders()
+        self.compact()
+
+    def compact(self) -> None:
+        """Fold the log into a fresh snapshot. Caller must hold the write lock."""
+        data: Any = dict(self.records) if self.key is None else list(self.records.values())
+        tmp = self.snapshot.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            if FSYNC:
+                os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot)
+        with open(self.log, "w", encoding="utf-8"):
+            pass
+        self._snap_sig = self._signature()
+        self._offset = 0
+        self._log_entries = 0
+
+    def _flush(self) -> None:
+        payload = ("\n".join(self._pending) + "\n").encode("utf-8")
+        with open(self.log, "ab") as f:
+            f.write(payload)
+            f.flush()
+            if FSYNC:
+                os.fsync(f.fileno())
+        self._offset += len(payload)
+        self._log_entries += len(self._pending)
+        self._pending.clear()
+        if self._log_entries >= self.compact_every:
+            self.compact()
@@ -1,36 +1,39 @@
 from __future__ import annotations
+import asyncio
 import os
-import re
 import uuid
 import html 
 from telegram.constants import ParseMode
-from dataclasses import dataclass
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 from typing import Optional, Tuple
 
 from dotenv import load_dotenv
-from dateutil import parser as dtparser
 
-from telegram import Update
+from telegram import ChatMember, InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.constants import ParseMode
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, filters,
+    Application, CallbackQueryHandler, ChatMemberHandler, CommandHandler, MessageHandler, filters,
     ContextTypes, ConversationHandler
 )
 
 import json
-USE_MONGO = os.getenv("USE_MONGO", "0") == "1" or bool(os.getenv("MONGODB_URI"))
-if USE_MONGO:
-    from storage_mongo import (
-        add_reminder, load_reminders, save_reminders, update_reminder_status,
-        delete_reminder, upsert_user_timezone, get_user_timezone
-    )
-else:
-    from storage import (
-        add_reminder, load_reminders, save_reminders, update_reminder_status,
-        delete_reminder, upsert_user_timezone, get_user_timezone
-    )
+from delivery import LEASE_SECONDS, WORKER_ID, engine as delivery_engine, settle_failed, settle_sent
+from timeparse import WhenParseResult, parse_when
+from recurrence import describe as describe_recurrence, parse_recurrence
+from scheduler import BATCH_SLACK, Scheduler
+from retention import archive_loop
+from reminder import Reminder
+from habit import Habit
+from usercache import UserCache
+from metrics import serve as serve_metrics, timed_handler
+from persistence import SessionApplication, StoragePersistence, conversation_sync
+from updates import CONCURRENCY, ChatOrderedUpdateProcessor
+from astorage import (
+    USE_MONGO, add_reminder, fetch_due, claim_reminders, renew_claimed, delete_reminder, block_chat, unblock_chat,
+    upsert_user_timezone, get_user_timezone, list_reminders_for_chat, list_archived_for_chat,
+    add_habit, list_habits, check_in_habit, delete_habit,
+)
 
 # ---- Conversation states ----
 ASK_WHEN, ASK_TEXT = range(2)
@@ -38,92 +41,40 @@ ASK_WHEN, ASK_TEXT = range(2)
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_TOKEN")
 DEFAULT_TZ = os.getenv("DEFAULT_TZ", "Asia/Ho_Chi_Minh")
+users = UserCache(get_user_timezone, upsert_user_timezone, DEFAULT_TZ)
 
 if not TOKEN:
     raise RuntimeError("TELEGRAM_TOKEN environment variable not set. Put it in .env")
 
-@dataclass
-class WhenParseResult:
-    due_at: datetime  # timezone-aware
-    source: str       # human-readable source (for echoing back)
-
-def _now_in_tz(tz_name: str) -> datetime:
-    return datetime.now(ZoneInfo(tz_name))
-
-def parse_when(text: str, tz_name: str) -> Optional[WhenParseResult]:
-    """
-    Supported:
-      - in 10m / in 2h / in 1d
-      - at 18:30
-      - tomorrow 09:00
-      - absolute dates, e.g. 2025-08-26 18:30 or 'Aug 26 18:30'
-    """
-    text = text.strip().lower()
-    now = _now_in_tz(tz_name)
-
-    # in X[d/h/m]
-    m = re.fullmatch(r"in\s+(\d+)\s*([dhm])", text)
-    if m:
-        value = int(m.group(1))
-        unit = m.group(2)
-        delta = timedelta(minutes=value) if unit == "m" else timedelta(hours=value) if unit == "h" else timedelta(days=value)
-        due = now + delta
-        return WhenParseResult(due_at=due, source=f"in {value}{unit}")
-
-    # at HH:MM (today or tomorrow)
-    m = re.fullmatch(r"at\s+(\d{1,2}):(\d{2})", text)
-    if m:
-        hh, mm = int(m.group(1)), int(m.group(2))
-        candidate = now.replace(hour=hh, minute=mm, second=0, microsecond=0)
-        if candidate <= now:
-            candidate += timedelta(days=1)
-        return WhenParseResult(due_at=candidate, source=f"at {hh:02d}:{mm:02d}")
-
-    # tomorrow HH:MM
-    m = re.fullmatch(r"tomorrow\s+(\d{1,2}):(\d{2})", text)
-    if m:
-        hh, mm = int(m.group(1)), int(m.group(2))
-        candidate = (now + timedelta(days=1)).replace(hour=hh, minute=mm, second=0, microsecond=0)
-        return WhenParseResult(due_at=candidate, source=f"tomorrow {hh:02d}:{mm:02d}")
-
-    # Try dateutil absolute-ish parse (interprets in local tz)
-    try:
-        dt = dtparser.parse(text)
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=ZoneInfo(tz_name))
-        else:
-            # convert to user's tz
-            dt = dt.astimezone(ZoneInfo(tz_name))
-        if dt > now:
-            return WhenParseResult(due_at=dt, source=text)
-    except Exception:
-        pass
-
-    return None
-
 async def _send_html(update, text: str) -> None:
     if update.message is None:
         return
     await update.message.reply_text(text, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 # ------------ Command handlers -------------
 
+@timed_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.effective_chat is None:
         return
     chat_id = update.effective_chat.id
-    tz = get_user_timezone(chat_id) or DEFAULT_TZ
+    # Whoever (re)starts the bot can be reached again
+    await unblock_chat(chat_id)
+    tz = await users.timezone(chat_id)
     msg = (
         "<b>Hi, I’m Gretchen</b> — your reminders &amp; tasks helper!\n\n"
         "<b>Quick commands</b>\n"
         "• /setreminder — create a reminder\n"
         "• /reminders — list your reminders\n"
         "• /deletereminder &lt;id&gt; — delete by id\n"
+        "• /newhabit &lt;name&gt; — track a daily habit\n"
+        "• /checkin — check in on a habit, /habits — your streaks\n"
         "• /timezone — view or set your timezone\n"
         "• /help — tips and examples\n\n"
         f"Your current timezone: <code>{html.escape(tz)}</code>"
     )
     await _send_html(update, msg)
 
+@timed_handler
 async def help_(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     msg = (
         "<b>How to set a reminder</b>\n"
@@ -131,17 +82,24 @@ async def help_(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "2. When prompted for <i>when</i>, try formats like:\n"
         "   • <code>in 10m</code>   • <code>in 2h</code>   • <code>in 1d</code>\n"
         "   • <code>at 18:30</code>\n"
-        "   • <code>tomorrow 09:00</code>\n"
+        "   • <code>tomorrow 09:00</code>   • <code>next monday 9am</code>   • <code>in 1h30m</code>\n"
         "   • or an absolute time like <code>2025-08-26 18:00</code>\n"
+        "   • repeating: <code>every day at 09:00</code>, <code>every 2 hours</code>, "
+        "<code>every monday 08:30</code>, <code>cron 0 9 * * 1-5</code>\n"
         "3. Then tell me <i>what</i> to remind you about\n\n"
         "<b>Example</b>\n"
         "<code>/setreminder</code> → <code>in 15m</code> → <code>stretch and drink water</code>\n\n"
+        "<b>Habits</b>\n"
+        "<code>/newhabit stretch</code>, then <code>/checkin stretch</code> once a day "
+        "(or just <code>/checkin</code> and pick one). <code>/habits</code> shows streaks "
+        "and how many of the last 7 days you kept it up.\n\n"
         "Use <code>/timezone</code> to view or set your timezone, e.g. "
         "<code>/timezone Asia/Ho_Chi_Minh</code>"
     )
     await _send_html(update, msg)
 
 
+@timed_handler
 async def timezone_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.effective_chat is None or update.message is None:
         return
@@ -150,19 +108,20 @@ async def timezone_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         candidate = " ".join(context.args).strip()
         try:
             _ = ZoneInfo(candidate)  # validate
-            upsert_user_timezone(chat_id, candidate)
+            await users.set_timezone(chat_id, candidate)
             await update.message.reply_text(f"Timezone set to {candidate}")
         except Exception:
             await update.message.reply_text("That doesn't look like a valid IANA timezone. Try something like `Asia/Ho_Chi_Minh` or `Europe/London`.")
         return
 
     # show current
-    tz = get_user_timezone(chat_id) or DEFAULT_TZ
-    now_str = _now_in_tz(tz).strftime("%Y-%m-%d %H:%M")
+    tz = await users.timezone(chat_id)
+    now_str = datetime.now(await users.zone(chat_id)).strftime("%Y-%m-%d %H:%M")
     await update.message.reply_text(f"Your timezone is {tz}. Local time there is {now_str}.\nSet a new one: /timezone <IANA>")
 
 # ---- setreminder conversation ----
 
+@timed_handler
 async def setreminder_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message is None:
         return ConversationHandler.END
@@ -171,14 +130,24 @@ async def setreminder_entry(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
     return ASK_WHEN
 
+@timed_handler
 async def setreminder_ask_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.effective_chat is None or update.message is None or update.message.text is None:
         return ConversationHandler.END
     chat_id = update.effective_chat.id
-    tz = get_user_timezone(chat_id) or DEFAULT_TZ
+    tz = await users.timezone(chat_id)
     when_str = update.message.text.strip()
 
-    parsed = parse_when(when_str, tz)
+    try:
+        recurring = parse_recurrence(when_str, tz)
+    except ValueError as e:
+        await update.message.reply_text(f"That repeats too rarely: {e}. Try a shorter interval.")
+        return ASK_WHEN
+    if recurring:
+        rule, first_due, source = recurring
+        parsed = WhenParseResult(due_at=first_due, source=source, recurrence=rule)
+    else:
+        parsed = parse_when(when_str, tz)
     if not parsed:
         await update.message.reply_text("I couldn't parse that time. Try `in 10m`, `in 2h`, `at 18:30`, `tomorrow 09:00`, or an absolute like `2025-08-26 18:00`.")
         return ASK_WHEN
@@ -187,40 +156,36 @@ async def setreminder_ask_text(update: Update, context: ContextTypes.DEFAULT_TYP
         return ConversationHandler.END
     context.user_data["pending_due_at"] = parsed.due_at
     context.user_data["pending_when_src"] = parsed.source
+    context.user_data["pending_recurrence"] = parsed.recurrence
     await update.message.reply_text("What should I say when it's time?")
     return ASK_TEXT
 
+@timed_handler
 async def setreminder_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.effective_chat is None or update.message is None or update.message.text is None or context.user_data is None:
         return ConversationHandler.END
     chat_id = update.effective_chat.id
-    tz = get_user_timezone(chat_id) or DEFAULT_TZ
+    tz = await users.timezone(chat_id)
     text = update.message.text.strip()
     due_at = context.user_data.pop("pending_due_at", None)
     when_src = context.user_data.pop("pending_when_src", None)
+    recurrence = context.user_data.pop("pending_recurrence", None)
     if not due_at:
         await update.message.reply_text("Oops, I lost the schedule time. Let's try again. /setreminder")
         return ConversationHandler.END
 
     # Create reminder
     rem_id = uuid.uuid4().hex[:8]
-    rem = {
-        "id": rem_id,
-        "chat_id": chat_id,
-        "text": text,
-        "due_at": due_at.isoformat(),
-        "timezone": tz,
-        "status": "scheduled",
-        "created_at": datetime.utcnow().isoformat() + "Z",
-        "updated_at": datetime.utcnow().isoformat() + "Z",
-    }
-    add_reminder(rem)
-
-    # Schedule job
-    # job name will be 'rem:<id>' so we can identify/remove
-    job_name = f"rem:{rem_id}"
-    if context.job_queue is not None:
-        context.job_queue.run_once(reminder_job, when=due_at, chat_id=chat_id, name=job_name, data={"id": rem_id, "text": text})
+    now = datetime.now(timezone.utc)
+    rem = Reminder(
+        id=rem_id, chat_id=chat_id, text=text, due=due_at, timezone=tz,
+        recurrence=recurrence or None, created_at=now, updated_at=now,
+    )
+    await add_reminder(rem)
+
+    scheduler = context.bot_data.get("scheduler")
+    if scheduler is not None:
+        scheduler.add(rem_id, rem.due)
 
     human_due = due_at.strftime("%Y-%m-%d %H:%M")
     msg = (
@@ -232,6 +197,7 @@ async def setreminder_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE
     await update.message.reply_text(msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
     return ConversationHandler.END
 
+@timed_handler
 async def cancel_flow(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if context.user_data is not None:
         context.user_data.clear() 
@@ -239,52 +205,94 @@ async def cancel_flow(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         await update.message.reply_text("Cancelled.")
     return ConversationHandler.END
 
-# ---- jobs ----
-async def reminder_job(context: ContextTypes.DEFAULT_TYPE) -> None:
-    job = context.job
-    if job is None or job.data is None:
+# ---- delivery ----
+async def dispatch_due(app: Application, ids: list) -> None:
+    """Claim and send one batch of reminders handed over by the scheduler."""
+    scheduler: Scheduler = app.bot_data["scheduler"]
+    now = datetime.now(timezone.utc)
+    # Skip anything a cron run or another bot process already picked up. The
+    # scheduler hands over reminders up to BATCH_SLACK early; claim those too.
+    claimed = await claim_reminders(ids, now + timedelta(seconds=BATCH_SLACK), WORKER_ID, LEASE_SECONDS)
+    if not claimed:
         return
-    data = job.data  # type: ignore
-    rem_id = data["id"]  # type: ignore
-    text = data["text"]  # type: ignore
-    chat_id = job.chat_id
-    if chat_id is None:
+    # Late reminders (e.g. after downtime) are still sent, as the cron path does
+    next_runs: dict = {}
+
+    async def mark_sent(rows: list) -> None:
+        next_runs.update(await settle_sent(rows, WORKER_ID))
+
+    result = await delivery_engine.deliver(
+        app.bot, claimed, mark_sent=mark_sent, renew=lambda ids: renew_claimed(ids, WORKER_ID, LEASE_SECONDS),
+    )
+    next_runs.update(await settle_failed(result, claimed, WORKER_ID))
+    # Recurring: only the next occurrence is ever queued; failures come back at their retry time
+    for rid, due in next_runs.items():
+        scheduler.add(rid, due)
+
+@timed_handler
+async def chat_member_changed(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Pause a chat's reminders while the bot is blocked or removed, and resume them after."""
+    change = update.my_chat_member
+    if change is None:
         return
-    await context.bot.send_message(chat_id, f"⏰ Reminder: {text}")
-    update_reminder_status(rem_id, "done")
+    status = change.new_chat_member.status
+    if status in (ChatMember.BANNED, ChatMember.LEFT):
+        await block_chat(change.chat.id)
+    elif status in (ChatMember.MEMBER, ChatMember.ADMINISTRATOR):
+        await unblock_chat(change.chat.id)
 
 # ---- listing & deleting ----
+PAGE_SIZE = 20
+# /reminders pages through upcoming reminders first, then recent history, then the archive
+_LIST_SECTIONS = {"s": ("scheduled", "sending"), "d": ("done", "dead"), "a": None}
+_SECTION_TITLES = {"s": "Your reminders", "d": "Completed reminders", "a": "Archived reminders"}
+
+async def _render_reminder_page(chat_id: int, section: str, cursor: Optional[str]) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    tzinfo = await users.zone(chat_id)
+    if section == "a":
+        rows, next_cursor = await list_archived_for_chat(chat_id, cursor, PAGE_SIZE)
+    else:
+        rows, next_cursor = await list_reminders_for_chat(chat_id, _LIST_SECTIONS[section], cursor, PAGE_SIZE)
+    lines = [_SECTION_TITLES[section]]
+    for r in rows:
+        local_due = r.due.astimezone(tzinfo).strftime("%Y-%m-%d %H:%M")
+        emoji = "⚠️" if r.status == "dead" else "✅" if section != "s" else "🔁" if r.recurrence else "🟢"
+        repeat = f" ({describe_recurrence(r.recurrence)})" if r.recurrence and section == "s" else ""
+        lines.append(f"{emoji} `{r.id}` — {local_due}{repeat} — {r.text}")
+    if not rows:
+        lines.append("No upcoming reminders. Try /setreminder" if section == "s" else "Nothing here yet.")
+    if next_cursor:
+        button = InlineKeyboardButton("Next page ›", callback_data=f"rp:{section}:{next_cursor}")
+    elif section == "s":
+        button = InlineKeyboardButton("History ›", callback_data="rp:d:")
+    elif section == "d":
+        button = InlineKeyboardButton("Archive ›", callback_data="rp:a:")
+    else:
+        return "\n".join(lines), None
+    return "\n".join(lines), InlineKeyboardMarkup([[button]])
+
+@timed_handler
 async def list_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.effective_chat is None or update.message is None:
         return
     chat_id = update.effective_chat.id
-    tz = get_user_timezone(chat_id) or DEFAULT_TZ
-    tzinfo = ZoneInfo(tz)
-    rows = []
-    now = datetime.now(tzinfo)
-    for r in load_reminders():
-        if r.get("chat_id") != chat_id:
-            continue
-        if r.get("status") not in ("scheduled", "done"):
-            continue
-        due_at = dtparser.isoparse(r["due_at"])
-        if due_at.tzinfo is None:
-            due_at = due_at.replace(tzinfo=tzinfo)
-        local_due = due_at.astimezone(tzinfo).strftime("%Y-%m-%d %H:%M")
-        rows.append((r["id"], r["status"], local_due, r["text"]))
+    text, markup = await _render_reminder_page(chat_id, "s", None)
+    await update.message.reply_text(text, reply_markup=markup)
 
-    if not rows:
-        await update.message.reply_text("You have no reminders yet. Try /setreminder")
+@timed_handler
+async def list_reminders_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    if query is None or query.data is None or update.effective_chat is None:
         return
-
-    rows.sort(key=lambda x: (x[1] != "scheduled", x[2]))  # scheduled first, then by due time
-    lines = ["Your reminders"]
-    for rid, status, due, text in rows[:50]:
-        emoji = "🟢" if status == "scheduled" else "✅"
-        lines.append(f"{emoji} `{rid}` — {due} — {text}")
-    await update.message.reply_text("\n".join(lines))
+    await query.answer()
+    _, section, cursor = query.data.split(":", 2)
+    if section not in _LIST_SECTIONS:
+        return
+    text, markup = await _render_reminder_page(update.effective_chat.id, section, cursor or None)
+    await query.edit_message_text(text, reply_markup=markup)
 
 
+@timed_handler
 async def delete_reminder_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.message is None:
         return
@@ -292,59 +300,169 @@ async def delete_reminder_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("Usage: /deletereminder <id>")
         return
     rid = context.args[0].strip()
-    # cancel job if present
-    if context.job_queue is not None:
-        jobs = context.job_queue.get_jobs_by_name(f"rem:{rid}")
-        for j in jobs:
-            j.schedule_removal()
+    scheduler = context.bot_data.get("scheduler")
+    if scheduler is not None:
+        scheduler.cancel(rid)
 
-    ok = delete_reminder(rid)
+    ok = await delete_reminder(rid)
     if ok:
         await update.message.reply_text(f"Deleted reminder {rid}")
     else:
         await update.message.reply_text("Couldn't find that reminder ID.")
 
-# ---- bootstrapping: reschedule persisted reminders ----
-async def _reschedule_persisted(app: Application) -> None:
-    all_rems = load_reminders()
-    now_utc = datetime.utcnow()
-    count = 0
-    for r in all_rems:
-        if r.get("status") != "scheduled":
-            continue
-        rid = r["id"]
-        chat_id = r["chat_id"]
-        text = r["text"]
-        due_at = dtparser.isoparse(r["due_at"])
-        # If timezone-naive in file, assume DEFAULT_TZ to be safe
-        if due_at.tzinfo is None:
-            due_at = due_at.replace(tzinfo=ZoneInfo(os.getenv("DEFAULT_TZ", "Asia/Ho_Chi_Minh")))
-        if due_at.astimezone(ZoneInfo("UTC")).replace(tzinfo=None) <= now_utc:
-            # In the past; mark as done (we missed it)
-            update_reminder_status(rid, "done")
-            continue
-        job_name = f"rem:{rid}"
-        # Avoid duplicate scheduling if job exists
-        if app.job_queue is not None and app.job_queue.get_jobs_by_name(job_name):
-            continue
-        if app.job_queue is not None:
-            app.job_queue.run_once(reminder_job, when=due_at, chat_id=chat_id, name=job_name, data={"id": rid, "text": text})
-            count += 1
-    print(f"[bootstrap] Rescheduled {count} reminders.")
+# ---- habits ----
+# Stats come straight from each habit's summary document, never from its history
 
-def main() -> None:
+async def _today(chat_id: int) -> date:
+    return datetime.now(await users.zone(chat_id)).date()
+
+def _habit_stats(h: Habit, today: date) -> str:
+    week = "".join("✅" if done else "▫️" for done in h.days(today))
+    return (
+        f"🔥 {h.current_streak(today)}-day streak (best {h.longest}) · "
+        f"{round(h.week_rate(today) * 100)}% of the last 7 days {week}"
+    )
+
+async def _check_in(chat_id: int, habit_id: str) -> str:
+    today = await _today(chat_id)
+    habit, counted = await check_in_habit(chat_id, habit_id, today)
+    if habit is None:
+        return "Couldn't find that habit. See /habits"
+    head = f"Checked in: {habit.name}" if counted else f"Already checked in today: {habit.name}"
+    return f"{head}\n{_habit_stats(habit, today)}"
+
+@timed_handler
+async def new_habit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_chat is None or update.message is None:
+        return
+    name = " ".join(context.args or []).strip()
+    if not name:
+        await update.message.reply_text("Usage: /newhabit <name>, e.g. /newhabit read 20 pages")
+        return
+    chat_id = update.effective_chat.id
+    if any(h.name.lower() == name.lower() for h in await list_habits(chat_id)):
+        await update.message.reply_text("You already track that habit. See /habits")
+        return
+    habit = Habit(id=uuid.uuid4().hex[:8], chat_id=chat_id, name=name, created_at=datetime.now(timezone.utc))
+    await add_habit(habit)
+    await update.message.reply_text(f"Tracking `{habit.id}` — {name}. Check in each day with /checkin {name}")
+
+@timed_handler
+async def checkin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_chat is None or update.message is None:
+        return
+    chat_id = update.effective_chat.id
+    habits = await list_habits(chat_id)
+    if not habits:
+        await update.message.reply_text("No habits yet. Start one with /newhabit <name>")
+        return
+    wanted = " ".join(context.args or []).strip().lower()
+    if wanted:
+        matches = [h for h in habits if wanted in (h.id, h.name.lower())]
+        if not matches:
+            await update.message.reply_text("Couldn't find that habit. See /habits")
+            return
+        habit = matches[0]
+    elif len(habits) == 1:
+        habit = habits[0]
+    else:
+        today = await _today(chat_id)
+        buttons = [
+            [InlineKeyboardButton(("✅ " if h.last_day == today else "") + h.name, callback_data=f"hc:{h.id}")]
+            for h in habits
+        ]
+        await update.message.reply_text("Which habit?", reply_markup=InlineKeyboardMarkup(buttons))
+        return
+    await update.message.reply_text(await _check_in(chat_id, habit.id))
+
+@timed_handler
+async def checkin_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    if query is None or query.data is None or update.effective_chat is None:
+        return
+    await query.answer()
+    await query.edit_message_text(await _check_in(update.effective_chat.id, query.data[len("hc:"):]))
+
+@timed_handler
+async def habits_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_chat is None or update.message is None:
+        return
+    chat_id = update.effective_chat.id
+    habits = await list_habits(chat_id)
+    if not habits:
+        await update.message.reply_text("No habits yet. Start one with /newhabit <name>")
+        return
+    today = await _today(chat_id)
+    lines = ["Your habits"]
+    for h in habits:
+        lines.append(f"`{h.id}` — {h.name} ({h.total} check-ins)\n{_habit_stats(h, today)}")
+    await update.message.reply_text("\n".join(lines))
+
+@timed_handler
+async def delete_habit_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_chat is None or update.message is None:
+        return
+    if not context.args:
+        await update.message.reply_text("Usage: /deletehabit <id>")
+        return
+    hid = context.args[0].strip()
+    if await delete_habit(update.effective_chat.id, hid):
+        await update.message.reply_text(f"Deleted habit {hid}")
+    else:
+        await update.message.reply_text("Couldn't find that habit ID.")
+
+# ---- bootstrapping: start the scheduler ----
+async def _start_scheduler(app: Application) -> None:
+    if USE_MONGO:
+        # Fail fast on a bad URI and get index creation out of the first handler's way
+        from db import connect_async, ready_async_db, startup_stats
+        await connect_async()
+        await ready_async_db()
+        print(f"[bootstrap] Mongo ready: {startup_stats()}")
+    scheduler = Scheduler(fetch_due, lambda ids: dispatch_due(app, ids))
+    app.bot_data["scheduler"] = scheduler
+    # Only the first horizon is loaded; later reminders come in with each refill
+    loaded = await scheduler.refill()
+    scheduler.start()
+    if await serve_metrics() is not None:
+        print("[bootstrap] Metrics served on METRICS_PORT.")
+    print(f"[bootstrap] Scheduler loaded {loaded} reminders due within {scheduler.horizon:.0f}s.")
+    app.bot_data["retention"] = asyncio.create_task(archive_loop())
+
+async def _stop_scheduler(app: Application) -> None:
+    scheduler = app.bot_data.get("scheduler")
+    if scheduler is not None:
+        await scheduler.stop()
+    retention = app.bot_data.get("retention")
+    if retention is not None:
+        retention.cancel()
+
+def build_application() -> Application:
+    """The bot with all handlers, shared by polling (``main``) and the webhook (api/webhook.py)."""
     if TOKEN is None:
         raise RuntimeError("TELEGRAM_TOKEN environment variable not set. Put it in .env")
-    application = Application.builder().token(TOKEN).build()
+    persistence = StoragePersistence()
+    builder = Application.builder().token(TOKEN).application_class(SessionApplication).persistence(persistence)
+    if CONCURRENCY > 1:
+        # Chats are served in parallel; each chat's updates still run one at a time
+        builder = builder.concurrent_updates(ChatOrderedUpdateProcessor())
+    application = builder.build()
 
     # Basic commands
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_))
     application.add_handler(CommandHandler("timezone", timezone_cmd))
     application.add_handler(CommandHandler("reminders", list_reminders))
+    application.add_handler(CallbackQueryHandler(list_reminders_page, pattern=r"^rp:"))
     application.add_handler(CommandHandler("deletereminder", delete_reminder_cmd))
-
-    # Conversation: /setreminder
+    application.add_handler(CommandHandler("newhabit", new_habit))
+    application.add_handler(CommandHandler("checkin", checkin_cmd))
+    application.add_handler(CallbackQueryHandler(checkin_button, pattern=r"^hc:"))
+    application.add_handler(CommandHandler("habits", habits_cmd))
+    application.add_handler(CommandHandler("deletehabit", delete_habit_cmd))
+    application.add_handler(ChatMemberHandler(chat_member_changed, ChatMemberHandler.MY_CHAT_MEMBER))
+
+    # Conversation: /setreminder, resumable on any instance
     conv = ConversationHandler(
         entry_points=[CommandHandler("setreminder", setreminder_entry)],
         states={
@@ -352,11 +470,19 @@ def main() -> None:
             ASK_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, setreminder_confirm)],
         },
         fallbacks=[CommandHandler("cancel", cancel_flow)],
+        name="setreminder",
+        persistent=True,
     )
+    application.add_handler(conversation_sync(persistence, conv), group=-1)
     application.add_handler(conv)
+    return application
+
+def main() -> None:
+    application = build_application()
 
-    # Bootstrap: reschedule persisted reminders after start
-    application.post_init = _reschedule_persisted  # type: ignore
+    # Bootstrap: load the first scheduling window after start
+    application.post_init = _start_scheduler  # type: ignore
+    application.post_shutdown = _stop_scheduler  # type: ignore
 
     print("Bot is starting...")
     application.run_polling(close_loop=False)
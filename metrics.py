@@ -0,0 +1,200 @@
+from __future__ import annotations
+import asyncio
+import bisect
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Process-local counters, gauges and histograms, rendered in the Prometheus
+# text format by ``render()``. Served at /metrics by the cron app, and by the
+# polling bot on METRICS_PORT when set. With METRICS_LOG=1 every observation is
+# also written as one JSON line to the "gretchen.metrics" logger.
+
+LOG_ENABLED = os.getenv("METRICS_LOG", "0") == "1"
+PORT = int(os.getenv("METRICS_PORT", "0"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LAG_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 900, 3600)
+
+log = logging.getLogger("gretchen.metrics")
+if LOG_ENABLED and not log.handlers:
+    log.addHandler(logging.StreamHandler())
+    log.setLevel(logging.INFO)
+_lock = threading.Lock()
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt(name: str, labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return name
+    body = ",".join(f'{k}="{v}"' for k, v in pairs)
+    return f"{name}{{{body}}}"
+
+
+def _log(name: str, labels: Labels, value: float) -> None:
+    if LOG_ENABLED:
+        log.info(json.dumps({"metric": name, **dict(labels), "value": round(value, 6), "ts": time.time()}))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_: str) -> None:
+        self.name, self.help = name, help_
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = _labels(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _log(self.name, key, amount)
+
+    def samples(self) -> List[str]:
+        return [f"{_fmt(self.name, k)} {v}" for k, v in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = _labels(labels)
+        with _lock:
+            self._values[key] = value
+        _log(self.name, key, value)
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.name, self.help, self.buckets = name, help_, buckets
+        # per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _labels(labels)
+        with _lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+        _log(self.name, key, value)
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        out = []
+        for key, (counts, total) in sorted(self._values.items()):
+            running = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                running += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                out.append(f"{_fmt(self.name + '_bucket', key, ('le', le))} {running}")
+            out.append(f"{_fmt(self.name + '_sum', key)} {total[0]}")
+            out.append(f"{_fmt(self.name + '_count', key)} {running}")
+        return out
+
+
+_registry: List[Any] = []
+
+
+def _register(metric: Any) -> Any:
+    _registry.append(metric)
+    return metric
+
+
+handler_seconds = _register(Histogram("gretchen_handler_seconds", "Bot handler duration"))
+handler_errors = _register(Counter("gretchen_handler_errors_total", "Bot handlers that raised"))
+storage_seconds = _register(Histogram("gretchen_storage_seconds", "Storage call duration"))
+storage_errors = _register(Counter("gretchen_storage_errors_total", "Storage calls that raised"))
+send_seconds = _register(Histogram("gretchen_telegram_send_seconds", "Telegram sendMessage duration"))
+send_errors = _register(Counter("gretchen_telegram_errors_total", "Telegram send errors by type"))
+delivery_lag = _register(Histogram("gretchen_delivery_lag_seconds", "Send time minus due time", LAG_BUCKETS))
+delivered = _register(Counter("gretchen_delivered_total", "Reminders delivered"))
+delivery_failed = _register(Counter("gretchen_delivery_failed_total", "Reminders that could not be delivered"))
+dead_lettered = _register(Counter("gretchen_dead_letter_total", "Reminders given up on after repeated or permanent failures"))
+chats_blocked = _register(Counter("gretchen_chats_blocked_total", "Chats found unreachable (bot blocked, chat deleted)"))
+queue_depth = _register(Gauge("gretchen_queue_depth", "Reminders waiting, by queue"))
+cron_seconds = _register(Histogram("gretchen_cron_run_seconds", "process_due duration"))
+
+
+def render() -> str:
+    lines = []
+    for m in _registry:
+        lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        lines.extend(m.samples())
+    return "\n".join(lines) + "\n"
+
+
+def timed_handler(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Record duration and failures of an async bot handler, labelled by its name."""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            handler_errors.inc(handler=name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, handler=name)
+    return wrapper
+
+
+def timed_storage(fn: Callable[..., Any]) -> Callable[..., Any]:
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            storage_errors.inc(op=name)
+            raise
+        finally:
+            storage_seconds.observe(time.perf_counter() - started, op=name)
+    return wrapper
+
+
+async def serve(port: int = PORT) -> Optional[asyncio.AbstractServer]:
+    """Expose ``render()`` over HTTP on ``port`` (any path) for the long-running bot."""
+    if not port:
+        return None
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = render().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nConnection: close\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "0.0.0.0", port)
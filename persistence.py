@@ -0,0 +1,167 @@
+from __future__ import annotations
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application, BasePersistence, ContextTypes, ConversationHandler, PersistenceInput, TypeHandler
+from telegram.ext._utils.types import ConversationDict, ConversationKey, CDCData
+
+from astorage import get_session, set_session
+
+# Shares /setreminder conversations and user_data between bot instances (and
+# across restarts) through the configured storage backend's ``sessions``.
+#
+# PTB loads persisted state once at startup and writes it back every
+# ``update_interval``; that is not enough when several stateless instances take
+# turns on one chat. So nothing is preloaded: user_data is re-read per update
+# through ``refresh_user_data``, conversation state by the group -1 handler from
+# ``conversation_sync``, and ``SessionApplication`` writes both back as soon as
+# each update has been handled.
+
+
+def _encode(value: Any) -> Any:
+    # Session values must survive both JSON and BSON: datetimes keep their zone
+    # as an ISO string instead of being normalized to UTC by the driver.
+    if isinstance(value, datetime):
+        return {"__dt__": value.isoformat()}
+    if isinstance(value, dict):
+        return {str(k): _encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    return value
+
+
+def _decode(value: Any) -> Any:
+    if isinstance(value, dict):
+        if set(value) == {"__dt__"}:
+            return datetime.fromisoformat(value["__dt__"])
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def _user_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def _conv_key(name: str, key: ConversationKey) -> str:
+    return "conv:" + name + ":" + ":".join(str(k) for k in key)
+
+
+class StoragePersistence(BasePersistence):
+    """user_data and conversation states in storage; chat, bot and callback data are not kept."""
+
+    def __init__(self) -> None:
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+        )
+        # Last value written per session key, so unchanged data is not rewritten
+        self._written: Dict[str, Any] = {}
+
+    async def _write(self, key: str, data: Optional[Dict[str, Any]]) -> None:
+        if key in self._written and self._written[key] == data:
+            return
+        await set_session(key, data)
+        self._written[key] = data
+
+    # ---- user_data ----
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        stored = await get_session(_user_key(user_id))
+        self._written[_user_key(user_id)] = stored or {}
+        user_data.clear()
+        user_data.update(_decode(stored or {}))
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        await self._write(_user_key(user_id), _encode(data))
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self._write(_user_key(user_id), None)
+
+    # ---- conversations ----
+    async def get_conversations(self, name: str) -> ConversationDict:
+        return {}
+
+    async def load_conversation(self, name: str, key: ConversationKey) -> Optional[object]:
+        stored = await get_session(_conv_key(name, key))
+        self._written[_conv_key(name, key)] = stored
+        return stored["state"] if stored else None
+
+    async def update_conversation(self, name: str, key: ConversationKey, new_state: Optional[object]) -> None:
+        await self._write(_conv_key(name, key), None if new_state is None else {"state": new_state})
+
+    # ---- not persisted ----
+    async def get_chat_data(self) -> Dict[int, Any]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def get_callback_data(self) -> Optional[CDCData]:
+        return None
+
+    async def update_chat_data(self, chat_id: int, data: Any) -> None:
+        pass
+
+    async def update_bot_data(self, data: Any) -> None:
+        pass
+
+    async def update_callback_data(self, data: CDCData) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Any) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Any) -> None:
+        pass
+
+    async def flush(self) -> None:
+        pass
+
+
+def _key(conv: ConversationHandler, update: Update) -> Optional[Tuple[int, ...]]:
+    # Mirrors ConversationHandler's own key for per_chat/per_user conversations
+    if conv.per_message or update.effective_chat is None or update.effective_user is None:
+        return None
+    key = []
+    if conv.per_chat:
+        key.append(update.effective_chat.id)
+    if conv.per_user:
+        key.append(update.effective_user.id)
+    return tuple(key)
+
+
+def conversation_sync(persistence: StoragePersistence, *convs: ConversationHandler) -> TypeHandler:
+    """A handler for group -1 that loads each conversation's stored state for the
+    incoming update, so whichever instance receives it continues where another left off."""
+
+    async def sync(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        for conv in convs:
+            key = _key(conv, update)
+            if key is None or conv.name is None:
+                continue
+            state = await persistence.load_conversation(conv.name, key)
+            # PTB exposes no public setter; write past the change tracking so
+            # the load itself is not persisted back.
+            tracked = conv._conversations  # type: ignore[attr-defined]
+            if state is None:
+                tracked.data.pop(key, None)
+            else:
+                tracked.update_no_track({key: state})
+
+    return TypeHandler(Update, sync)
+
+
+class SessionApplication(Application):
+    """Flushes persistence after every update instead of on a timer."""
+
+    async def process_update(self, update: object) -> None:
+        await super().process_update(update)
+        if self.persistence is not None:
+            await self.update_persistence()
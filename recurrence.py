@@ -0,0 +1,188 @@
+from __future__ import annotations
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+# A recurrence rule is stored on the reminder as ``recurrence``:
+#   {"freq": "hourly" | "daily" | "weekly", "interval": n, "at": "HH:MM"}
+#   {"cron": "<minute> <hour> <day-of-month> <month> <day-of-week>"}
+# Only the next occurrence is ever computed; nothing is pre-materialized.
+
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+_EVERY_RE = re.compile(
+    r"(?:every\s+(?:(?P<n>\d+)\s*)?(?P<unit>hours?|days?|weeks?|(?:mon|tues?|wed(?:nes)?|thu(?:rs?)?|fri|sat(?:ur)?|sun)(?:day)?)"
+    r"|(?P<adverb>hourly|daily|weekly))"
+    r"(?:\s+at)?(?:\s+(?P<hh>\d{1,2}):(?P<mm>\d{2}))?"
+)
+_CRON_RE = re.compile(r"cron\s+(?P<expr>\S+\s+\S+\s+\S+\s+\S+\s+\S+)")
+
+
+# ---- cron expressions ----
+def _cron_field(spec: str, lo: int, hi: int) -> Set[int]:
+    values: Set[int] = set()
+    for part in spec.split(","):
+        base, _, step = part.partition("/")
+        if base == "*":
+            start, end = lo, hi
+        elif "-" in base:
+            a, b = base.split("-", 1)
+            start, end = int(a), int(b)
+        else:
+            start = end = int(base)
+            if step:
+                end = hi
+        if start < lo or end > hi or start > end:
+            raise ValueError(f"cron field {part!r} out of range {lo}-{hi}")
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return values
+
+
+def parse_cron(expr: str) -> Tuple[Set[int], Set[int], Set[int], Set[int], Set[int], bool, bool]:
+    fields = expr.split()
+    if len(fields) != 5:
+        raise ValueError("cron expression needs 5 fields")
+    minute, hour, dom, month, dow = fields
+    dows = {d % 7 for d in _cron_field(dow, 0, 7)}  # 0 and 7 are both Sunday
+    return (
+        _cron_field(minute, 0, 59), _cron_field(hour, 0, 23), _cron_field(dom, 1, 31),
+        _cron_field(month, 1, 12), dows, dom != "*", dow != "*",
+    )
+
+
+def _next_cron(expr: str, after: datetime) -> datetime:
+    """First wall-clock minute strictly after ``after`` (naive local time) matching ``expr``."""
+    minutes, hours, doms, months, dows, dom_set, dow_set = parse_cron(expr)
+    start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    day = start.date()
+    for _ in range(366 * 5):
+        cron_dow = (day.weekday() + 1) % 7
+        if dom_set and dow_set:  # classic cron: either day field may match
+            day_ok = day.day in doms or cron_dow in dows
+        else:
+            day_ok = day.day in doms and cron_dow in dows
+        if day.month in months and day_ok:
+            for h in sorted(hours):
+                for m in sorted(minutes):
+                    candidate = datetime(day.year, day.month, day.day, h, m)
+                    if candidate >= start:
+                        return candidate
+        day += timedelta(days=1)
+    raise ValueError(f"cron expression {expr!r} never fires")
+
+
+# ---- next occurrence ----
+def next_occurrence(rule: Dict[str, Any], prev: datetime, tz_name: str, now: datetime) -> datetime:
+    """The first occurrence after both ``prev`` and ``now``, as an aware datetime in ``tz_name``.
+
+    Daily, weekly and cron rules step in local wall-clock time so a 09:00
+    reminder stays at 09:00 across DST changes; hourly rules step in absolute
+    time. Occurrences missed while nothing was running are skipped, not replayed.
+    """
+    tz = ZoneInfo(tz_name)
+    prev_local = prev.astimezone(tz) if prev.tzinfo is not None else prev.replace(tzinfo=tz)
+    now_local = now.astimezone(tz)
+    if "cron" in rule:
+        wall = _next_cron(rule["cron"], max(prev_local, now_local).replace(tzinfo=None))
+        return wall.replace(tzinfo=tz)
+
+    freq = rule.get("freq")
+    interval = max(1, int(rule.get("interval", 1)))
+    if freq == "hourly":
+        step = timedelta(hours=interval)
+        prev_utc = prev_local.astimezone(timezone.utc)
+        k = max(1, (now - prev_utc) // step + 1)
+        return (prev_utc + k * step).astimezone(tz)
+    if freq in ("daily", "weekly"):
+        days = interval * (7 if freq == "weekly" else 1)
+        wall = prev_local.replace(tzinfo=None)
+        if "at" in rule:
+            # Re-anchor on the intended local time: a 02:30 occurrence pushed to
+            # 03:30 by a spring-forward gap must come back to 02:30 the next day.
+            hh, mm = map(int, rule["at"].split(":"))
+            wall = wall.replace(hour=hh, minute=mm, second=0, microsecond=0)
+        k = max(1, (now_local.date() - wall.date()).days // days)
+        candidate = (wall + timedelta(days=k * days)).replace(tzinfo=tz)
+        while candidate <= now_local:
+            k += 1
+            candidate = (wall + timedelta(days=k * days)).replace(tzinfo=tz)
+        return candidate
+    raise ValueError(f"unknown recurrence rule {rule!r}")
+
+
+def describe(rule: Dict[str, Any]) -> str:
+    if "cron" in rule:
+        return f"cron {rule['cron']}"
+    interval = int(rule.get("interval", 1))
+    unit = {"hourly": "hour", "daily": "day", "weekly": "week"}[rule["freq"]]
+    return f"every {unit}" if interval == 1 else f"every {interval} {unit}s"
+
+
+# ---- parsing ----
+def parse_recurrence(text: str, tz_name: str, now: Optional[datetime] = None) -> Optional[Tuple[Dict[str, Any], datetime, str]]:
+    """Parse ``every day at 09:00``, ``every 2 hours``, ``weekly``, ``every monday 08:30``,
+    ``cron 0 9 * * 1-5`` and similar into (rule, first occurrence, source).
+
+    Returns None for text that is not a recurrence; raises ValueError for one
+    whose interval runs past the supported date range.
+    """
+    parsed = _parse_recurrence(text, tz_name, now)
+    if parsed is not None and "cron" not in parsed[0]:
+        rule, first, _ = parsed
+        try:
+            next_occurrence(rule, first, tz_name, first)
+        except OverflowError:
+            raise ValueError(f"{describe(rule)} is too far apart") from None
+    return parsed
+
+
+def _parse_recurrence(text: str, tz_name: str, now: Optional[datetime]) -> Optional[Tuple[Dict[str, Any], datetime, str]]:
+    text = text.strip().lower()
+    tz = ZoneInfo(tz_name)
+    now = (now or datetime.now(timezone.utc)).astimezone(tz)
+
+    m = _CRON_RE.fullmatch(text)
+    if m:
+        expr = " ".join(m.group("expr").split())
+        try:
+            first = _next_cron(expr, now.replace(tzinfo=None)).replace(tzinfo=tz)
+        except ValueError:
+            return None
+        return {"cron": expr}, first, f"cron {expr}"
+
+    m = _EVERY_RE.fullmatch(text)
+    if not m:
+        return None
+    unit = (m.group("unit") or m.group("adverb"))[:3]
+    interval = int(m.group("n") or 1)
+    if interval < 1:
+        return None
+    hh, mm = m.group("hh"), m.group("mm")
+    if hh is not None and (int(hh) > 23 or int(mm) > 59):
+        return None
+
+    if unit == "hou":
+        if hh is not None:
+            return None
+        rule = {"freq": "hourly", "interval": interval}
+        try:
+            first = now.replace(second=0, microsecond=0) + timedelta(hours=interval)
+        except OverflowError:
+            raise ValueError(f"{describe(rule)} is too far apart") from None
+        return rule, first, describe(rule)
+
+    at_h, at_m = (int(hh), int(mm)) if hh is not None else (now.hour, now.minute)
+    if unit in WEEKDAYS:
+        rule = {"freq": "weekly", "interval": interval}
+        days_ahead = (WEEKDAYS.index(unit) - now.weekday()) % 7
+    else:
+        rule = {"freq": "weekly" if unit == "wee" else "daily", "interval": interval}
+        days_ahead = 0
+    rule["at"] = f"{at_h:02d}:{at_m:02d}"
+    wall = (now.replace(tzinfo=None) + timedelta(days=days_ahead)).replace(hour=at_h, minute=at_m, second=0, microsecond=0)
+    first = wall.replace(tzinfo=tz)
+    if first <= now:
+        first = (wall + timedelta(days=7 if rule["freq"] == "weekly" else 1)).replace(tzinfo=tz)
+    source = describe(rule) + (f" on {unit.title()}" if unit in WEEKDAYS else "") + f" at {at_h:02d}:{at_m:02d}"
+    return rule, first, source
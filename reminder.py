@@ -0,0 +1,117 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from zoneinfo import ZoneInfo
+
+from sharding import shard_of
+from timeutil import DEFAULT_TZ, next_run_at, to_utc, utc_iso
+
+# Stored reminder documents carry a schema version in ``v``:
+#   0 (no ``v``): legacy rows; ``due_at`` is the source of truth and may be
+#     naive (meaning the reminder's own timezone), ``nextRunAt`` may be missing.
+#   1: ``nextRunAt`` is always set, in UTC (a native datetime in Mongo, a
+#     fixed-width ISO string in JSON); ``due_at`` is kept, in local time, for
+#     older readers.
+SCHEMA_VERSION = 1
+
+
+def _utc(value: Any) -> Optional[datetime]:
+    if isinstance(value, str) and value.endswith("+00:00"):
+        return datetime.fromisoformat(value)  # the common case, already UTC
+    return to_utc(value, "UTC")
+
+
+@dataclass(slots=True)
+class Reminder:
+    """A reminder as the bot and the cron see it, parsed once at the storage boundary.
+
+    ``due`` is an aware UTC datetime and ``epoch`` its POSIX timestamp, for
+    cheap sorting. While a failed send waits for its retry, ``due`` is the
+    retry time and ``occurrence`` the scheduled time it stands for (kept in
+    ``due_at``); otherwise the two are the same. Storage-only fields (leases, shard, archivedAt) stay in the
+    documents and are not carried here. Treat instances as read-only: changes
+    go through the storage functions.
+    """
+
+    id: str
+    chat_id: int
+    text: str
+    due: datetime
+    timezone: str = DEFAULT_TZ
+    status: str = "scheduled"
+    recurrence: Optional[Dict[str, Any]] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    attempts: int = 0  # failed sends so far, reset when a recurring reminder advances
+    occurrence: Optional[datetime] = None
+    epoch: float = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        if self.due.tzinfo is not timezone.utc:
+            if self.due.tzinfo is None:
+                raise ValueError("Reminder.due must be timezone-aware")
+            self.due = self.due.astimezone(timezone.utc)
+        self.epoch = self.due.timestamp()
+        if self.occurrence is None:
+            self.occurrence = self.due
+        elif self.occurrence.tzinfo is not timezone.utc:
+            self.occurrence = self.occurrence.astimezone(timezone.utc)
+
+    @property
+    def local_due(self) -> datetime:
+        """``occurrence`` in the reminder's own timezone, the anchor for recurrence."""
+        return self.occurrence.astimezone(ZoneInfo(self.timezone))
+
+    @property
+    def shard(self) -> int:
+        return shard_of(self.chat_id)
+
+    @classmethod
+    def from_doc(cls, doc: Dict[str, Any]) -> "Reminder":
+        tz = doc.get("timezone") or DEFAULT_TZ
+        if doc.get("v", 0) >= 1:
+            due = doc["nextRunAt"]
+            if isinstance(due, str):
+                due = datetime.fromisoformat(due)
+        else:
+            due = next_run_at({**doc, "timezone": tz})
+        if due is None:
+            raise ValueError(f"reminder {doc.get('id')!r} has no due time")
+        return cls(
+            id=doc["id"],
+            chat_id=doc["chat_id"],
+            text=doc.get("text", ""),
+            due=due,
+            timezone=tz,
+            status=doc.get("status", "scheduled"),
+            recurrence=doc.get("recurrence") or None,
+            # Always written in UTC, with or without an offset
+            created_at=_utc(doc.get("created_at")),
+            updated_at=_utc(doc.get("updated_at")),
+            attempts=doc.get("attempts", 0),
+            # Retries move nextRunAt only; due_at still holds the occurrence
+            occurrence=to_utc(doc["due_at"], tz) if doc.get("attempts") and doc.get("due_at") else None,
+        )
+
+    def to_doc(self, native: bool) -> Dict[str, Any]:
+        """The stored form: ``native`` datetimes for Mongo, ISO strings for JSON."""
+        now = datetime.now(timezone.utc)
+        doc: Dict[str, Any] = {
+            "v": SCHEMA_VERSION,
+            "id": self.id,
+            "chat_id": self.chat_id,
+            "text": self.text,
+            "due_at": self.local_due.isoformat(),
+            "timezone": self.timezone,
+            "status": self.status,
+            "created_at": (self.created_at or now).isoformat(),
+            "updated_at": (self.updated_at or now).isoformat(),
+            "nextRunAt": self.due if native else utc_iso(self.due),
+            "shard": self.shard,
+        }
+        if self.recurrence:
+            doc["recurrence"] = self.recurrence
+        if self.attempts:
+            doc["attempts"] = self.attempts
+        return doc
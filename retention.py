@@ -0,0 +1,35 @@
+from __future__ import annotations
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from astorage import archive_done
+
+# Done reminders older than ARCHIVE_AFTER_DAYS (by due time) move from the hot
+# reminders store to the archive, so due scans, listings and the JSON snapshot
+# only carry pending work. /reminders still pages through the archive.
+
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "7"))
+ARCHIVE_EVERY_HOURS = float(os.getenv("ARCHIVE_EVERY_HOURS", "6"))
+ARCHIVE_BATCH = 5000
+
+
+async def archive_old(now: Optional[datetime] = None) -> int:
+    """Archive every eligible done reminder, in batches; returns how many moved."""
+    before = (now or datetime.now(timezone.utc)) - timedelta(days=ARCHIVE_AFTER_DAYS)
+    total = 0
+    while True:
+        moved = await archive_done(before, ARCHIVE_BATCH)
+        total += moved
+        if moved < ARCHIVE_BATCH:
+            return total
+
+
+async def archive_loop() -> None:
+    """For the polling bot: archive now, then every ARCHIVE_EVERY_HOURS."""
+    while True:
+        moved = await archive_old()
+        if moved:
+            print(f"[retention] Archived {moved} done reminders.")
+        await asyncio.sleep(ARCHIVE_EVERY_HOURS * 3600)
@@ -0,0 +1,129 @@
+from __future__ import annotations
+import asyncio
+import heapq
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import metrics
+from reminder import Reminder
+
+HORIZON_SECONDS = float(os.getenv("SCHEDULER_HORIZON_SECONDS", "600"))
+WINDOW_LIMIT = int(os.getenv("SCHEDULER_WINDOW_LIMIT", "10000"))
+# Reminders due within this many seconds of each other go out in one batch
+BATCH_SLACK = float(os.getenv("SCHEDULER_BATCH_SLACK_SECONDS", "0.5"))
+
+
+class Scheduler:
+    """In-process timer for the polling bot.
+
+    Only reminders due within the next ``horizon`` seconds are held, in a
+    min-heap of (due epoch, id). The window is refilled from storage's
+    ``fetch_due`` every half horizon, capped at ``window_limit`` rows, so memory
+    and startup time stay bounded however many reminders are scheduled further
+    out. Everything that falls due together is handed to ``dispatch`` as one
+    batch of ids; the dispatcher claims and sends them. ``fetch_due`` also
+    returns reminders whose lease has expired, so rows left ``sending`` by a
+    crashed worker come back with the next refill.
+
+    ``add`` is O(log n); ``cancel`` is O(1) with the stale heap entry dropped
+    lazily when it surfaces.
+    """
+
+    def __init__(
+        self,
+        fetch_due: Callable[[datetime, int], Awaitable[List[Reminder]]],
+        dispatch: Callable[[List[str]], Awaitable[Any]],
+        horizon: float = HORIZON_SECONDS,
+        window_limit: int = WINDOW_LIMIT,
+    ) -> None:
+        self._fetch_due = fetch_due
+        self._dispatch = dispatch
+        self.horizon = horizon
+        self.window_limit = window_limit
+        self._heap: List[Tuple[float, str]] = []
+        self._live: Dict[str, float] = {}
+        self._horizon_end = 0.0
+        self._next_refill = 0.0
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    # ---- mutation ----
+    def add(self, rid: str, due: datetime) -> None:
+        """Track ``rid`` if it falls inside the loaded window; later ones arrive with a refill."""
+        at = due.timestamp()
+        if at > self._horizon_end or self._live.get(rid) == at:
+            return
+        self._live[rid] = at
+        heapq.heappush(self._heap, (at, rid))
+        if self._heap[0][1] == rid:
+            self._wake.set()
+
+    def cancel(self, rid: str) -> None:
+        self._live.pop(rid, None)
+        if len(self._heap) > 2 * len(self._live) + 1024:
+            self._heap = [(at, r) for at, r in self._heap if self._live.get(r) == at]
+            heapq.heapify(self._heap)
+
+    # ---- loop ----
+    async def refill(self) -> int:
+        now = time.time()
+        until = datetime.fromtimestamp(now + self.horizon, timezone.utc)
+        rows = await self._fetch_due(until, self.window_limit)
+        # A full window means more is due than we keep in memory: only trust
+        # it up to the last row fetched and come back for the rest sooner.
+        if len(rows) >= self.window_limit:
+            self._horizon_end = rows[-1].epoch
+        else:
+            self._horizon_end = until.timestamp()
+        for r in rows:
+            self.add(r.id, r.due)
+        self._next_refill = min(now + self.horizon / 2, max(self._horizon_end, now + 1))
+        return len(rows)
+
+    def _pop_due(self, now: float) -> List[str]:
+        batch = []
+        while self._heap and self._heap[0][0] <= now + BATCH_SLACK:
+            at, rid = heapq.heappop(self._heap)
+            if self._live.get(rid) == at:
+                del self._live[rid]
+                batch.append(rid)
+        return batch
+
+    async def run(self) -> None:
+        while True:
+            now = time.time()
+            if now >= self._next_refill:
+                await self.refill()
+            batch = self._pop_due(now)
+            if batch:
+                # Don't let a slow send hold up the timer
+                task = asyncio.create_task(self._dispatch(batch))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+            metrics.queue_depth.set(len(self._live), queue="scheduler")
+            head = self._heap[0][0] if self._heap else float("inf")
+            delay = max(0.0, min(head, self._next_refill) - time.time())
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
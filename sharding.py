@@ -0,0 +1,32 @@
+from __future__ import annotations
+from typing import Any, Dict, Optional, Tuple
+
+# Reminders are partitioned by chat so one chat's reminders always land on the
+# same worker, which keeps them in order. Each reminder stores its bucket in
+# ``shard`` (|chat_id| mod SHARD_BUCKETS, computable inside Mongo for
+# backfills); worker i of n takes the buckets with ``shard % n == i``, so any
+# worker count partitions the due set without rewriting stored buckets.
+
+SHARD_BUCKETS = 1024
+
+Shard = Tuple[int, int]  # (index, count)
+
+
+def shard_of(chat_id: int) -> int:
+    return abs(int(chat_id)) % SHARD_BUCKETS
+
+
+def in_shard(rem: Dict[str, Any], shard: Optional[Shard]) -> bool:
+    if shard is None:
+        return True
+    index, count = shard
+    bucket = rem.get("shard")
+    if bucket is None:
+        bucket = shard_of(rem["chat_id"])
+    return bucket % count == index
+
+
+def check_shard(index: int, count: int) -> Optional[Shard]:
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"shard {index} out of range for {count} shards")
+    return None if count == 1 else (index, count)
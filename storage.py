@@ -1,68 +1,349 @@
 from __future__ import annotations
-import json
+import heapq
+import itertools
+import os
 from pathlib import Path
-from typing import Any, Dict, List, Optional
-from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+from datetime import date, datetime, timedelta, timezone
+from habit import Habit
+from journal import Journal
+from reminder import Reminder
+from sharding import Shard, in_shard
+from timeutil import decode_cursor, encode_cursor, next_run_at, utc_iso
 
-DATA_DIR = Path(__file__).parent / "data"
+DATA_DIR = Path(os.getenv("JSON_DATA_DIR") or Path(__file__).parent / "data")
 REM_FILE = DATA_DIR / "reminders.json"
 USR_FILE = DATA_DIR / "users.json"
+SES_FILE = DATA_DIR / "sessions.json"
+ARC_FILE = DATA_DIR / "reminders_archive.json"
+HAB_FILE = DATA_DIR / "habits.json"
+CHK_FILE = DATA_DIR / "habit_checkins.json"
 
-def _ensure_files():
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    if not REM_FILE.exists():
-        REM_FILE.write_text("[]", encoding="utf-8")
-    if not USR_FILE.exists():
-        USR_FILE.write_text("{}", encoding="utf-8")
+# reminders.json / users.json hold the last compacted snapshot; changes since
+# then are appended to reminders.log.jsonl / users.log.jsonl (see journal.py).
+_reminders = Journal(
+    REM_FILE,
+    key="id",
+    indexes={"status": lambda r: r.get("status"), "chat": lambda r: r.get("chat_id")},
+    # Due queries read a prefix of these instead of sorting every scheduled row
+    ordered={
+        "due": lambda r: _due_key(r) if r.get("status") == "scheduled" else None,
+        "lease": lambda r: r.get("leaseUntil", "") if r.get("status") == "sending" else None,
+    },
+)
+_users = Journal(USR_FILE, key=None)
+# Done reminders past the retention age, moved out of the hot file by archive_done
+_archive = Journal(ARC_FILE, key="id", indexes={"chat": lambda r: r.get("chat_id")})
+# Bot conversation state and user_data, see persistence.py
+_sessions = Journal(SES_FILE, key=None)
+# Habit summaries, and one check-in record per habit and day (history only:
+# stats come from the summary)
+_habits = Journal(HAB_FILE, key="id", indexes={"chat": lambda r: r.get("chat_id")})
+_checkins = Journal(CHK_FILE, key="id", indexes={"habit": lambda r: r.get("habit_id")})
 
-def load_reminders() -> List[Dict[str, Any]]:
-    _ensure_files()
-    with open(REM_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+def load_reminders() -> List[Reminder]:
+    with _reminders.reading() as j:
+        return [Reminder.from_doc(r) for r in j.records.values()]
 
-def save_reminders(reminders: List[Dict[str, Any]]) -> None:
-    _ensure_files()
-    with open(REM_FILE, "w", encoding="utf-8") as f:
-        json.dump(reminders, f, indent=2, ensure_ascii=False)
+def save_reminders(reminders: List[Reminder]) -> None:
+    with _reminders.writing() as j:
+        j.replace_all({r.id: r.to_doc(native=False) for r in reminders})
 
 def load_users() -> Dict[str, Any]:
-    _ensure_files()
-    with open(USR_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with _users.reading() as j:
+        return {k: dict(v) for k, v in j.records.items()}
 
 def save_users(users: Dict[str, Any]) -> None:
-    _ensure_files()
-    with open(USR_FILE, "w", encoding="utf-8") as f:
-        json.dump(users, f, indent=2, ensure_ascii=False)
+    with _users.writing() as j:
+        j.replace_all({k: dict(v) for k, v in users.items()})
 
 def upsert_user_timezone(chat_id: int, tz: str) -> None:
-    users = load_users()
-    users[str(chat_id)] = users.get(str(chat_id), {})
-    users[str(chat_id)]["timezone"] = tz
-    save_users(users)
+    with _users.writing() as j:
+        if not j.update(chat_id, {"timezone": tz}):
+            j.put(chat_id, {"timezone": tz})
 
 def get_user_timezone(chat_id: int) -> Optional[str]:
-    users = load_users()
-    return users.get(str(chat_id), {}).get("timezone")
+    with _users.reading() as j:
+        return j.records.get(str(chat_id), {}).get("timezone")
 
-def add_reminder(rem: Dict[str, Any]) -> None:
-    reminders = load_reminders()
-    reminders.append(rem)
-    save_reminders(reminders)
+def get_session(key: str) -> Optional[Dict[str, Any]]:
+    with _sessions.reading() as j:
+        rec = j.records.get(key)
+        return dict(rec["data"]) if rec else None
+
+def set_session(key: str, data: Optional[Dict[str, Any]]) -> None:
+    """Store ``data`` under ``key``; None deletes it."""
+    with _sessions.writing() as j:
+        if data is None:
+            j.delete(key)
+        elif not j.update(key, {"data": data}):
+            j.put(key, {"data": data})
+
+def add_reminder(rem: Reminder) -> None:
+    with _reminders.writing() as j:
+        j.put(rem.id, rem.to_doc(native=False))
 
 def update_reminder_status(reminder_id: str, status: str) -> None:
-    reminders = load_reminders()
-    for r in reminders:
-        if r["id"] == reminder_id:
-            r["status"] = status
-            r["updated_at"] = datetime.now(timezone.utc).isoformat()
-            break
-    save_reminders(reminders)
+    update_reminders_status([reminder_id], status)
+
+def update_reminders_status(reminder_ids: List[str], status: str) -> None:
+    now = datetime.now(timezone.utc).isoformat()
+    with _reminders.writing() as j:
+        for rid in reminder_ids:
+            j.update(rid, {"status": status, "updated_at": now})
 
 def delete_reminder(reminder_id: str) -> bool:
-    reminders = load_reminders()
-    new_list = [r for r in reminders if r["id"] != reminder_id]
-    changed = len(new_list) != len(reminders)
-    if changed:
-        save_reminders(new_list)
-    return changed
+    with _reminders.writing() as j:
+        return j.delete(reminder_id)
+
+def fetch_due(now: datetime, limit: int = 500) -> List[Reminder]:
+    """Reminders claimable at ``now``, oldest first: scheduled ones with ``nextRunAt <= now``
+    and any whose lease has expired."""
+    cutoff = utc_iso(now)
+    with _reminders.reading() as j:
+        return [Reminder.from_doc(r) for r in _due(j, cutoff, limit)]
+
+def _due_key(r: Dict[str, Any]) -> Optional[str]:
+    key = r.get("nextRunAt")
+    if key is None:  # legacy row written before nextRunAt existed
+        dt = next_run_at(r)
+        key = utc_iso(dt) if dt is not None else None
+    return key
+
+def _claimable(r: Dict[str, Any], cutoff: str) -> bool:
+    if r.get("status") == "scheduled":
+        key = _due_key(r)
+        return key is not None and key <= cutoff
+    # An expired lease means the claiming worker died mid-send
+    return r.get("status") == "sending" and r.get("leaseUntil", "") <= cutoff
+
+def _due(j: Journal, cutoff: str, limit: int, shard: Optional[Shard] = None) -> List[Dict[str, Any]]:
+    # Both ordered indexes stop at the cutoff, so the cost follows the number due
+    due = (j.records[k] for k in j.upto("due", cutoff))
+    # Expired leases are rare; order them by due time and merge them in
+    expired = sorted((j.records[k] for k in j.upto("lease", cutoff)), key=lambda r: _due_key(r) or "")
+    due = heapq.merge(due, expired, key=lambda r: _due_key(r) or "")
+    return list(itertools.islice((r for r in due if in_shard(r, shard)), limit))
+
+def claim_due(
+    now: datetime, limit: int, worker_id: str, lease_seconds: int = 120, shard: Optional[Shard] = None,
+) -> List[Reminder]:
+    """Atomically move up to ``limit`` due reminders to ``sending`` under ``worker_id``.
+
+    Reminders whose lease has expired are reclaimed as well. With ``shard``
+    (index, count) only that partition of chats is considered.
+    """
+    cutoff = utc_iso(now)
+    with _reminders.writing() as j:
+        claimed = _due(j, cutoff, limit, shard=shard)
+        return _lease(j, claimed, now, worker_id, lease_seconds)
+
+def claim_reminders(reminder_ids: Iterable[str], now: datetime, worker_id: str, lease_seconds: int = 120) -> List[Reminder]:
+    """Claim specific reminders, skipping any that another worker holds or has finished."""
+    cutoff = utc_iso(now)
+    with _reminders.writing() as j:
+        rows = [j.records.get(rid) for rid in reminder_ids]
+        claimed = [r for r in rows if r is not None and _claimable(r, cutoff)]
+        return _lease(j, claimed, now, worker_id, lease_seconds)
+
+def _lease(j: Journal, rows: List[Dict[str, Any]], now: datetime, worker_id: str, lease_seconds: int) -> List[Reminder]:
+    lease = {"status": "sending", "leaseUntil": utc_iso(now + timedelta(seconds=lease_seconds)), "workerId": worker_id}
+    ids = [r["id"] for r in rows]
+    for rid in ids:
+        j.update(rid, lease)
+    return [Reminder.from_doc(j.records[rid]) for rid in ids]
+
+def finish_claimed(reminder_ids: Iterable[str], worker_id: str, status: str = "done") -> None:
+    """Settle reminders this worker still holds: ``done`` once sent, ``scheduled`` to release."""
+    now = datetime.now(timezone.utc).isoformat()
+    with _reminders.writing() as j:
+        for rid in reminder_ids:
+            r = j.records.get(rid)
+            if r is not None and r.get("status") == "sending" and r.get("workerId") == worker_id:
+                j.update(rid, {"status": status, "updated_at": now}, unset=["leaseUntil", "workerId"])
+
+def renew_claimed(reminder_ids: Iterable[str], worker_id: str, lease_seconds: int = 120) -> None:
+    """Extend the lease on reminders this worker still holds, for runs that outlast it."""
+    until = utc_iso(datetime.now(timezone.utc) + timedelta(seconds=lease_seconds))
+    with _reminders.writing() as j:
+        for rid in reminder_ids:
+            r = j.records.get(rid)
+            if r is not None and r.get("status") == "sending" and r.get("workerId") == worker_id:
+                j.update(rid, {"leaseUntil": until})
+
+def reschedule_claimed(next_runs: Dict[str, datetime], worker_id: str) -> None:
+    """Return recurring reminders this worker holds to ``scheduled`` at their next occurrence."""
+    now = datetime.now(timezone.utc).isoformat()
+    with _reminders.writing() as j:
+        for rid, due in next_runs.items():
+            r = j.records.get(rid)
+            if r is not None and r.get("status") == "sending" and r.get("workerId") == worker_id:
+                j.update(
+                    rid,
+                    {"status": "scheduled", "due_at": due.isoformat(), "nextRunAt": utc_iso(due), "updated_at": now},
+                    unset=["leaseUntil", "workerId", "attempts", "lastError"],
+                )
+
+def fail_claimed(failures: Dict[str, Tuple[Optional[datetime], str]], worker_id: str) -> None:
+    """Record a failed send on reminders this worker holds.
+
+    ``failures`` maps id -> (retry_at, error): the reminder is retried at
+    ``retry_at``, or dead-lettered (status ``dead``) when that is None.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    with _reminders.writing() as j:
+        for rid, (retry_at, error) in failures.items():
+            r = j.records.get(rid)
+            if r is None or r.get("status") != "sending" or r.get("workerId") != worker_id:
+                continue
+            fields = {"attempts": r.get("attempts", 0) + 1, "lastError": error, "updated_at": now}
+            if retry_at is None:
+                fields["status"] = "dead"
+            else:
+                fields.update(status="scheduled", nextRunAt=utc_iso(retry_at))
+            j.update(rid, fields, unset=["leaseUntil", "workerId"])
+
+def block_chat(chat_id: int) -> int:
+    """Flag the chat as unreachable and park its pending reminders as ``blocked``."""
+    now = datetime.now(timezone.utc).isoformat()
+    with _users.writing() as j:
+        if not j.update(chat_id, {"blocked": True, "blockedAt": now}):
+            j.put(chat_id, {"blocked": True, "blockedAt": now})
+    return _move_chat(chat_id, ("scheduled", "sending"), "blocked", now)
+
+def unblock_chat(chat_id: int) -> int:
+    """Clear the flag and put the chat's parked reminders back on schedule; a no-op unless flagged."""
+    with _users.reading() as j:
+        if not j.records.get(str(chat_id), {}).get("blocked"):
+            return 0
+    now = datetime.now(timezone.utc).isoformat()
+    with _users.writing() as j:
+        j.update(chat_id, unset=["blocked", "blockedAt"])
+    return _move_chat(chat_id, ("blocked",), "scheduled", now)
+
+def _move_chat(chat_id: int, statuses: Sequence[str], status: str, now: str) -> int:
+    with _reminders.writing() as j:
+        ids = [k for k in list(j.ids("chat", chat_id)) if j.records[k].get("status") in statuses]
+        for rid in ids:
+            j.update(rid, {"status": status, "updated_at": now}, unset=["leaseUntil", "workerId"])
+    return len(ids)
+
+def list_reminders_for_chat(
+    chat_id: int,
+    status: Union[str, Sequence[str], None] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+) -> Tuple[List[Reminder], Optional[str]]:
+    """One page of a chat's reminders ordered by (nextRunAt, id), plus the cursor for the next page."""
+    statuses = {status} if isinstance(status, str) else set(status) if status else None
+    return _page_of(_reminders, chat_id, statuses, cursor, limit)
+
+def list_archived_for_chat(chat_id: int, cursor: Optional[str] = None, limit: int = 20) -> Tuple[List[Reminder], Optional[str]]:
+    return _page_of(_archive, chat_id, None, cursor, limit)
+
+def _page_of(journal: Journal, chat_id: int, statuses: Optional[set], cursor: Optional[str], limit: int) -> Tuple[List[Reminder], Optional[str]]:
+    after = None
+    if cursor:
+        after_dt, after_id = decode_cursor(cursor)
+        after = (utc_iso(after_dt), after_id)
+    with journal.reading() as j:
+        rows = []
+        for k in j.ids("chat", chat_id):
+            r = j.records[k]
+            if statuses is not None and r.get("status") not in statuses:
+                continue
+            key = (_due_key(r) or "", r["id"])
+            if after is None or key > after:
+                rows.append((key, r))
+        rows.sort(key=lambda x: x[0])
+        page = [Reminder.from_doc(r) for _, r in rows[:limit]]
+    next_cursor = encode_cursor(page[-1].due, page[-1].id) if len(rows) > limit else None
+    return page, next_cursor
+
+_FINISHED = ("done", "dead")
+
+def archive_done(before: datetime, limit: int = 5000) -> int:
+    """Move up to ``limit`` done or dead reminders due before ``before`` to the archive, then compact."""
+    cutoff = utc_iso(before)
+    archived_at = datetime.now(timezone.utc).isoformat()
+    with _reminders.writing() as j:
+        rows = [j.records[k] for s in _FINISHED for k in j.ids("status", s)]
+        rows = [r for r in rows if (_due_key(r) or "") <= cutoff][:limit]
+        if not rows:
+            return 0
+        # Archive first: a crash in between leaves a duplicate, never a loss
+        with _archive.writing() as a:
+            for r in rows:
+                a.put(r["id"], {**r, "archivedAt": archived_at})
+        for r in rows:
+            j.delete(r["id"])
+    # Shrink the hot snapshot now rather than at the next scheduled compaction
+    with _reminders.writing() as j:
+        j.compact()
+    return len(rows)
+
+# ---- habits ----
+def add_habit(habit: Habit) -> None:
+    with _habits.writing() as j:
+        j.put(habit.id, habit.to_doc())
+
+def list_habits(chat_id: int) -> List[Habit]:
+    with _habits.reading() as j:
+        rows = sorted((j.records[k] for k in j.ids("chat", chat_id)), key=lambda r: (r.get("created_at", ""), r["id"]))
+    return [Habit.from_doc(r) for r in rows]
+
+def check_in_habit(chat_id: int, habit_id: str, day: date) -> Tuple[Optional[Habit], bool]:
+    """Check the habit in for ``day``: (habit after, whether this counted), or (None, False) if unknown."""
+    now = datetime.now(timezone.utc).isoformat()
+    with _habits.writing() as j:
+        doc = j.records.get(habit_id)
+        if doc is None or doc.get("chat_id") != chat_id:
+            return None, False
+        habit = Habit.from_doc(doc)
+        fields = habit.checkin(day)
+        if fields is None:
+            return habit, False
+        with _checkins.writing() as c:
+            key = f"{habit_id}:{fields['lastDay']}"
+            c.put(key, {"id": key, "habit_id": habit_id, "chat_id": chat_id, "day": fields["lastDay"], "at": now})
+        j.update(habit_id, {**fields, "updated_at": now})
+        return Habit.from_doc(j.records[habit_id]), True
+
+def delete_habit(chat_id: int, habit_id: str) -> bool:
+    with _habits.writing() as j:
+        doc = j.records.get(habit_id)
+        if doc is None or doc.get("chat_id") != chat_id:
+            return False
+        j.delete(habit_id)
+    with _checkins.writing() as c:
+        for k in list(c.ids("habit", habit_id)):
+            c.delete(k)
+    return True
+
+# ---- bulk transfer (see transfer.py) ----
+_KINDS = {"reminders": _reminders, "archive": _archive, "users": _users, "habits": _habits, "checkins": _checkins}
+
+def scan(kind: str, after: Any = None, batch: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+    """Stored ``kind`` documents in key order, ``batch`` at a time, starting after key ``after``.
+
+    Reminders are keyed by ``id``, users by ``chatId`` (added to each document).
+    The lock is only held while a batch is copied out.
+    """
+    journal = _KINDS[kind]
+    key = int if kind == "users" else str
+    with journal.reading() as j:
+        keys = sorted((k for k in j.records if after is None or key(k) > after), key=key)
+    for i in range(0, len(keys), batch):
+        with journal.reading() as j:
+            rows = [(k, j.records.get(k)) for k in keys[i:i + batch]]
+        yield [{"chatId": int(k), **r} if kind == "users" else dict(r) for k, r in rows if r is not None]
+
+def bulk_put(kind: str, docs: List[Dict[str, Any]]) -> None:
+    """Insert or replace ``docs``, keyed as in ``scan``, with a single journal append."""
+    with _KINDS[kind].writing() as j:
+        for d in docs:
+            if kind == "users":
+                d = dict(d)
+                j.put(d.pop("chatId"), d)
+            else:
+                j.put(d["id"], d)
@@ -1,28 +1,38 @@
 from __future__ import annotations
 import os
-from typing import Any, Dict, List, Optional
-from datetime import datetime, timezone
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+from datetime import date, datetime, timedelta, timezone
 from bson import ObjectId
-from db import get_db, ensure_indexes
+from pymongo import ReplaceOne, UpdateOne
+from db import get_db, ready_db
+from habit import Habit
+from reminder import Reminder
+from sharding import SHARD_BUCKETS, Shard
+from timeutil import decode_cursor, encode_cursor, next_run_at
 
 
 def _coll():
-    ensure_indexes()
-    return get_db().reminders
+    return ready_db().reminders
+
+
+def _archive():
+    return ready_db().reminders_archive
 
 
 def _users():
-    ensure_indexes()
-    return get_db().users
+    return ready_db().users
 
 
+# Filter/update builders below are shared with storage_mongo_async.
+
 # ---- users ----
+def _timezone_update(tz: str) -> Dict[str, Any]:
+    return {"$set": {"timezone": tz, "updatedAt": datetime.now(timezone.utc)}, "$setOnInsert": {"createdAt": datetime.now(timezone.utc)}}
+
+
 def upsert_user_timezone(chat_id: int, tz: str) -> None:
-    _users().update_one(
-        {"chatId": chat_id},
-        {"$set": {"timezone": tz, "updatedAt": datetime.now(timezone.utc)}, "$setOnInsert": {"createdAt": datetime.now(timezone.utc)}},
-        upsert=True,
-    )
+    _users().update_one({"chatId": chat_id}, _timezone_update(tz), upsert=True)
 
 
 def get_user_timezone(chat_id: int) -> Optional[str]:
@@ -30,29 +40,61 @@ def get_user_timezone(chat_id: int) -> Optional[str]:
     return (doc or {}).get("timezone")
 
 
+# ---- sessions ----
+def _sessions():
+    return ready_db().sessions
+
+
+def _session_update(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {"$set": {"data": data, "updatedAt": datetime.now(timezone.utc)}}
+
+
+def get_session(key: str) -> Optional[Dict[str, Any]]:
+    doc = _sessions().find_one({"key": key}, {"data": 1})
+    return doc["data"] if doc else None
+
+
+def set_session(key: str, data: Optional[Dict[str, Any]]) -> None:
+    if data is None:
+        _sessions().delete_one({"key": key})
+    else:
+        _sessions().update_one({"key": key}, _session_update(data), upsert=True)
+
+
 # ---- reminders ----
-def load_reminders() -> List[Dict[str, Any]]:
-    docs = list(_coll().find({}, {"_id": 0}))
-    return docs
+def _reminders(docs: Iterable[Dict[str, Any]]) -> List[Reminder]:
+    return [Reminder.from_doc(d) for d in docs]
+
+
+def load_reminders() -> List[Reminder]:
+    return _reminders(_coll().find({}, {"_id": 0}))
 
 
-def save_reminders(reminders: List[Dict[str, Any]]) -> None:
+def save_reminders(reminders: List[Reminder]) -> None:
     # Not used in Mongo backend; provided for API parity
     pass
 
 
-def add_reminder(rem: Dict[str, Any]) -> None:
-    rem = dict(rem)
-    rem.setdefault("created_at", datetime.now(timezone.utc).isoformat())
-    rem.setdefault("updated_at", datetime.now(timezone.utc).isoformat())
-    _coll().insert_one(rem)
+def _prepare(rem: Reminder) -> Dict[str, Any]:
+    return rem.to_doc(native=True)
+
+
+def add_reminder(rem: Reminder) -> None:
+    _coll().insert_one(_prepare(rem))
+
+
+def _status_update(status: str) -> Dict[str, Any]:
+    return {"$set": {"status": status, "updated_at": datetime.now(timezone.utc).isoformat()}}
 
 
 def update_reminder_status(reminder_id: str, status: str) -> None:
-    _coll().update_one(
-        {"id": reminder_id},
-        {"$set": {"status": status, "updated_at": datetime.now(timezone.utc).isoformat()}},
-    )
+    _coll().update_one({"id": reminder_id}, _status_update(status))
+
+
+def update_reminders_status(reminder_ids: List[str], status: str) -> None:
+    if not reminder_ids:
+        return
+    _coll().update_many({"id": {"$in": list(reminder_ids)}}, _status_update(status))
 
 
 def delete_reminder(reminder_id: str) -> bool:
@@ -60,3 +102,367 @@ def delete_reminder(reminder_id: str) -> bool:
     return res.deleted_count > 0
 
 
+def fetch_due(now: datetime, limit: int = 500) -> List[Reminder]:
+    """Reminders claimable at ``now``: scheduled ones with ``nextRunAt <= now`` and expired leases."""
+    return _reminders(_coll().find(_claimable(now), {"_id": 0}).sort("nextRunAt", 1).limit(limit))
+
+
+def _claimable(now: datetime, shard: Optional[Shard] = None) -> Dict[str, Any]:
+    query: Dict[str, Any] = {
+        "$or": [
+            {"status": "scheduled", "nextRunAt": {"$lte": now}},
+            # An expired lease means the claiming worker died mid-send
+            {"status": "sending", "leaseUntil": {"$lte": now}},
+        ]
+    }
+    if shard is not None:
+        index, count = shard
+        # Checked on the (status, nextRunAt, shard) index keys, no document fetch
+        query["shard"] = {"$mod": [count, index]}
+    return query
+
+
+def claim_due(
+    now: datetime, limit: int, worker_id: str, lease_seconds: int = 120, shard: Optional[Shard] = None,
+) -> List[Reminder]:
+    """Atomically move up to ``limit`` due reminders to ``sending`` under ``worker_id``.
+
+    Reminders whose lease has expired are reclaimed as well. With ``shard``
+    (index, count) only that partition of chats is considered.
+    """
+    ids = [d["id"] for d in _coll().find(_claimable(now, shard), {"_id": 0, "id": 1}).sort("nextRunAt", 1).limit(limit)]
+    return claim_reminders(ids, now, worker_id, lease_seconds)
+
+
+def claim_reminders(reminder_ids: Iterable[str], now: datetime, worker_id: str, lease_seconds: int = 120) -> List[Reminder]:
+    """Claim specific reminders, skipping any that another worker holds or has finished."""
+    ids = list(reminder_ids)
+    if not ids:
+        return []
+    # The filter is re-checked per document by update_many, so a row grabbed by
+    # a concurrent worker between our read and this write is simply skipped.
+    claim_id = uuid.uuid4().hex
+    coll = _coll()
+    coll.update_many({"id": {"$in": ids}, **_claimable(now)}, _lease(now, worker_id, lease_seconds, claim_id))
+    return _reminders(coll.find({"claimId": claim_id, "status": "sending"}, {"_id": 0}).sort("nextRunAt", 1))
+
+
+def _lease(now: datetime, worker_id: str, lease_seconds: int, claim_id: str) -> Dict[str, Any]:
+    return {"$set": {
+        "status": "sending",
+        "leaseUntil": now + timedelta(seconds=lease_seconds),
+        "workerId": worker_id,
+        "claimId": claim_id,
+    }}
+
+
+def finish_claimed(reminder_ids: Iterable[str], worker_id: str, status: str = "done") -> None:
+    """Settle reminders this worker still holds: ``done`` once sent, ``scheduled`` to release."""
+    ids = list(reminder_ids)
+    if not ids:
+        return
+    _coll().update_many(*_finish(ids, worker_id, status))
+
+
+def _finish(ids: List[str], worker_id: str, status: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    return (
+        {"id": {"$in": ids}, "status": "sending", "workerId": worker_id},
+        {
+            "$set": {"status": status, "updated_at": datetime.now(timezone.utc).isoformat()},
+            "$unset": {"leaseUntil": "", "workerId": "", "claimId": ""},
+        },
+    )
+
+
+def renew_claimed(reminder_ids: Iterable[str], worker_id: str, lease_seconds: int = 120) -> None:
+    """Extend the lease on reminders this worker still holds, for runs that outlast it."""
+    ids = list(reminder_ids)
+    if ids:
+        _coll().update_many(*_renew(ids, worker_id, lease_seconds))
+
+
+def _renew(ids: List[str], worker_id: str, lease_seconds: int) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    return (
+        {"id": {"$in": ids}, "status": "sending", "workerId": worker_id},
+        {"$set": {"leaseUntil": datetime.now(timezone.utc) + timedelta(seconds=lease_seconds)}},
+    )
+
+
+def reschedule_claimed(next_runs: Dict[str, datetime], worker_id: str) -> None:
+    """Return recurring reminders this worker holds to ``scheduled`` at their next occurrence."""
+    if next_runs:
+        _coll().bulk_write(_reschedule_ops(next_runs, worker_id), ordered=False)
+
+
+def _reschedule_ops(next_runs: Dict[str, datetime], worker_id: str) -> List[UpdateOne]:
+    now = datetime.now(timezone.utc).isoformat()
+    return [
+        UpdateOne(
+            {"id": rid, "status": "sending", "workerId": worker_id},
+            {
+                "$set": {"status": "scheduled", "due_at": due.isoformat(), "nextRunAt": due.astimezone(timezone.utc), "updated_at": now},
+                "$unset": {"leaseUntil": "", "workerId": "", "claimId": "", "attempts": "", "lastError": ""},
+            },
+        )
+        for rid, due in next_runs.items()
+    ]
+
+
+def fail_claimed(failures: Dict[str, Tuple[Optional[datetime], str]], worker_id: str) -> None:
+    """Record a failed send on reminders this worker holds.
+
+    ``failures`` maps id -> (retry_at, error): the reminder is retried at
+    ``retry_at``, or dead-lettered (status ``dead``) when that is None.
+    """
+    if failures:
+        _coll().bulk_write(_fail_ops(failures, worker_id), ordered=False)
+
+
+def _fail_ops(failures: Dict[str, Tuple[Optional[datetime], str]], worker_id: str) -> List[UpdateOne]:
+    now = datetime.now(timezone.utc).isoformat()
+    ops = []
+    for rid, (retry_at, error) in failures.items():
+        fields: Dict[str, Any] = {"lastError": error, "updated_at": now}
+        if retry_at is None:
+            fields["status"] = "dead"
+        else:
+            fields.update(status="scheduled", nextRunAt=retry_at.astimezone(timezone.utc))
+        ops.append(UpdateOne(
+            {"id": rid, "status": "sending", "workerId": worker_id},
+            {"$set": fields, "$inc": {"attempts": 1}, "$unset": {"leaseUntil": "", "workerId": "", "claimId": ""}},
+        ))
+    return ops
+
+
+# ---- unreachable chats ----
+def _blocked_user(chat_id: int) -> Dict[str, Any]:
+    return {"chatId": chat_id, "blocked": True}
+
+
+def _blocked_update(blocked: bool) -> Dict[str, Any]:
+    if blocked:
+        return {"$set": {"blocked": True, "blockedAt": datetime.now(timezone.utc)}}
+    return {"$unset": {"blocked": "", "blockedAt": ""}}
+
+
+def _move_chat(chat_id: int, statuses: Sequence[str], status: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    # Served by the (chat_id, status, ...) index
+    return (
+        {"chat_id": chat_id, "status": {"$in": list(statuses)}},
+        {
+            "$set": {"status": status, "updated_at": datetime.now(timezone.utc).isoformat()},
+            "$unset": {"leaseUntil": "", "workerId": "", "claimId": ""},
+        },
+    )
+
+
+_PENDING = ("scheduled", "sending")
+
+
+def block_chat(chat_id: int) -> int:
+    """Flag the chat as unreachable and park its pending reminders as ``blocked``."""
+    _users().update_one({"chatId": chat_id}, _blocked_update(True), upsert=True)
+    return _coll().update_many(*_move_chat(chat_id, _PENDING, "blocked")).modified_count
+
+
+def unblock_chat(chat_id: int) -> int:
+    """Clear the flag and put the chat's parked reminders back on schedule; a no-op unless flagged."""
+    if _users().find_one(_blocked_user(chat_id), {"_id": 1}) is None:
+        return 0
+    _users().update_one(_blocked_user(chat_id), _blocked_update(False))
+    return _coll().update_many(*_move_chat(chat_id, ("blocked",), "scheduled")).modified_count
+
+
+def list_reminders_for_chat(
+    chat_id: int,
+    status: Union[str, Sequence[str], None] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+) -> Tuple[List[Reminder], Optional[str]]:
+    """One page of a chat's reminders ordered by (nextRunAt, id), plus the cursor for the next page.
+
+    Served by the (chat_id, status, nextRunAt, id) index.
+    """
+    docs = list(_coll().find(_page_query(chat_id, status, cursor), {"_id": 0}).sort(_PAGE_SORT).limit(limit + 1))
+    return _page(docs, limit)
+
+
+_PAGE_SORT = [("nextRunAt", 1), ("id", 1)]
+
+
+def list_archived_for_chat(chat_id: int, cursor: Optional[str] = None, limit: int = 20) -> Tuple[List[Reminder], Optional[str]]:
+    docs = list(_archive().find(_page_query(chat_id, None, cursor), {"_id": 0}).sort(_PAGE_SORT).limit(limit + 1))
+    return _page(docs, limit)
+
+
+# ---- retention ----
+_FINISHED = ["done", "dead"]
+
+
+def _archivable(before: datetime) -> Dict[str, Any]:
+    return {"status": {"$in": _FINISHED}, "nextRunAt": {"$lte": before}}
+
+
+def _archive_ops(docs: List[Dict[str, Any]]) -> List[ReplaceOne]:
+    # Upserts keyed by id, so a batch re-run after a crash does not duplicate
+    now = datetime.now(timezone.utc)
+    return [ReplaceOne({"id": d["id"]}, {**d, "archivedAt": now}, upsert=True) for d in docs]
+
+
+def archive_done(before: datetime, limit: int = 5000) -> int:
+    """Move up to ``limit`` done or dead reminders due before ``before`` to ``reminders_archive``."""
+    docs = list(_coll().find(_archivable(before)).limit(limit))
+    if not docs:
+        return 0
+    _archive().bulk_write(_archive_ops([{k: v for k, v in d.items() if k != "_id"} for d in docs]), ordered=False)
+    _coll().delete_many({"_id": {"$in": [d["_id"] for d in docs]}, "status": {"$in": _FINISHED}})
+    return len(docs)
+
+
+def _page_query(chat_id: int, status: Union[str, Sequence[str], None], cursor: Optional[str]) -> Dict[str, Any]:
+    query: Dict[str, Any] = {"chat_id": chat_id}
+    if status:
+        query["status"] = status if isinstance(status, str) else {"$in": list(status)}
+    if cursor:
+        after_dt, after_id = decode_cursor(cursor)
+        query["$or"] = [{"nextRunAt": {"$gt": after_dt}}, {"nextRunAt": after_dt, "id": {"$gt": after_id}}]
+    return query
+
+
+def _page(docs: List[Dict[str, Any]], limit: int) -> Tuple[List[Reminder], Optional[str]]:
+    page = _reminders(docs[:limit])
+    next_cursor = encode_cursor(page[-1].due, page[-1].id) if len(docs) > limit else None
+    return page, next_cursor
+
+
+# Reminders written before nextRunAt existed, and the fields needed to compute it
+_LEGACY_NEXT_RUN = ({"nextRunAt": {"$exists": False}}, {"_id": 1, "due_at": 1, "timezone": 1})
+
+
+def _next_run_op(doc: Dict[str, Any]) -> Optional[UpdateOne]:
+    due = next_run_at(doc)
+    return UpdateOne({"_id": doc["_id"]}, {"$set": {"nextRunAt": due}}) if due is not None else None
+
+
+def backfill_next_run_at() -> int:
+    """Populate ``nextRunAt`` on reminders written before it existed.
+
+    Run by ``python db.py migrate`` and once per process by ``ready_db``.
+    """
+    coll = get_db().reminders
+    ops = [op for op in map(_next_run_op, coll.find(*_LEGACY_NEXT_RUN)) if op is not None]
+    if ops:
+        coll.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+# Computed server-side for reminders written before sharding
+_LEGACY_SHARD = ({"shard": {"$exists": False}}, [{"$set": {"shard": {"$mod": [{"$abs": "$chat_id"}, SHARD_BUCKETS]}}}])
+
+
+def backfill_shards() -> int:
+    """Populate ``shard`` on reminders written before sharding.
+
+    Run by ``python db.py migrate`` and once per process by ``ready_db``.
+    """
+    return get_db().reminders.update_many(*_LEGACY_SHARD).modified_count
+
+
+# ---- habits ----
+def _habits():
+    return ready_db().habits
+
+
+def _checkins():
+    return ready_db().habit_checkins
+
+
+def _habit_key(chat_id: int, habit_id: str) -> Dict[str, Any]:
+    return {"chat_id": chat_id, "id": habit_id}
+
+
+def _checkin_log(habit: Habit, day: str, now: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    key = f"{habit.id}:{day}"
+    return {"habit_id": habit.id, "day": day}, {"$setOnInsert": {"id": key, "chat_id": habit.chat_id, "at": now}}
+
+
+def _checkin_update(habit: Habit, fields: Dict[str, Any], now: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    # Only applies if nobody checked in since we read the summary
+    last = habit.last_day.isoformat() if habit.last_day else None
+    return {**_habit_key(habit.chat_id, habit.id), "lastDay": last}, {"$set": {**fields, "updated_at": now}}
+
+
+# A conflicting check-in is almost always the same day, which ends the loop
+CHECKIN_ATTEMPTS = 5
+
+
+def add_habit(habit: Habit) -> None:
+    _habits().insert_one(habit.to_doc())
+
+
+def list_habits(chat_id: int) -> List[Habit]:
+    docs = _habits().find({"chat_id": chat_id}, {"_id": 0}).sort([("created_at", 1), ("id", 1)])
+    return [Habit.from_doc(d) for d in docs]
+
+
+def check_in_habit(chat_id: int, habit_id: str, day: date) -> Tuple[Optional[Habit], bool]:
+    """Check the habit in for ``day``: (habit after, whether this counted), or (None, False) if unknown."""
+    for _ in range(CHECKIN_ATTEMPTS):
+        doc = _habits().find_one(_habit_key(chat_id, habit_id), {"_id": 0})
+        if doc is None:
+            return None, False
+        habit = Habit.from_doc(doc)
+        fields = habit.checkin(day)
+        if fields is None:
+            return habit, False
+        now = datetime.now(timezone.utc).isoformat()
+        _checkins().update_one(*_checkin_log(habit, fields["lastDay"], now), upsert=True)
+        if _habits().update_one(*_checkin_update(habit, fields, now)).modified_count:
+            return Habit.from_doc({**doc, **fields}), True
+    raise RuntimeError(f"habit {habit_id} check-in kept conflicting")
+
+
+def delete_habit(chat_id: int, habit_id: str) -> bool:
+    if not _habits().delete_one(_habit_key(chat_id, habit_id)).deleted_count:
+        return False
+    _checkins().delete_many({"habit_id": habit_id})
+    return True
+
+
+# ---- bulk transfer (see transfer.py) ----
+# kind -> (collection, scan key, fields identifying a document on its unique index)
+_KINDS = {
+    "reminders": ("reminders", "id", ("chat_id", "id")),
+    "archive": ("reminders_archive", "id", ("id",)),
+    "users": ("users", "chatId", ("chatId",)),
+    "habits": ("habits", "id", ("chat_id", "id")),
+    "checkins": ("habit_checkins", "id", ("habit_id", "day")),
+}
+
+
+def scan(kind: str, after: Any = None, batch: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+    """Stored ``kind`` documents in key order, ``batch`` at a time, starting after key ``after``."""
+    name, key, _ = _KINDS[kind]
+    query = {key: {"$gt": after}} if after is not None else {}
+    # reminders has no index on id alone; let the sort spill to disk
+    cursor = ready_db()[name].find(query, {"_id": 0}).sort(key, 1).batch_size(batch).allow_disk_use(True)
+    chunk: List[Dict[str, Any]] = []
+    for doc in cursor:
+        chunk.append(doc)
+        if len(chunk) == batch:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _bulk_ops(kind: str, docs: List[Dict[str, Any]]) -> List[ReplaceOne]:
+    # Upserts on the unique index, so re-running a batch after a crash is harmless
+    fields = _KINDS[kind][2]
+    return [ReplaceOne({f: d[f] for f in fields}, d, upsert=True) for d in docs]
+
+
+def bulk_put(kind: str, docs: List[Dict[str, Any]]) -> None:
+    """Insert or replace ``docs`` (in stored, native-datetime form) in one unordered bulk_write."""
+    if docs:
+        ready_db()[_KINDS[kind][0]].bulk_write(_bulk_ops(kind, docs), ordered=False)
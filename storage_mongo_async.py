@@ -0,0 +1,222 @@
+from __future__ import annotations
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from datetime import date, datetime, timezone
+from db import get_async_db, ready_async_db
+from habit import Habit
+from reminder import Reminder
+from sharding import Shard
+from storage_mongo import (
+    CHECKIN_ATTEMPTS, _FINISHED, _LEGACY_NEXT_RUN, _LEGACY_SHARD, _PAGE_SORT, _PENDING, _archivable, _archive_ops,
+    _blocked_update, _blocked_user, _checkin_log, _checkin_update, _claimable, _fail_ops, _finish, _habit_key, _lease,
+    _move_chat, _next_run_op, _page, _page_query, _prepare, _reminders, _renew, _reschedule_ops, _session_update,
+    _status_update, _timezone_update,
+)
+
+# Native asyncio mirror of storage_mongo; queries are built by the same helpers.
+
+
+async def _coll():
+    return (await ready_async_db()).reminders
+
+
+async def _archive():
+    return (await ready_async_db()).reminders_archive
+
+
+async def _users():
+    return (await ready_async_db()).users
+
+
+# ---- users ----
+async def upsert_user_timezone(chat_id: int, tz: str) -> None:
+    await (await _users()).update_one({"chatId": chat_id}, _timezone_update(tz), upsert=True)
+
+
+async def get_user_timezone(chat_id: int) -> Optional[str]:
+    doc = await (await _users()).find_one({"chatId": chat_id}, {"timezone": 1})
+    return (doc or {}).get("timezone")
+
+
+# ---- sessions ----
+async def _sessions():
+    return (await ready_async_db()).sessions
+
+
+async def get_session(key: str) -> Optional[Dict[str, Any]]:
+    doc = await (await _sessions()).find_one({"key": key}, {"data": 1})
+    return doc["data"] if doc else None
+
+
+async def set_session(key: str, data: Optional[Dict[str, Any]]) -> None:
+    if data is None:
+        await (await _sessions()).delete_one({"key": key})
+    else:
+        await (await _sessions()).update_one({"key": key}, _session_update(data), upsert=True)
+
+
+# ---- reminders ----
+async def load_reminders() -> List[Reminder]:
+    return _reminders(await (await _coll()).find({}, {"_id": 0}).to_list(None))
+
+
+async def save_reminders(reminders: List[Reminder]) -> None:
+    # Not used in Mongo backend; provided for API parity
+    pass
+
+
+async def add_reminder(rem: Reminder) -> None:
+    await (await _coll()).insert_one(_prepare(rem))
+
+
+async def update_reminder_status(reminder_id: str, status: str) -> None:
+    await (await _coll()).update_one({"id": reminder_id}, _status_update(status))
+
+
+async def update_reminders_status(reminder_ids: List[str], status: str) -> None:
+    if not reminder_ids:
+        return
+    await (await _coll()).update_many({"id": {"$in": list(reminder_ids)}}, _status_update(status))
+
+
+async def delete_reminder(reminder_id: str) -> bool:
+    res = await (await _coll()).delete_one({"id": reminder_id})
+    return res.deleted_count > 0
+
+
+async def fetch_due(now: datetime, limit: int = 500) -> List[Reminder]:
+    return _reminders(await (await _coll()).find(_claimable(now), {"_id": 0}).sort("nextRunAt", 1).limit(limit).to_list(None))
+
+
+async def claim_due(
+    now: datetime, limit: int, worker_id: str, lease_seconds: int = 120, shard: Optional[Shard] = None,
+) -> List[Reminder]:
+    cur = (await _coll()).find(_claimable(now, shard), {"_id": 0, "id": 1}).sort("nextRunAt", 1).limit(limit)
+    ids = [d["id"] async for d in cur]
+    return await claim_reminders(ids, now, worker_id, lease_seconds)
+
+
+async def claim_reminders(reminder_ids: Iterable[str], now: datetime, worker_id: str, lease_seconds: int = 120) -> List[Reminder]:
+    ids = list(reminder_ids)
+    if not ids:
+        return []
+    claim_id = uuid.uuid4().hex
+    coll = await _coll()
+    await coll.update_many({"id": {"$in": ids}, **_claimable(now)}, _lease(now, worker_id, lease_seconds, claim_id))
+    return _reminders(await coll.find({"claimId": claim_id, "status": "sending"}, {"_id": 0}).sort("nextRunAt", 1).to_list(None))
+
+
+async def finish_claimed(reminder_ids: Iterable[str], worker_id: str, status: str = "done") -> None:
+    ids = list(reminder_ids)
+    if not ids:
+        return
+    await (await _coll()).update_many(*_finish(ids, worker_id, status))
+
+
+async def renew_claimed(reminder_ids: Iterable[str], worker_id: str, lease_seconds: int = 120) -> None:
+    ids = list(reminder_ids)
+    if ids:
+        await (await _coll()).update_many(*_renew(ids, worker_id, lease_seconds))
+
+
+async def reschedule_claimed(next_runs: Dict[str, datetime], worker_id: str) -> None:
+    if next_runs:
+        await (await _coll()).bulk_write(_reschedule_ops(next_runs, worker_id), ordered=False)
+
+
+async def fail_claimed(failures: Dict[str, Tuple[Optional[datetime], str]], worker_id: str) -> None:
+    if failures:
+        await (await _coll()).bulk_write(_fail_ops(failures, worker_id), ordered=False)
+
+
+async def block_chat(chat_id: int) -> int:
+    await (await _users()).update_one({"chatId": chat_id}, _blocked_update(True), upsert=True)
+    return (await (await _coll()).update_many(*_move_chat(chat_id, _PENDING, "blocked"))).modified_count
+
+
+async def unblock_chat(chat_id: int) -> int:
+    users = await _users()
+    if await users.find_one(_blocked_user(chat_id), {"_id": 1}) is None:
+        return 0
+    await users.update_one(_blocked_user(chat_id), _blocked_update(False))
+    return (await (await _coll()).update_many(*_move_chat(chat_id, ("blocked",), "scheduled"))).modified_count
+
+
+async def list_reminders_for_chat(
+    chat_id: int,
+    status: Union[str, Sequence[str], None] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+) -> Tuple[List[Reminder], Optional[str]]:
+    cur = (await _coll()).find(_page_query(chat_id, status, cursor), {"_id": 0}).sort(_PAGE_SORT).limit(limit + 1)
+    return _page(await cur.to_list(None), limit)
+
+
+async def list_archived_for_chat(chat_id: int, cursor: Optional[str] = None, limit: int = 20) -> Tuple[List[Reminder], Optional[str]]:
+    cur = (await _archive()).find(_page_query(chat_id, None, cursor), {"_id": 0}).sort(_PAGE_SORT).limit(limit + 1)
+    return _page(await cur.to_list(None), limit)
+
+
+async def archive_done(before: datetime, limit: int = 5000) -> int:
+    coll = await _coll()
+    docs = await coll.find(_archivable(before)).limit(limit).to_list(None)
+    if not docs:
+        return 0
+    await (await _archive()).bulk_write(_archive_ops([{k: v for k, v in d.items() if k != "_id"} for d in docs]), ordered=False)
+    await coll.delete_many({"_id": {"$in": [d["_id"] for d in docs]}, "status": {"$in": _FINISHED}})
+    return len(docs)
+
+
+async def backfill_next_run_at() -> int:
+    coll = get_async_db().reminders
+    docs = await coll.find(*_LEGACY_NEXT_RUN).to_list(None)
+    ops = [op for op in map(_next_run_op, docs) if op is not None]
+    if ops:
+        await coll.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+async def backfill_shards() -> int:
+    return (await get_async_db().reminders.update_many(*_LEGACY_SHARD)).modified_count
+
+
+# ---- habits ----
+async def _habits():
+    return (await ready_async_db()).habits
+
+
+async def _checkins():
+    return (await ready_async_db()).habit_checkins
+
+
+async def add_habit(habit: Habit) -> None:
+    await (await _habits()).insert_one(habit.to_doc())
+
+
+async def list_habits(chat_id: int) -> List[Habit]:
+    cursor = (await _habits()).find({"chat_id": chat_id}, {"_id": 0}).sort([("created_at", 1), ("id", 1)])
+    return [Habit.from_doc(d) async for d in cursor]
+
+
+async def check_in_habit(chat_id: int, habit_id: str, day: date) -> Tuple[Optional[Habit], bool]:
+    habits = await _habits()
+    for _ in range(CHECKIN_ATTEMPTS):
+        doc = await habits.find_one(_habit_key(chat_id, habit_id), {"_id": 0})
+        if doc is None:
+            return None, False
+        habit = Habit.from_doc(doc)
+        fields = habit.checkin(day)
+        if fields is None:
+            return habit, False
+        now = datetime.now(timezone.utc).isoformat()
+        await (await _checkins()).update_one(*_checkin_log(habit, fields["lastDay"], now), upsert=True)
+        if (await habits.update_one(*_checkin_update(habit, fields, now))).modified_count:
+            return Habit.from_doc({**doc, **fields}), True
+    raise RuntimeError(f"habit {habit_id} check-in kept conflicting")
+
+
+async def delete_habit(chat_id: int, habit_id: str) -> bool:
+    if not (await (await _habits()).delete_one(_habit_key(chat_id, habit_id))).deleted_count:
+        return False
+    await (await _checkins()).delete_many({"habit_id": habit_id})
+    return True
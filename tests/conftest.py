@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# Tests run against the JSON backend in a throwaway data directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["JSON_DATA_DIR"] = tempfile.mkdtemp(prefix="gretchen-tests-")
+os.environ["USE_MONGO"] = "0"
+os.environ.pop("MONGODB_URI", None)
+os.environ.setdefault("TELEGRAM_TOKEN", "123:test")
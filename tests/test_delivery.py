@@ -0,0 +1,114 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from astorage import add_reminder, claim_due, claim_reminders, load_reminders, renew_claimed
+from delivery import DeliveryEngine, TokenBucket, settle_sent
+from reminder import Reminder
+
+
+class SlowBot:
+    def __init__(self, delay):
+        self.delay = delay
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        await asyncio.sleep(self.delay)
+        self.sent.append((chat_id, text))
+
+
+def test_long_run_keeps_its_leases():
+    lease = 1
+    chat_id = 2000 + uuid.uuid4().int % 1000
+    engine = DeliveryEngine(global_rate=1000, chat_rate=1000, lease_seconds=lease)
+    bot = SlowBot(0.25)
+
+    async def scenario():
+        now = datetime.now(timezone.utc)
+        ids = [f"{uuid.uuid4().hex[:6]}{i:02d}" for i in range(8)]
+        for i, rid in enumerate(ids):
+            await add_reminder(Reminder(id=rid, chat_id=chat_id, text=rid, due=now - timedelta(seconds=10 - i)))
+        claimed = await claim_reminders(ids, now, "w1", lease)
+        # One chat, sent in order: the run takes twice the lease
+        delivery = asyncio.create_task(engine.deliver(
+            bot, claimed,
+            mark_sent=lambda rows: settle_sent(rows, "w1"),
+            renew=lambda held: renew_claimed(held, "w1", lease),
+        ))
+        await asyncio.sleep(lease * 1.6)
+        stolen = await claim_due(datetime.now(timezone.utc), 100, "w2", lease)
+        result = await delivery
+        return ids, stolen, result
+
+    ids, stolen, result = asyncio.run(scenario())
+    assert [r.id for r in stolen if r.id in ids] == []
+    assert sorted(result.sent) == sorted(ids)
+    assert len(bot.sent) == len(ids)
+    statuses = {r.id: r.status for r in asyncio.run(load_reminders()) if r.id in ids}
+    assert statuses == {rid: "done" for rid in ids}
+
+
+def test_rate_limits_survive_a_new_event_loop():
+    bucket = TokenBucket(100, capacity=1)
+
+    async def burst():
+        # More than the capacity, so acquirers wait on the bucket's lock
+        await asyncio.gather(*(bucket.acquire() for _ in range(3)))
+
+    asyncio.run(burst())
+    asyncio.run(burst())  # e.g. the next serverless invocation
+
+
+class ScriptedBot:
+    """Sleeps ``delays[n]`` on the n-th message and raises for chats in ``broken``."""
+
+    def __init__(self, delays, broken=()):
+        self.delays = delays
+        self.broken = set(broken)
+        self.calls = 0
+
+    async def send_message(self, chat_id, text):
+        self.calls += 1
+        await asyncio.sleep(self.delays.get(self.calls, 0))
+        if chat_id in self.broken:
+            raise RuntimeError("bot exploded")
+
+
+def _rows(chat_ids):
+    now = datetime.now(timezone.utc)
+    return [Reminder(id=uuid.uuid4().hex[:8], chat_id=c, text="t", due=now) for c in chat_ids]
+
+
+def test_sent_rows_are_flushed_when_a_chat_fails():
+    engine = DeliveryEngine(global_rate=1000, chat_rate=1000, flush_size=100)
+    rows = _rows([1, 2])
+    marked = []
+
+    async def mark_sent(batch):
+        marked.extend(r.id for r in batch)
+
+    async def scenario():
+        await engine.deliver(ScriptedBot({2: 0.1}, broken={2}), rows, mark_sent=mark_sent)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(scenario())
+    assert marked == [rows[0].id]
+
+
+def test_lease_keeper_finishes_its_flush():
+    # The keeper flushes the first row at ~0.1s; the run ends while mark_sent is still writing it
+    engine = DeliveryEngine(global_rate=1000, chat_rate=1000, flush_size=100, lease_seconds=0.3)
+    rows = _rows([1, 1])
+    marked = []
+
+    async def mark_sent(batch):
+        await asyncio.sleep(0.3)
+        marked.extend(r.id for r in batch)
+
+    async def scenario():
+        await engine.deliver(ScriptedBot({1: 0.05, 2: 0.2}), rows, mark_sent=mark_sent)
+
+    asyncio.run(scenario())
+    assert sorted(marked) == sorted(r.id for r in rows)
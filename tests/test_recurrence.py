@@ -0,0 +1,37 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import storage
+from astorage import add_reminder, claim_reminders, load_reminders
+from delivery import settle_sent
+from recurrence import parse_recurrence
+from reminder import Reminder
+
+
+@pytest.mark.parametrize("text", ["every 3000000 days", "every 9999999 weeks", "every 100000000 hours"])
+def test_intervals_past_the_date_range_are_rejected(text):
+    with pytest.raises(ValueError):
+        parse_recurrence(text, "Europe/Berlin")
+
+
+def test_unschedulable_rule_does_not_poison_the_batch():
+    ids = [uuid.uuid4().hex[:8] for _ in range(3)]
+
+    async def scenario():
+        now = datetime.now(timezone.utc)
+        due = now.replace(microsecond=0) - timedelta(minutes=1)
+        rules = (None, {"freq": "daily", "interval": 3000000}, {"freq": "daily", "interval": 1})
+        for rid, rule in zip(ids, rules):
+            await add_reminder(Reminder(id=rid, chat_id=5000, text="t", due=due, timezone="UTC", recurrence=rule))
+        claimed = await claim_reminders(ids, now, "w1", 60)
+        return due, await settle_sent(claimed, "w1")
+
+    due, next_runs = asyncio.run(scenario())
+    assert next_runs == {ids[2]: due + timedelta(days=1)}
+    stored = {r.id: r for r in asyncio.run(load_reminders()) if r.id in ids}
+    assert [stored[rid].status for rid in ids] == ["done", "dead", "scheduled"]
+    with storage._reminders.reading() as j:
+        assert j.records[ids[1]]["lastError"].startswith("OverflowError")
@@ -0,0 +1,33 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from astorage import add_reminder, claim_reminders, load_reminders
+from delivery import DeliveryResult, settle_failed, settle_sent
+from reminder import Reminder
+
+
+def test_retried_hourly_reminder_keeps_its_schedule():
+    rid = uuid.uuid4().hex[:8]
+
+    async def scenario():
+        now = datetime.now(timezone.utc)
+        occurrence = now.replace(second=0, microsecond=0) - timedelta(minutes=1)
+        await add_reminder(Reminder(
+            id=rid, chat_id=3000, text="hourly", due=occurrence, timezone="Europe/Berlin",
+            recurrence={"freq": "hourly", "interval": 1},
+        ))
+        claimed = await claim_reminders([rid], now, "w1", 60)
+        retries = await settle_failed(DeliveryResult(failed={rid: "NetworkError: down"}), claimed, "w1")
+        assert retries[rid] > now
+        # The retry comes due and goes through
+        claimed = await claim_reminders([rid], retries[rid] + timedelta(seconds=1), "w1", 60)
+        assert claimed[0].due > now
+        assert claimed[0].occurrence == occurrence
+        next_runs = await settle_sent(claimed, "w1")
+        return occurrence, next_runs
+
+    occurrence, next_runs = asyncio.run(scenario())
+    assert next_runs[rid] == occurrence + timedelta(hours=1)
+    stored = next(r for r in asyncio.run(load_reminders()) if r.id == rid)
+    assert (stored.due, stored.occurrence, stored.attempts) == (occurrence + timedelta(hours=1),) * 2 + (0,)
@@ -0,0 +1,75 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import main
+from astorage import add_reminder, claim_reminders, fetch_due, load_reminders
+from delivery import DeliveryResult
+from reminder import Reminder
+from scheduler import BATCH_SLACK, Scheduler
+
+
+class FakeEngine:
+    def __init__(self):
+        self.sent = []
+
+    async def deliver(self, bot, rows, mark_sent=None, **kwargs):
+        rows = list(rows)
+        self.sent.extend(r.id for r in rows)
+        if mark_sent is not None and rows:
+            await mark_sent(rows)
+        return DeliveryResult(sent=[r.id for r in rows])
+
+
+def test_reminders_within_batch_slack_are_all_claimed(monkeypatch):
+    engine = FakeEngine()
+    monkeypatch.setattr(main, "delivery_engine", engine)
+    chat_id = 1000 + uuid.uuid4().int % 1000
+
+    async def scenario():
+        now = datetime.now(timezone.utc)
+        ids = [uuid.uuid4().hex[:8] for _ in range(2)]
+        # Two reminders closer together than BATCH_SLACK: popped as one batch
+        for rid, delay in zip(ids, (0.1, 0.1 + BATCH_SLACK * 0.6)):
+            await add_reminder(Reminder(id=rid, chat_id=chat_id, text="hi", due=now + timedelta(seconds=delay)))
+        app = SimpleNamespace(bot=None, bot_data={})
+        scheduler = Scheduler(fetch_due, lambda batch: main.dispatch_due(app, batch), horizon=60)
+        app.bot_data["scheduler"] = scheduler
+        scheduler.start()
+        try:
+            await asyncio.sleep(1 + BATCH_SLACK)
+        finally:
+            await scheduler.stop()
+        return ids
+
+    ids = asyncio.run(scenario())
+    assert sorted(engine.sent) == sorted(ids)
+    statuses = {r.id: r.status for r in asyncio.run(load_reminders()) if r.id in ids}
+    assert statuses == {rid: "done" for rid in ids}
+
+
+def test_refill_reclaims_expired_leases(monkeypatch):
+    engine = FakeEngine()
+    monkeypatch.setattr(main, "delivery_engine", engine)
+    rid = uuid.uuid4().hex[:8]
+
+    async def scenario():
+        now = datetime.now(timezone.utc)
+        # Long overdue, e.g. after an outage: still sent, as the cron path does
+        await add_reminder(Reminder(id=rid, chat_id=2000, text="hi", due=now - timedelta(hours=3)))
+        # Claimed by a worker that crashed before sending; its lease ran out
+        assert await claim_reminders([rid], now - timedelta(hours=2), "crashed", 60)
+        app = SimpleNamespace(bot=None, bot_data={})
+        scheduler = Scheduler(fetch_due, lambda batch: main.dispatch_due(app, batch), horizon=60)
+        app.bot_data["scheduler"] = scheduler
+        assert await scheduler.refill() >= 1
+        scheduler.start()
+        try:
+            await asyncio.sleep(0.5)
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(scenario())
+    assert rid in engine.sent
+    assert next(r for r in asyncio.run(load_reminders()) if r.id == rid).status == "done"
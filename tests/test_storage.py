@@ -0,0 +1,57 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import storage
+from journal import SortedIndex
+from reminder import Reminder
+
+# Long past, so reminders left by other tests never fall under these cutoffs
+BASE = datetime(2001, 1, 1, tzinfo=timezone.utc)
+
+
+def test_sorted_index_keeps_order_across_chunks(monkeypatch):
+    monkeypatch.setattr(SortedIndex, "CHUNK", 4)
+    items = [(f"{n:03d}", str(n)) for n in range(100)]
+    index = SortedIndex(items[:10])
+    for item in random.Random(1).sample(items[10:], 90):
+        index.add(item)
+    for item in items[::3]:
+        index.remove(item)
+    index.remove(("999", "x"))
+    assert list(index) == [i for n, i in enumerate(items) if n % 3]
+    assert len(index) == 66
+
+
+def test_due_queries_take_the_index_prefix():
+    for n in (3, 0, 4, 1, 2):
+        storage.add_reminder(Reminder(id=f"due{n}", chat_id=4000, text="t", due=BASE + timedelta(minutes=n)))
+    cutoff = BASE + timedelta(minutes=3)
+
+    assert [r.id for r in storage.fetch_due(cutoff)] == ["due0", "due1", "due2", "due3"]
+    assert [r.id for r in storage.fetch_due(cutoff, limit=2)] == ["due0", "due1"]
+
+    claimed = storage.claim_due(cutoff, 2, "w1", lease_seconds=60)
+    assert [r.id for r in claimed] == ["due0", "due1"]
+    # Claimed rows leave the due index until their lease runs out
+    assert [r.id for r in storage.fetch_due(cutoff)] == ["due2", "due3"]
+    later = [r.id for r in storage.claim_due(cutoff + timedelta(minutes=5), 10, "w2", lease_seconds=60)]
+    assert later == ["due0", "due1", "due2", "due3", "due4"]
+
+    storage.reschedule_claimed({"due4": BASE - timedelta(minutes=1)}, "w2")
+    storage.delete_reminder("due3")
+    storage.finish_claimed(["due0", "due1", "due2"], "w2", status="scheduled")
+    assert [r.id for r in storage.fetch_due(cutoff)] == ["due4", "due0", "due1", "due2"]
+
+
+def test_unblock_is_a_no_op_for_chats_never_blocked():
+    storage.add_reminder(Reminder(id="unb1", chat_id=4100, text="t", due=BASE))
+    storage.upsert_user_timezone(4101, "Europe/Berlin")
+    logs = (storage._users.log, storage._reminders.log)
+    sizes = [p.stat().st_size if p.exists() else 0 for p in logs]
+    assert storage.unblock_chat(4101) == 0
+    assert [p.stat().st_size if p.exists() else 0 for p in logs] == sizes
+
+    assert storage.block_chat(4100) == 1
+    assert storage.unblock_chat(4100) == 1
+    assert storage.get_user_timezone(4100) is None
+    assert "unb1" in [r.id for r in storage.fetch_due(BASE)]
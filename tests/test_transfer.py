@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import storage
+import transfer
+from reminder import Reminder
+
+
+def _ics(*events):
+    body = "".join(f"BEGIN:VEVENT\r\n{e}END:VEVENT\r\n" for e in events)
+    return f"BEGIN:VCALENDAR\r\nVERSION:2.0\r\n{body}END:VCALENDAR\r\n"
+
+
+def test_ics_import_skips_malformed_events(tmp_path):
+    path = tmp_path / "bad.ics"
+    path.write_text(_ics(
+        "UID:bad-interval\r\nDTSTART:20200101T090000Z\r\nRRULE:FREQ=DAILY;INTERVAL=x\r\nSUMMARY:a\r\n",
+        "UID:bad-cron\r\nDTSTART:20990101T090000Z\r\nX-GRETCHEN-CRON:not a cron\r\nSUMMARY:b\r\n",
+        "UID:bad-date\r\nDTSTART:2099AB01T090000Z\r\nSUMMARY:c\r\n",
+        "UID:good\r\nDTSTART:20990101T090000Z\r\nSUMMARY:kept\r\n",
+    ), newline="")
+    stats = transfer.ics_import("json", str(path), chat_id=4001, tz_name="UTC")
+    assert stats.counts["invalid"] == 3
+    assert stats.counts["reminders"] == 1
+    assert [r.text for r in storage.list_reminders_for_chat(4001)[0]] == ["kept"]
+
+
+def test_ics_export_then_import_updates_in_place(tmp_path):
+    chat_id = 4002
+    now = datetime.now(timezone.utc)
+    storage.add_reminder(Reminder(id="rt-once", chat_id=chat_id, text="once, twice; thrice", due=now + timedelta(days=1)))
+    storage.add_reminder(Reminder(
+        id="rt-daily", chat_id=chat_id, text="daily", due=now + timedelta(hours=2), timezone="Europe/Berlin",
+        recurrence={"freq": "daily", "interval": 1, "at": (now + timedelta(hours=2)).astimezone(ZoneInfo("Europe/Berlin")).strftime("%H:%M")},
+    ))
+    storage.add_reminder(Reminder(
+        id="rt-cron", chat_id=chat_id, text="cron", due=now + timedelta(days=2), recurrence={"cron": "0 9 * * 1-5"},
+    ))
+    before = sorted((r.id, r.text) for r in storage.list_reminders_for_chat(chat_id)[0])
+    path = tmp_path / "chat.ics"
+
+    transfer.ics_export("json", str(path), chat_id=chat_id)
+    transfer.ics_import("json", str(path), chat_id=chat_id)
+    transfer.ics_import("json", str(path), chat_id=chat_id)
+    assert sorted((r.id, r.text) for r in storage.list_reminders_for_chat(chat_id)[0]) == before
+
+    # Into another chat the events are copies with their own ids
+    transfer.ics_import("json", str(path), chat_id=chat_id + 1)
+    copied = storage.list_reminders_for_chat(chat_id + 1)[0]
+    assert len(copied) == 3 and not {r.id for r in copied} & {rid for rid, _ in before}
+    assert sorted((r.id, r.text) for r in storage.list_reminders_for_chat(chat_id)[0]) == before
@@ -0,0 +1,222 @@
+from __future__ import annotations
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+# Natural-language "when" parser for /setreminder.
+#
+# Input is split by one precompiled tokenizer and matched against a small
+# grammar; the resulting plan depends only on the text, so it is memoized and
+# re-evaluated against the current time on each call. dateutil is only tried
+# for inputs the grammar rejects that still look like dates.
+#
+#   when     := "in" duration+ | day? clock? | clock day
+#   duration := <n> ("d" | "h" | "m" | "day(s)" | "hour(s)" | "min(s)" | ...) ["and"]
+#   day      := "today" | "tonight" | "tomorrow" | ["next" | "this" | "on"] weekday
+#   clock    := ["at"] (HH:MM | H[:MM] am/pm | "noon" | "midnight")
+
+DEFAULT_HOUR = 9  # used when a day is given without a time ("tomorrow", "next friday")
+
+WEEKDAYS = {
+    "mon": 0, "monday": 0, "tue": 1, "tues": 1, "tuesday": 1, "wed": 2, "wednesday": 2,
+    "thu": 3, "thur": 3, "thurs": 3, "thursday": 3, "fri": 4, "friday": 4,
+    "sat": 5, "saturday": 5, "sun": 6, "sunday": 6,
+}
+_DAY_NAMES = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+_DAY_WORDS = {"today": "today", "tonight": "tonight", "tomorrow": "tomorrow", "tmr": "tomorrow", "tmrw": "tomorrow"}
+_UNITS = {"d": "days", "h": "hours", "m": "minutes"}
+
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<dur>\d+)\s*(?P<unit>days?|d|hours?|hrs?|h|minutes?|mins?|m)(?![a-z])
+  | (?P<hh>\d{1,2})(?::(?P<mm>\d{2}))?\s*(?P<ampm>am|pm|a\.m\.|p\.m\.)
+  | (?P<hh24>\d{1,2}):(?P<mm24>\d{2})\b
+  | (?P<word>[a-z]+)
+  | (?P<sep>[\s,]+)
+  | (?P<other>.)
+    """,
+    re.VERBOSE,
+)
+_DATEISH_RE = re.compile(r"\d{4}|\d[-/.]\d|\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)")
+
+Plan = Tuple  # ("delta", timedelta, src) | ("at", day, weekday_mode, hh, mm, src)
+
+
+@dataclass
+class WhenParseResult:
+    due_at: datetime  # timezone-aware
+    source: str       # human-readable source (for echoing back)
+    recurrence: Optional[dict] = None  # rule for repeating reminders, see recurrence.py
+
+
+def _tokenize(text: str) -> Optional[List[Tuple[str, object]]]:
+    tokens: List[Tuple[str, object]] = []
+    for m in _TOKEN_RE.finditer(text):
+        kind = m.lastgroup
+        if kind == "sep":
+            continue
+        if kind == "other":
+            return None
+        if m.group("dur"):
+            tokens.append(("dur", (int(m.group("dur")), _UNITS[m.group("unit")[0]])))
+        elif m.group("hh"):
+            hh, mm = int(m.group("hh")), int(m.group("mm") or 0)
+            if not 1 <= hh <= 12 or mm > 59:
+                return None
+            pm = m.group("ampm").startswith("p")
+            tokens.append(("clock", (hh % 12 + (12 if pm else 0), mm)))
+        elif m.group("hh24"):
+            hh, mm = int(m.group("hh24")), int(m.group("mm24"))
+            if hh > 23 or mm > 59:
+                return None
+            tokens.append(("clock", (hh, mm)))
+        else:
+            tokens.append(("word", m.group("word")))
+    return tokens
+
+
+@lru_cache(maxsize=4096)
+def _plan(text: str) -> Optional[Plan]:
+    """Compile normalized text to a time-independent plan, or None if the grammar rejects it."""
+    tokens = _tokenize(text)
+    if not tokens:
+        return None
+    if tokens[0] == ("word", "in"):
+        delta = timedelta()
+        parts = []
+        for kind, value in tokens[1:]:
+            if kind == "word" and value == "and":
+                continue
+            if kind != "dur":
+                return None
+            n, unit = value  # type: ignore[misc]
+            delta += timedelta(**{unit: n})
+            parts.append(f"{n}{unit[0]}")
+        if not parts:
+            return None
+        return ("delta", delta, "in " + "".join(parts))
+
+    day: Optional[object] = None
+    mode = ""
+    clock: Optional[Tuple[int, int]] = None
+    for kind, value in tokens:
+        if kind == "clock":
+            if clock is not None:
+                return None
+            clock = value  # type: ignore[assignment]
+        elif kind == "word" and value in ("at", "on"):
+            continue
+        elif kind == "word" and value in ("noon", "midnight"):
+            if clock is not None:
+                return None
+            clock = (12, 0) if value == "noon" else (0, 0)
+        elif kind == "word" and value in ("next", "this"):
+            if mode:
+                return None
+            mode = value  # type: ignore[assignment]
+        elif kind == "word" and value in _DAY_WORDS:
+            if day is not None:
+                return None
+            day = _DAY_WORDS[value]  # type: ignore[index]
+        elif kind == "word" and value in WEEKDAYS:
+            if day is not None:
+                return None
+            day = WEEKDAYS[value]  # type: ignore[index]
+        else:
+            return None
+    if day is None and clock is None:
+        return None
+    if mode and not isinstance(day, int):
+        return None
+    if day == "tonight" and clock is None:
+        clock = (20, 0)
+    hh, mm = clock if clock is not None else (DEFAULT_HOUR, 0)
+    if day is None:
+        src = f"at {hh:02d}:{mm:02d}"
+    elif isinstance(day, int):
+        src = f"{mode + ' ' if mode else ''}{_DAY_NAMES[day]} {hh:02d}:{mm:02d}"
+    else:
+        src = f"{day} {hh:02d}:{mm:02d}"
+    return ("at", day, mode, hh, mm, src)
+
+
+@lru_cache(maxsize=512)
+def _zone(tz_name: str) -> ZoneInfo:
+    return ZoneInfo(tz_name)
+
+
+_now_cache: dict = {}
+
+
+def now_in(tz_name: str) -> datetime:
+    """Current time in ``tz_name``, memoized per zone for the current wall-clock second."""
+    second = int(time.time())
+    hit = _now_cache.get(tz_name)
+    if hit is not None and hit[0] == second:
+        return hit[1]
+    now = datetime.now(_zone(tz_name))
+    if len(_now_cache) > 1024:
+        _now_cache.clear()
+    _now_cache[tz_name] = (second, now)
+    return now
+
+
+def _evaluate(plan: Plan, now: datetime) -> Optional[WhenParseResult]:
+    if plan[0] == "delta":
+        return WhenParseResult(due_at=now + plan[1], source=plan[2])
+    _, day, mode, hh, mm, src = plan
+    tz = now.tzinfo
+    wall = now.replace(tzinfo=None, hour=hh, minute=mm, second=0, microsecond=0)
+    if day is None or day in ("today", "tonight"):
+        candidate = wall.replace(tzinfo=tz)
+        if day is None and candidate <= now:
+            candidate = (wall + timedelta(days=1)).replace(tzinfo=tz)
+    elif day == "tomorrow":
+        candidate = (wall + timedelta(days=1)).replace(tzinfo=tz)
+    else:
+        ahead = (day - now.weekday()) % 7
+        if mode == "next" and ahead == 0:
+            ahead = 7
+        candidate = (wall + timedelta(days=ahead)).replace(tzinfo=tz)
+        if candidate <= now:
+            candidate = (wall + timedelta(days=ahead + 7)).replace(tzinfo=tz)
+    if candidate <= now:
+        return None
+    return WhenParseResult(due_at=candidate, source=src)
+
+
+def _fallback(text: str, now: datetime) -> Optional[WhenParseResult]:
+    # Last resort for absolute dates ("2025-08-26 18:30", "Aug 26 18:30").
+    # Imported lazily: dateutil is only needed for the long tail.
+    if not _DATEISH_RE.search(text):
+        return None
+    from dateutil import parser as dtparser
+    try:
+        dt = dtparser.parse(text, default=now.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None))
+    except (ValueError, OverflowError):
+        return None
+    dt = dt.replace(tzinfo=now.tzinfo) if dt.tzinfo is None else dt.astimezone(now.tzinfo)
+    if dt <= now:
+        return None
+    return WhenParseResult(due_at=dt, source=text)
+
+
+def parse_when(text: str, tz_name: str, now: Optional[datetime] = None) -> Optional[WhenParseResult]:
+    """
+    Supported:
+      - in 10m / in 2h / in 1d / in 1h30m / in 2 hours and 15 minutes
+      - at 18:30 / 6:30pm / 9am / noon / midnight
+      - today 17:00 / tonight / tomorrow 09:00 / 9am tomorrow
+      - monday 9am / next friday / on wed at 14:00
+      - absolute dates, e.g. 2025-08-26 18:30 or 'Aug 26 18:30'
+    """
+    text = " ".join(text.strip().lower().split())
+    now = now.astimezone(_zone(tz_name)) if now is not None else now_in(tz_name)
+    plan = _plan(text)
+    if plan is not None:
+        return _evaluate(plan, now)
+    return _fallback(text, now)
@@ -0,0 +1,46 @@
+from __future__ import annotations
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+DEFAULT_TZ = os.getenv("DEFAULT_TZ", "Asia/Ho_Chi_Minh")
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_utc(value: Any, tz_name: Optional[str] = None) -> Optional[datetime]:
+    """Coerce an ISO string or datetime to an aware UTC datetime.
+
+    Naive values are interpreted in ``tz_name`` (falling back to DEFAULT_TZ).
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=ZoneInfo(tz_name or DEFAULT_TZ))
+    return value.astimezone(timezone.utc)
+
+
+def utc_iso(dt: datetime) -> str:
+    # Fixed-width so that ISO strings sort lexicographically in time order
+    return dt.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def next_run_at(rem: dict) -> Optional[datetime]:
+    """The reminder's due time in UTC, preferring the indexed ``nextRunAt``."""
+    value = rem.get("nextRunAt")
+    if value is None:
+        value = rem.get("due_at")
+    return to_utc(value, rem.get("timezone"))
+
+
+def encode_cursor(due: Optional[datetime], rem_id: str) -> str:
+    """Compact page cursor (fits Telegram's 64-byte callback_data)."""
+    micros = (due - EPOCH) // timedelta(microseconds=1) if due is not None else 0
+    return f"{micros}:{rem_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    micros, _, rem_id = cursor.partition(":")
+    return EPOCH + timedelta(microseconds=int(micros)), rem_id
@@ -0,0 +1,484 @@
+from __future__ import annotations
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import re
+import sys
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+from zoneinfo import ZoneInfo
+
+from recurrence import next_occurrence, parse_cron
+from reminder import Reminder
+from timeutil import DEFAULT_TZ, to_utc
+
+# Bulk moves between the JSON and Mongo backends, and to/from files:
+#
+#   python transfer.py copy --from json --to mongo
+#   python transfer.py export --from mongo dump.jsonl
+#   python transfer.py import --to json dump.jsonl
+#   python transfer.py ics-export --from json --chat 42 team.ics
+#   python transfer.py ics-import --to mongo --chat 42 team.ics
+#
+# Everything is streamed in batches (one journal append or one bulk_write per
+# batch) and written as upserts, so a run interrupted part-way can be resumed
+# from its --checkpoint file, or simply re-run. Reminders are rewritten in the
+# current schema on the way: legacy rows get their indexed nextRunAt from due_at.
+
+BATCH = int(os.getenv("TRANSFER_BATCH", "1000"))
+KINDS = ("users", "reminders", "archive", "habits", "checkins")
+_BACKENDS = {"json": "storage", "mongo": "storage_mongo"}
+# A claim does not survive the move; the reminder is simply due again
+_LEASE = ("leaseUntil", "workerId", "claimId")
+_DATES = ("archivedAt", "blockedAt", "createdAt", "updatedAt")
+
+
+def backend(name: str):
+    return importlib.import_module(_BACKENDS[name])
+
+
+def normalize(kind: str, doc: Dict[str, Any], native: bool) -> Dict[str, Any]:
+    """``doc`` from either backend, in the stored form of one that wants ``native`` datetimes.
+
+    Raises ValueError for a reminder without a usable due time.
+    """
+    out = {k: v for k, v in doc.items() if k != "_id" and k not in _LEASE}
+    for k in _DATES:
+        if out.get(k) is not None:
+            dt = to_utc(out[k], "UTC")
+            out[k] = dt if native else dt.isoformat()
+    if kind in ("reminders", "archive"):
+        try:
+            rem = Reminder.from_doc(doc)
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"malformed reminder {doc.get('id')!r}: {e}") from e
+        out.update(rem.to_doc(native))
+        if out["status"] == "sending":
+            out["status"] = "scheduled"
+    return out
+
+
+class Checkpoint:
+    """Progress of a resumable run, saved to ``path`` (atomically) after every batch."""
+
+    def __init__(self, path: Optional[str]) -> None:
+        self.path = Path(path) if path else None
+        self.state: Dict[str, Any] = {}
+        if self.path is not None and self.path.exists():
+            self.state = json.loads(self.path.read_text())
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return self.state.get(name, default)
+
+    def save(self, name: str, value: Any) -> None:
+        self.state[name] = value
+        if self.path is None:
+            return
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self.state))
+        os.replace(tmp, self.path)
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.counts: Dict[str, int] = {}
+
+    def add(self, what: str, n: int = 1) -> None:
+        self.counts[what] = self.counts.get(what, 0) + n
+
+    def __str__(self) -> str:
+        return ", ".join(f"{k}={v}" for k, v in sorted(self.counts.items())) or "nothing to do"
+
+
+def _key(kind: str, doc: Dict[str, Any]) -> Any:
+    return doc["chatId"] if kind == "users" else doc["id"]
+
+
+def _batches(src, kinds: Iterable[str], batch: int, ckpt: Checkpoint) -> Iterator[Tuple[str, List[Dict[str, Any]], Any]]:
+    """(kind, raw documents, last key) from ``src``, resuming each kind after its checkpoint."""
+    for kind in kinds:
+        if ckpt.get(f"{kind}:done"):
+            continue
+        for docs in src.scan(kind, after=ckpt.get(kind), batch=batch):
+            yield kind, docs, _key(kind, docs[-1])
+        ckpt.save(f"{kind}:done", True)
+
+
+def _normalized(kind: str, docs: List[Dict[str, Any]], native: bool, stats: Stats) -> List[Dict[str, Any]]:
+    out = []
+    for d in docs:
+        try:
+            out.append(normalize(kind, d, native))
+        except ValueError as e:
+            print(f"[transfer] skipped: {e}", file=sys.stderr)
+            stats.add(f"{kind}_skipped")
+    return out
+
+
+def copy(src_name: str, dst_name: str, kinds: Iterable[str] = KINDS, batch: int = BATCH, ckpt: Optional[Checkpoint] = None) -> Stats:
+    """Stream ``kinds`` from one backend into the other."""
+    src, dst = backend(src_name), backend(dst_name)
+    native = dst_name == "mongo"
+    ckpt = ckpt or Checkpoint(None)
+    stats = Stats()
+    for kind, docs, last in _batches(src, kinds, batch, ckpt):
+        rows = _normalized(kind, docs, native, stats)
+        dst.bulk_put(kind, rows)
+        ckpt.save(kind, last)
+        stats.add(kind, len(rows))
+    return stats
+
+
+def export(src_name: str, out: str, kinds: Iterable[str] = KINDS, batch: int = BATCH, ckpt: Optional[Checkpoint] = None) -> Stats:
+    """Write ``kinds`` as JSON lines of ``{"kind": ..., "doc": ...}``, datetimes as ISO strings."""
+    src = backend(src_name)
+    ckpt = ckpt or Checkpoint(None)
+    stats = Stats()
+    # Appending on resume may repeat the last unsaved batch; imports upsert, so that is harmless
+    with open(out, "a" if ckpt.state else "w", encoding="utf-8") as f:
+        for kind, docs, last in _batches(src, kinds, batch, ckpt):
+            rows = _normalized(kind, docs, False, stats)
+            f.writelines(json.dumps({"kind": kind, "doc": r}, ensure_ascii=False) + "\n" for r in rows)
+            f.flush()
+            ckpt.save(kind, last)
+            stats.add(kind, len(rows))
+    return stats
+
+
+def import_(dst_name: str, path: str, batch: int = BATCH, ckpt: Optional[Checkpoint] = None) -> Stats:
+    """Load a file written by ``export`` into ``dst_name``."""
+    dst = backend(dst_name)
+    native = dst_name == "mongo"
+    ckpt = ckpt or Checkpoint(None)
+    stats = Stats()
+    skip = ckpt.get("line", 0)
+    pending: Dict[str, List[Dict[str, Any]]] = {}
+    line_no = 0
+
+    def flush() -> None:
+        for kind, docs in pending.items():
+            rows = _normalized(kind, docs, native, stats)
+            dst.bulk_put(kind, rows)
+            stats.add(kind, len(rows))
+        pending.clear()
+        ckpt.save("line", line_no)
+
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if line_no <= skip or not line.strip():
+                continue
+            entry = json.loads(line)
+            pending.setdefault(entry["kind"], []).append(entry["doc"])
+            if line_no % batch == 0:
+                flush()
+    flush()
+    return stats
+
+
+# ---- iCalendar (RFC 5545) ----
+ALL_DAY_AT = (9, 0)  # local time for reminders imported from all-day events
+_PENDING = ("scheduled", "sending", "blocked")
+_FREQS = {"HOURLY": "hourly", "DAILY": "daily", "WEEKLY": "weekly"}
+_ICS_DAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+_ESCAPES = {"\\": "\\\\", ";": "\\;", ",": "\\,", "\n": "\\n"}
+# Our own UIDs name the reminder and its chat, so a re-import updates it in place
+_OWN_UID = re.compile(r"(?P<id>[^.@]+)\.(?P<chat>-?\d+)@gretchen")
+
+
+def _escape(text: str) -> str:
+    return "".join(_ESCAPES.get(ch, ch) for ch in text)
+
+
+def _unescape(text: str) -> str:
+    return re.sub(r"\\(.)", lambda m: "\n" if m.group(1) in "nN" else m.group(1), text)
+
+
+def _fold(line: str) -> str:
+    # Content lines are at most 75 octets; continuations start with a space
+    parts, chunk, size, limit = [], "", 0, 75
+    for ch in line:
+        n = len(ch.encode("utf-8"))
+        if size + n > limit:
+            parts.append(chunk)
+            chunk, size, limit = "", 0, 74
+        chunk += ch
+        size += n
+    parts.append(chunk)
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def _ics_stamp(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def _vevent(rem: Reminder, stamp: str) -> List[str]:
+    lines = ["BEGIN:VEVENT", f"UID:{rem.id}.{rem.chat_id}@gretchen", f"DTSTAMP:{stamp}"]
+    rule = rem.recurrence
+    if rule:
+        # Local wall time, so daily/weekly events keep their hour across DST
+        lines.append(f"DTSTART;TZID={rem.timezone}:{rem.local_due.strftime('%Y%m%dT%H%M%S')}")
+        if "cron" in rule:
+            # No general RRULE equivalent; kept so a re-import restores the schedule
+            lines.append(f"X-GRETCHEN-CRON:{rule['cron']}")
+        else:
+            lines.append(f"RRULE:FREQ={rule['freq'].upper()};INTERVAL={int(rule.get('interval', 1))}")
+    else:
+        lines.append(f"DTSTART:{_ics_stamp(rem.due)}")
+    lines += [
+        f"SUMMARY:{_escape(rem.text)}",
+        "BEGIN:VALARM", "ACTION:DISPLAY", "TRIGGER:PT0S", f"DESCRIPTION:{_escape(rem.text)}", "END:VALARM",
+        "END:VEVENT",
+    ]
+    return lines
+
+
+def _chat_reminders(src, chat_id: Optional[int], batch: int) -> Iterator[List[Reminder]]:
+    if chat_id is not None:
+        cursor = None
+        while True:
+            page, cursor = src.list_reminders_for_chat(chat_id, status=_PENDING, cursor=cursor, limit=batch)
+            yield page
+            if cursor is None:
+                return
+    for docs in src.scan("reminders", batch=batch):
+        yield [Reminder.from_doc(d) for d in docs if d.get("status") in _PENDING]
+
+
+def ics_export(src_name: str, out: str, chat_id: Optional[int] = None, batch: int = BATCH) -> Stats:
+    """Write pending reminders (of one chat, or all) as an iCalendar file."""
+    src = backend(src_name)
+    stats = Stats()
+    stamp = _ics_stamp(datetime.now(timezone.utc))
+    with open(out, "w", encoding="utf-8", newline="") as f:
+        f.writelines(_fold(l) for l in ("BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//gretchen//reminders//EN"))
+        for page in _chat_reminders(src, chat_id, batch):
+            f.writelines(_fold(l) for rem in page for l in _vevent(rem, stamp))
+            stats.add("events", len(page))
+        f.write(_fold("END:VCALENDAR"))
+    return stats
+
+
+def _unfolded(f: TextIO) -> Iterator[str]:
+    line = None
+    for raw in f:
+        raw = raw.rstrip("\r\n")
+        if raw[:1] in (" ", "\t") and line is not None:
+            line += raw[1:]
+            continue
+        if line is not None:
+            yield line
+        line = raw
+    if line is not None:
+        yield line
+
+
+def _property(line: str) -> Tuple[str, Dict[str, str], str]:
+    """``NAME;PARAM=V;...:value`` -> (NAME, params, value); ':' may appear in quoted params."""
+    quoted = False
+    for i, ch in enumerate(line):
+        if ch == '"':
+            quoted = not quoted
+        elif ch == ":" and not quoted:
+            head, value = line[:i], line[i + 1:]
+            break
+    else:
+        return line.upper(), {}, ""
+    name, *params = head.split(";")
+    parsed = {}
+    for p in params:
+        k, _, v = p.partition("=")
+        parsed[k.upper()] = v.strip('"')
+    return name.upper(), parsed, value
+
+
+def _ics_time(value: str, params: Dict[str, str], tz_name: str) -> Tuple[datetime, str]:
+    """(aware DTSTART, the zone its wall time is in); UTC times keep the chat's zone."""
+    tz = tz_name
+    if "TZID" in params:
+        try:
+            ZoneInfo(params["TZID"])
+            tz = params["TZID"]
+        except (KeyError, ValueError):
+            pass  # e.g. Windows zone names; the chat's zone is the best guess
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        d = date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+        return datetime(d.year, d.month, d.day, *ALL_DAY_AT, tzinfo=ZoneInfo(tz)), tz
+    wall = datetime.strptime(value.rstrip("Z")[:15], "%Y%m%dT%H%M%S")
+    if value.endswith("Z"):
+        return wall.replace(tzinfo=timezone.utc), tz_name
+    return wall.replace(tzinfo=ZoneInfo(tz)), tz
+
+
+def _ics_rule(rrule: str, start: datetime) -> Optional[Dict[str, Any]]:
+    """Our recurrence rule for an RRULE, or None when it has no equivalent.
+
+    Rules that end (COUNT/UNTIL) or pick days we cannot express are not
+    mapped; the event then becomes a one-off reminder.
+    """
+    parts = dict(p.partition("=")[::2] for p in rrule.upper().split(";") if p)
+    if "COUNT" in parts or "UNTIL" in parts:
+        return None
+    freq = parts.get("FREQ")
+    interval = int(parts.get("INTERVAL", "1"))
+    days = [d[-2:] for d in parts["BYDAY"].split(",")] if "BYDAY" in parts else []
+    by = {k for k in parts if k.startswith("BY")} - {"BYDAY"}
+    at = f"{start.hour:02d}:{start.minute:02d}"
+    if freq in _FREQS and not by and (not days or (freq == "WEEKLY" and days == [_ICS_DAYS[start.weekday()]])):
+        rule: Dict[str, Any] = {"freq": _FREQS[freq], "interval": interval}
+        if freq != "HOURLY":
+            rule["at"] = at
+        return rule
+    if interval != 1 or any(d not in _ICS_DAYS for d in days):
+        return None
+    cron_days = ",".join(str((_ICS_DAYS.index(d) + 1) % 7) for d in days)
+    if freq in ("DAILY", "WEEKLY") and days and not by:
+        return {"cron": f"{start.minute} {start.hour} * * {cron_days}"}
+    if freq == "MONTHLY" and not days and by <= {"BYMONTHDAY"}:
+        return {"cron": f"{start.minute} {start.hour} {parts.get('BYMONTHDAY', start.day)} * *"}
+    if freq == "YEARLY" and not days and not by:
+        return {"cron": f"{start.minute} {start.hour} {start.day} {start.month} *"}
+    return None
+
+
+def _ics_id(event: Dict[str, Tuple[Dict[str, str], str]], chat_id: int, dtstart: str) -> str:
+    uid = event.get("UID", ({}, f"{dtstart}/{event.get('SUMMARY', ({}, ''))[1]}"))[1]
+    own = _OWN_UID.fullmatch(uid)
+    if own and int(own.group("chat")) == chat_id:
+        return own.group("id")
+    # Stable per chat and UID, so importing the calendar again updates in place.
+    # Reminder ids are global, so another chat's export never reuses its ids.
+    return hashlib.sha1(f"{chat_id}:{uid}".encode()).hexdigest()[:8]
+
+
+def _ics_reminder(event: Dict[str, Tuple[Dict[str, str], str]], chat_id: int, tz_name: str, now: datetime, stats: Stats) -> Optional[Reminder]:
+    if "DTSTART" not in event or event.get("STATUS", ({}, ""))[1].upper() == "CANCELLED":
+        stats.add("skipped")
+        return None
+    params, value = event["DTSTART"]
+    start, tz = _ics_time(value, params, tz_name)
+    local = start.astimezone(ZoneInfo(tz))
+    rule = None
+    if "X-GRETCHEN-CRON" in event:
+        rule = {"cron": event["X-GRETCHEN-CRON"][1]}
+        parse_cron(rule["cron"])  # a bad expression must not reach delivery
+    elif "RRULE" in event:
+        rule = _ics_rule(event["RRULE"][1], local)
+        if rule is None:
+            stats.add("rrule_unsupported")
+    due = start
+    if rule and due <= now:
+        due = next_occurrence(rule, local, tz, now)
+    elif due <= now:
+        stats.add("past")
+        return None
+    text = _unescape((event.get("SUMMARY") or event.get("DESCRIPTION") or ({}, ""))[1]).strip()
+    return Reminder(
+        id=_ics_id(event, chat_id, value),
+        chat_id=chat_id, text=text or "(untitled event)", due=due, timezone=tz, recurrence=rule,
+    )
+
+
+def ics_import(dst_name: str, path: str, chat_id: int, tz_name: Optional[str] = None, batch: int = BATCH, ckpt: Optional[Checkpoint] = None) -> Stats:
+    """Turn the upcoming events of an iCalendar file into reminders for ``chat_id``.
+
+    Times without a zone are read in ``tz_name``, else the chat's timezone.
+    Past one-off events are skipped; recurring ones start at their next occurrence.
+    """
+    dst = backend(dst_name)
+    tz_name = tz_name or dst.get_user_timezone(chat_id) or DEFAULT_TZ
+    native = dst_name == "mongo"
+    ckpt = ckpt or Checkpoint(None)
+    now = datetime.now(timezone.utc)
+    stats = Stats()
+    skip = ckpt.get("event", 0)
+    rows: List[Dict[str, Any]] = []
+    seen = 0
+    event: Optional[Dict[str, Tuple[Dict[str, str], str]]] = None
+    depth = 0  # nested components (VALARM) inside the event are ignored
+
+    with open(path, encoding="utf-8") as f:
+        for line in _unfolded(f):
+            name, params, value = _property(line)
+            if name == "BEGIN":
+                if value.upper() == "VEVENT":
+                    event, depth = {}, 0
+                elif event is not None:
+                    depth += 1
+            elif name == "END" and event is not None:
+                if value.upper() != "VEVENT":
+                    depth -= 1
+                    continue
+                seen += 1
+                if seen > skip:
+                    try:
+                        rem = _ics_reminder(event, chat_id, tz_name, now, stats)
+                    except (ValueError, KeyError, IndexError) as e:
+                        # One malformed event must not cost the rest of the file
+                        print(f"[transfer] skipped event {seen}: {e}", file=sys.stderr)
+                        stats.add("invalid")
+                        rem = None
+                    if rem is not None:
+                        rows.append(rem.to_doc(native))
+                if len(rows) >= batch:
+                    dst.bulk_put("reminders", rows)
+                    stats.add("reminders", len(rows))
+                    rows = []
+                    ckpt.save("event", seen)
+                event = None
+            elif event is not None and depth == 0:
+                event.setdefault(name, (params, value))
+    dst.bulk_put("reminders", rows)
+    stats.add("reminders", len(rows))
+    ckpt.save("event", seen)
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Bulk copy, export and import of gretchen data.")
+    ap.add_argument("--batch", type=int, default=BATCH)
+    ap.add_argument("--checkpoint", help="progress file; an interrupted run resumes from it")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    backends = list(_BACKENDS)
+    p = sub.add_parser("copy", help="copy users and reminders between backends")
+    p.add_argument("--from", dest="src", choices=backends, required=True)
+    p.add_argument("--to", dest="dst", choices=backends, required=True)
+    p.add_argument("--kinds", default=",".join(KINDS))
+    p = sub.add_parser("export", help="write a JSON lines dump")
+    p.add_argument("--from", dest="src", choices=backends, required=True)
+    p.add_argument("--kinds", default=",".join(KINDS))
+    p.add_argument("path")
+    p = sub.add_parser("import", help="load a JSON lines dump")
+    p.add_argument("--to", dest="dst", choices=backends, required=True)
+    p.add_argument("path")
+    p = sub.add_parser("ics-export", help="write pending reminders as an .ics calendar")
+    p.add_argument("--from", dest="src", choices=backends, required=True)
+    p.add_argument("--chat", type=int)
+    p.add_argument("path")
+    p = sub.add_parser("ics-import", help="schedule a chat's reminders from an .ics calendar")
+    p.add_argument("--to", dest="dst", choices=backends, required=True)
+    p.add_argument("--chat", type=int, required=True)
+    p.add_argument("--tz", help="zone for times without one (default: the chat's)")
+    p.add_argument("path")
+    args = ap.parse_args(argv)
+
+    ckpt = Checkpoint(args.checkpoint)
+    if args.cmd == "copy":
+        if args.src == args.dst:
+            ap.error("--from and --to must differ")
+        stats = copy(args.src, args.dst, args.kinds.split(","), args.batch, ckpt)
+    elif args.cmd == "export":
+        stats = export(args.src, args.path, args.kinds.split(","), args.batch, ckpt)
+    elif args.cmd == "import":
+        stats = import_(args.dst, args.path, args.batch, ckpt)
+    elif args.cmd == "ics-export":
+        stats = ics_export(args.src, args.path, args.chat, args.batch)
+    else:
+        stats = ics_import(args.dst, args.path, args.chat, args.tz, args.batch, ckpt)
+    print(f"[transfer] {args.cmd}: {stats}")
+
+
+if __name__ == "__main__":
+    main()
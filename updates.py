@@ -0,0 +1,70 @@
+from __future__ import annotations
+import asyncio
+import os
+from typing import Any, Awaitable, Dict, Hashable, List, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+# Handlers run up to BOT_CONCURRENCY at a time; 1 keeps PTB's sequential
+# processing. At most BOT_MAX_PENDING_UPDATES are admitted (running or waiting
+# for their chat); later updates wait in arrival order until one finishes.
+CONCURRENCY = int(os.getenv("BOT_CONCURRENCY", "8"))
+MAX_PENDING = int(os.getenv("BOT_MAX_PENDING_UPDATES", "256"))
+
+
+def _order_key(update: object) -> Optional[Hashable]:
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return ("user", update.effective_user.id)
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates from different chats concurrently, each chat's strictly in order.
+
+    PTB admits updates through its own semaphore, in arrival order, up to
+    ``max_pending``; that bounds how much work is in flight. Each admitted
+    update then queues on its chat's lock and only takes one of ``workers``
+    slots once it is at the head of that queue, so a chat sending a burst
+    cannot tie up the workers other chats need. Updates without a chat or
+    user (e.g. poll updates) are not ordered.
+    """
+
+    def __init__(self, workers: int = CONCURRENCY, max_pending: int = MAX_PENDING) -> None:
+        super().__init__(max(workers, max_pending))
+        self.workers = workers
+        self._worker_slots = asyncio.Semaphore(workers)
+        # chat -> [lock, number of updates holding or waiting for it]
+        self._chats: Dict[Hashable, List[Any]] = {}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = _order_key(update)
+        metrics.queue_depth.inc(queue="updates")
+        try:
+            if key is None:
+                async with self._worker_slots:
+                    await coroutine
+                return
+            entry = self._chats.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0], self._worker_slots:
+                    await coroutine
+            finally:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._chats[key]
+        finally:
+            metrics.queue_depth.dec(queue="updates")
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
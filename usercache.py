@@ -0,0 +1,62 @@
+from __future__ import annotations
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+
+
+class UserCache:
+    """Bounded LRU+TTL cache of per-user timezone in front of a storage backend.
+
+    Writes go through ``set_timezone`` so the cache is updated together with
+    storage. The TTL bounds staleness for changes made by other processes.
+    """
+
+    def __init__(
+        self,
+        get_timezone: Callable[[int], Awaitable[Optional[str]]],
+        upsert_timezone: Callable[[int, str], Awaitable[None]],
+        default_tz: str,
+        maxsize: int = CACHE_SIZE,
+        ttl: float = CACHE_TTL,
+    ) -> None:
+        self._get = get_timezone
+        self._upsert = upsert_timezone
+        self.default_tz = default_tz
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Tuple[float, str, ZoneInfo]]" = OrderedDict()
+
+    async def _lookup(self, chat_id: int) -> Tuple[str, ZoneInfo]:
+        entry = self._entries.get(chat_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(chat_id)
+            return entry[1], entry[2]
+        tz = await self._get(chat_id) or self.default_tz
+        return self._store(chat_id, tz)
+
+    def _store(self, chat_id: int, tz: str) -> Tuple[str, ZoneInfo]:
+        zone = ZoneInfo(tz)
+        self._entries[chat_id] = (time.monotonic() + self.ttl, tz, zone)
+        self._entries.move_to_end(chat_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return tz, zone
+
+    async def timezone(self, chat_id: int) -> str:
+        """The user's IANA timezone name, or the default."""
+        return (await self._lookup(chat_id))[0]
+
+    async def zone(self, chat_id: int) -> ZoneInfo:
+        return (await self._lookup(chat_id))[1]
+
+    async def set_timezone(self, chat_id: int, tz: str) -> None:
+        await self._upsert(chat_id, tz)
+        self._store(chat_id, tz)
+
+    def invalidate(self, chat_id: int) -> None:
+        self._entries.pop(chat_id, None)